@@ -0,0 +1,22 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import aio  # noqa: E402
+
+
+def main():
+    """
+    Opens `--concurrency` connections to the baseline server at once, each requesting
+    every size in `--sizes`, and prints per-size latency statistics.
+    """
+    parser = argparse.ArgumentParser(description='Asyncio baseline client')
+    aio.add_client_arguments(parser, '0.0.0.0', 5000)
+    aio.run_clients_main(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
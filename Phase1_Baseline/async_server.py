@@ -0,0 +1,23 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import aio  # noqa: E402
+from server import encode_response  # noqa: E402
+
+
+def main():
+    """
+    Runs the baseline server on asyncio so a single process can hold hundreds of
+    concurrent connections. Data generation runs in a thread pool executor.
+    """
+    parser = argparse.ArgumentParser(description='Asyncio baseline data server')
+    aio.add_server_arguments(parser, '0.0.0.0', 5000, executor='thread')
+    aio.run_server(parser.parse_args(), encode_response)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,23 @@
-import socket
+import argparse
+import os
+import sys
 import time
 
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import (codec_registry, datasets, framing, integrity,  # noqa: E402
+                    ranged, socket_tuning, striping, timing)
+
+# Largest single read from the socket; payloads are received straight into a
+# buffer sized from the frame header, so large reads just mean fewer system calls.
+READ_SIZE = 4 * 1024 * 1024
+
 
 def connect_to_server(host, port):
     """
-    Establishes a TCP connection to a specified server using a socket.
+    Establishes a TCP connection to a specified server using a socket tuned
+    with the active socket_tuning profile.
 
     Parameters:
     - host (str): The hostname or IP address of the server to connect to.
@@ -13,42 +26,73 @@ def connect_to_server(host, port):
     Returns:
     - socket.socket: A socket object that is connected to the server.
     """
-    # Create a TCP/IP socket
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # Connect the socket to the server's address
-    client_socket.connect((host, port))
-    return client_socket
+    # Buffers are tuned before the handshake, the per-connection flags after it
+    return socket_tuning.connect(host, port)
 
 
-def request_and_receive_data(client_socket, data_size):
+def request_and_receive_data(client_socket, data_size, buffer=None, read_size=READ_SIZE,
+                             verifier=None, **options):
     """
-    Requests a specific amount of data from a server and receives it in chunks.
+    Requests a specific amount of data from a server and receives the framed response.
+
+    The connection stays open afterwards so it can carry the next request.
 
     Parameters:
     - client_socket (socket.socket): The client socket that is connected to the server.
     - data_size (int): The size of the data to request from the server in megabytes.
+    - buffer (framing.ReceiveBuffer): Optional buffer reused across requests, so no
+      memory is allocated inside the timed section once it has grown.
+    - read_size (int): Largest single read from the socket, in bytes.
+    - verifier (integrity.BlockVerifier): Optional. The request then asks for
+      block digests and the data is checked against them; an uncompressed
+      payload is hashed while it arrives.
+    - **options: Extra request fields, e.g. `source='file'` or `codec='zlib'`.
 
     Returns:
     - tuple: A tuple containing:
-        - bytearray: The received data as a bytearray.
+        - bytearray or memoryview: The received data; a view on `buffer` if given.
+          Encoded responses are decoded, outside the timed section.
         - float: The total time elapsed during the data reception in seconds.
+
+    Raises:
+    - integrity.IntegrityError: If the data does not match the digests.
     """
+    if verifier is not None:
+        options['verify'] = True
+
+    def on_header(header):
+        span.mark('first_byte_received')
+        if verifier is not None:
+            verifier.expect(header)
+
     # Send data request to server
-    client_socket.sendall(str(data_size).encode('utf-8'))
+    span, options = timing.client_span(data_size, options)
+    framing.send_request(client_socket, data_size, **options)
+    span.mark('request_sent')
+    socket_tuning.rearm(client_socket)
 
     # Start the timer
     start_time = time.time()
 
-    received_data = bytearray()
-    while True:
-        # Receive data in chunks
-        chunk = client_socket.recv(4096)
-        if not chunk:
-            break
-        received_data.extend(chunk)
+    # Receive the header and exactly the number of payload bytes it announces
+    header, received_data = framing.recv_frame(
+        client_socket, read_size, buffer, on_header=on_header,
+        on_data=verifier.wire if verifier is not None else None)
 
     # Stop the timer
     end_time = time.time()
+    span.mark('last_byte_received')
+
+    # Verify outside the timed section so it does not skew the measurement
+    with span.stage('verify'):
+        framing.verify_checksum(header, received_data)
+    if header.codec_id != framing.CODEC_RAW:
+        with span.stage('decode'):
+            received_data = codec_registry.decode(header, received_data)
+    if verifier is not None:
+        verifier.check(header, received_data)
+    span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                compressed_length=header.compressed_length, flags=header.flags)
 
     # Calculate the elapsed time
     elapsed_time = end_time - start_time
@@ -60,23 +104,74 @@ def main():
     Main execution function for the client script. Connects to a server, requests, and receives data in predefined sizes.
 
     Steps:
-    - Establishes a connection to the server.
+    - Establishes a single persistent connection to the server.
     - Iterates through a list of data sizes, requests data for each size, and measures the time taken to receive the data.
     - Displays the requested size, received data length, and the time taken for each transaction.
 
     Uses:
     - Useful for testing the latency and effectiveness of data transmission over a network.
     """
-    server_host = '0.0.0.0'
-    server_port = 5000
-
-    client_socket = connect_to_server(server_host, server_port)
+    parser = argparse.ArgumentParser(description='Baseline client')
+    parser.add_argument('--host', default='0.0.0.0', help='Server address')
+    parser.add_argument('--port', type=int, default=5000, help='Server port')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100],
+                        help='Data sizes to request, in MB')
+    parser.add_argument('--source', choices=('memory', 'file'), default='memory',
+                        help='Generate each payload or serve it from a file with sendfile')
+    datasets.add_client_arguments(parser)
+    codec_registry.add_client_arguments(parser, default='raw')
+    striping.add_client_arguments(parser)
+    ranged.add_client_arguments(parser)
+    integrity.add_client_arguments(parser)
+    socket_tuning.add_arguments(parser)
+    timing.add_arguments(parser)
+    args = parser.parse_args()
+    if args.output and args.stripes > 1:
+        parser.error('--output cannot be combined with --stripes')
+    if args.trace:
+        timing.configure(args.trace)
+    socket_tuning.configure_from_arguments(args)
+    options = {'source': args.source, 'dataset': args.dataset, 'seed': args.seed,
+               **codec_registry.client_options(args)}
+    if args.verify:
+        options['verify'] = True
+
+    if args.output:
+        for data_size in args.sizes:
+            path = ranged.output_path(args.output, data_size, args.sizes)
+            download = ranged.ResumableDownload(args.host, args.port, data_size, path,
+                                                piece_size=args.piece_size)
+            try:
+                elapsed_time = download.run(**options)
+            except (framing.FrameError, OSError, ValueError) as e:
+                print(f"Failed to receive {data_size}MB of data: {e} ({download.describe()})")
+                continue
+            print(f"Requested {data_size}MB: {download.describe(elapsed_time)}")
+        return
+
+    options.update(ranged.client_options(args))
+    if args.stripes > 1:
+        with striping.StripedClient(args.host, args.port, args.stripes) as client:
+            for data_size in args.sizes:
+                received_data, elapsed_time, stripes = client.fetch(data_size, **options)
+                print(f"Requested {data_size}MB: Received {len(received_data) / (1024 * 1024)}MB "
+                      f"in {elapsed_time} seconds ({striping.describe(data_size, elapsed_time, stripes)})")
+        return
+
+    # Allocated once for the largest response and reused by every request
+    buffer = framing.ReceiveBuffer(max(args.sizes) * 1024 * 1024)
+
+    client_socket = connect_to_server(args.host, args.port)
     try:
-        for data_size in [1, 10, 100]:  # Data sizes in MB
+        for data_size in args.sizes:  # Data sizes in MB
+            verifier = integrity.BlockVerifier() if args.verify else None
             received_data, elapsed_time = request_and_receive_data(
-                client_socket, data_size)
-            print(
-                f"Requested {data_size}MB: Received {len(received_data) / (1024 * 1024)}MB in {elapsed_time} seconds")
+                client_socket, data_size, buffer, verifier=verifier, **options)
+            summary = (f"Requested {data_size}MB: Received {len(received_data) / (1024 * 1024)}MB "
+                       f"in {elapsed_time} seconds")
+            if verifier is not None:
+                summary += f" ({verifier.describe()})"
+            print(summary)
     finally:
         client_socket.close()
 
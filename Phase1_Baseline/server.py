@@ -1,38 +1,87 @@
-import socket
-import time
+import argparse
 import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import (adaptive, codec_registry, datasets, integrity,  # noqa: E402
+                    payload_cache, payload_store, server_core, socket_tuning, timing)
 
 # Function to generate a data packet of a specific size
 
 
-def generate_data(size_in_mb):
+def generate_data(size_in_mb, dataset=datasets.DEFAULT_DATASET, seed=0, offset=0, length=None):
     """
-    Generates a binary string of random bytes approximately equal to the specified size in megabytes.
+    Generates data of the specified size in megabytes.
 
     Parameters:
     - size_in_mb (int): The size of the data to generate in megabytes.
+    - dataset (str): One of datasets.DATASETS; 'random' gives uniform bytes.
+    - seed (int): The dataset seed.
+    - offset (int): First byte to generate, for a byte range of the data.
+    - length (int): Number of bytes to generate; the rest of the data by default.
 
     Returns:
-    - bytes: A bytes object containing random data of the specified size.
+    - bytes-like: The generated data.
     """
-    return os.urandom(size_in_mb * 1024 * 1024)
+    if length is None:
+        length = size_in_mb * 1024 * 1024 - offset
+    return datasets.generate_range(dataset, seed, offset, length)
 
-# Function to send data packets
+# Function to build the response for one request
 
 
-def send_data(client_socket, data_size):
+def encode_response(request):
     """
-    Sends a specified amount of data to the connected client socket.
+    Generates the data for one request. The baseline sends it unencoded unless
+    the request names a codec (`"codec"`, see common/codec_registry.py).
+
+    With `"source": "file"` the data comes from a payload file created once and
+    sent with sendfile, so neither the RNG nor a fresh allocation is measured.
 
     Parameters:
-    - client_socket (socket.socket): The client socket to send data to.
-    - data_size (int): The size of the data to send in megabytes.
+    - request (dict): The decoded request; `size_mb` is the size of the data in
+      megabytes and the optional `dataset` and `seed` select the data. With
+      `offset` and `length` only that byte range of the data is sent, as one
+      stripe of a striped transfer. With `"verify": true` the block digests of
+      the data are sent after it.
+
+    Returns:
+    - tuple: (codec id, raw length, payload, block digests or None) ready to be
+      sent as one frame.
 
-    Side Effects:
-    - Sends data through the socket.
+    Raises:
+    - ValueError: If the requested size, range, source, dataset, codec or verify
+      flag is invalid.
     """
-    data = generate_data(data_size)
-    client_socket.sendall(data)
+    data_size = server_core.request_size_mb(request)
+    offset, length = server_core.request_range(request, data_size)
+    dataset, seed = datasets.request_dataset(request)
+    codec, params = codec_registry.request_codec(request, default='raw')
+    if server_core.is_ranged(request):
+        print(f"Requested bytes {offset}+{length} of {data_size}MB of {dataset} ({codec.name})")
+    else:
+        print(f"Requested data size: {data_size}MB of {dataset} ({codec.name})")
+    if payload_store.request_source(request) == 'file':
+        if not server_core.is_ranged(request):
+            with timing.stage('load'):
+                payload = codec_registry.file_payload(codec, params, data_size, dataset, seed)
+            if payload is not None:
+                print(f"Serving {payload.path} ({payload_store.describe_peak_rss()})")
+                raw = payload_store.get_store().raw(data_size, dataset, seed)
+                digests = integrity.digest_file(request, raw.path, raw.offset, raw.length)
+                return codec.codec_id, data_size * 1024 * 1024, payload, digests
+        with timing.stage('load'):
+            raw = payload_store.get_store().raw(data_size, dataset, seed)
+            data = payload_store.read_range(raw, offset, length)
+    else:
+        with timing.stage('generate'):
+            data = generate_data(data_size, dataset, seed, offset, length)
+    digests = integrity.digest(request, data)
+    with timing.stage('encode'):
+        payload = codec.encode(data, **params)
+    return codec.codec_id, len(data), payload, digests
 
 
 def main():
@@ -41,47 +90,42 @@ def main():
 
     Process:
     - Sets up the server socket and listens on a specific port.
-    - Accepts connections and handles incoming data size requests from clients.
-    - Sends the requested amount of data and closes the connection after serving.
+    - Accepts connections and serves them concurrently using the selected execution
+      mode (`--mode serial|thread|process`, `--workers N`). Threads suit the
+      I/O-bound baseline, so thread mode is the default.
+    - Sends the requested amount of data for every request on the connection and
+      closes it once the client disconnects.
 
     Note:
     - The server runs indefinitely and can be stopped with a KeyboardInterrupt.
     """
-    host = '0.0.0.0'
-    port = 5000
-
-    # Create a TCP/IP socket
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-    # Bind the socket to the port
-    server_socket.bind((host, port))
-    print(f"Server is running on port {port}")
-
-    # Listen for incoming connections
-    server_socket.listen(5)
+    parser = argparse.ArgumentParser(description='Baseline data server')
+    server_core.add_server_arguments(parser, '0.0.0.0', 5000, mode='thread')
+    args = parser.parse_args()
+    if args.payload_dir:
+        payload_store.configure(args.payload_dir)
+    datasets.configure_from_arguments(args, pooled=args.mode == 'process')
+    if args.trace:
+        timing.configure(args.trace)
+    socket_tuning.configure_from_arguments(args)
+
+    server = server_core.ServerCore(args.host, args.port, encode_response,
+                                    mode=args.mode, workers=args.workers,
+                                    cache=payload_cache.from_arguments(args),
+                                    selector=adaptive.from_arguments(args))
+    print(f"Server is running on port {args.port} "
+          f"({server.mode} mode, {server.workers} workers)")
 
     try:
-        while True:
-            # Wait for a connection
-            print('waiting for a connection')
-            connection, client_address = server_socket.accept()
-            print('connection from', client_address)
-
-            try:
-                # Receive the message from the client
-                message = connection.recv(16).decode('utf-8')
-                # Assuming the client sends the size as a string
-                data_size = int(message)
-                print(f"Requested data size: {data_size}MB")
-
-                # Send the data
-                send_data(connection, data_size)
-            finally:
-                # Clean up the connection
-                connection.close()
+        server.serve_forever()
     except KeyboardInterrupt:
         print("Server is shutting down.")
-        server_socket.close()
+    finally:
+        server.shutdown()
+        if server.cache is not None:
+            print(f"Payload cache: {server.cache.stats}")
+        if server.selector is not None:
+            print(f"Adaptive selection: {server.selector}")
 
 
 if __name__ == '__main__':
@@ -4,8 +4,17 @@ import logging
 import lz4.frame
 import time
 import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import framing, socket_tuning  # noqa: E402
 
 RECV_BUFFER_SIZE = 10 * 1024 * 1024  # 10 MB receive buffer
+READ_SIZE = 4 * 1024 * 1024  # Largest single read from the socket
+# The receive buffer is set before connecting, so the window scale covers it
+SOCKET_PROFILE = socket_tuning.SocketProfile(rcvbuf=RECV_BUFFER_SIZE)
 
 # Creates a 'logs' directory in the current working directory
 log_dir = os.path.join(os.getcwd(), 'logs')
@@ -20,14 +29,11 @@ logging.basicConfig(filename=client_log_file, level=logging.INFO,
 def connect_to_server(host, port):
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        client_socket.setsockopt(
-            socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+        SOCKET_PROFILE.apply_before_connect(client_socket)
         # Set a timeout of 30 seconds for all socket operations
         client_socket.settimeout(30)
         client_socket.connect((host, port))
-        # Optionally, receive an initial server acknowledgment if expected
-        client_socket.recv(1024)
+        SOCKET_PROFILE.apply_connected(client_socket)
         return client_socket
     except socket.error as e:
         logging.error(f"Socket error during connection: {e}")
@@ -35,17 +41,17 @@ def connect_to_server(host, port):
         return None
 
 
-def receive_and_decompress_data(client_socket):
-    compressed_data = bytearray()
-    chunk_size = 65536  # 64 KB
+def receive_and_decompress_data(client_socket, buffer=None):
     try:
-        while True:
-            chunk = client_socket.recv(chunk_size)
-            if not chunk:
-                break
-            compressed_data.extend(chunk)
+        # The header announces the payload length, so it is received straight
+        # into one buffer (reused across requests) with large reads
+        header = framing.recv_header(client_socket)
+        compressed_data = framing.recv_payload(client_socket, header, READ_SIZE, buffer)
+        if header.is_error:
+            raise framing.ServerError(
+                f"Server error: {bytes(compressed_data).decode('utf-8', 'replace')}")
+        framing.verify_checksum(header, compressed_data)
         data = lz4.frame.decompress(compressed_data)
-        client_socket.sendall(b'ack')
         return data
     except Exception as e:
         print(f"Reception error: {e}")
@@ -60,16 +66,16 @@ def main():
     try:
         client_socket = connect_to_server(server_host, server_port)
         if client_socket:
+            buffer = framing.ReceiveBuffer()
             with client_socket:
                 for data_size in [1, 10, 100]:
                     logging.info(
                         f"Requesting {data_size}MB of data from the server.")
                     print(
                         f"Requesting {data_size}MB of data from the server.")
-                    data_size_str = str(data_size).encode('utf-8')
-                    client_socket.sendall(data_size_str)
+                    framing.send_request(client_socket, data_size)
                     start_time = time.time()
-                    data = receive_and_decompress_data(client_socket)
+                    data = receive_and_decompress_data(client_socket, buffer)
                     elapsed_time = time.time() - start_time
                     if data is not None:
                         throughput = data_size / elapsed_time
@@ -2,10 +2,17 @@
 import socket
 import logging
 import os
+import sys
 import lz4.frame
-import time
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import datasets, framing, socket_tuning  # noqa: E402
 
 SEND_BUFFER_SIZE = 10 * 1024 * 1024  # 10 MB send buffer
+# Set on the listening socket before listen(), so every accepted socket inherits it
+SOCKET_PROFILE = socket_tuning.SocketProfile(sndbuf=SEND_BUFFER_SIZE)
 
 # Creates a 'logs' directory in the current working directory
 log_dir = os.path.join(os.getcwd(), 'logs')
@@ -18,7 +25,7 @@ logging.basicConfig(filename=server_log_file, level=logging.INFO,
 
 
 def generate_data(size_in_mb):
-    return os.urandom(size_in_mb * 1024 * 1024)
+    return datasets.generate('random', size_in_mb * 1024 * 1024)
 
 
 def compress_data(data):
@@ -35,16 +42,9 @@ def send_data(client_socket, data_size):
             f"Sending {len(compressed_data)} bytes of compressed data.")
         print(
             f"Sending {len(compressed_data)} bytes of compressed data.")
-        client_socket.sendall(compressed_data)
-        # Check if the connection is still open
-        try:
-            client_socket.send(b' ')  # Send a single byte
-        except socket.error as e:
-            logging.error(f"Connection closed unexpectedly: {e}")
-            return
-        client_socket.settimeout(120)  # Set a timeout of 120 seconds
-        client_socket.recv(1024)  # Wait for acknowledgment
-        time.sleep(1)
+        # The frame header carries the payload length, so the client knows where
+        # the response ends without an acknowledgment round trip
+        framing.send_frame(client_socket, framing.CODEC_LZ4, len(data), compressed_data)
     except socket.error as e:
         logging.error(f"Error sending data: {e}")
         print(f"Error sending data: {e}")
@@ -58,10 +58,9 @@ def main():
     print(f"Server is running and listening on {host}:{port}")
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+        SOCKET_PROFILE.apply_listener(server_socket)
         server_socket.bind((host, port))
         server_socket.listen(5)
-        server_socket.setsockopt(
-            socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
         logging.info(f"Server listening on {host}:{port}")
         print(f"Server listening on {host}:{port}")
 
@@ -69,14 +68,23 @@ def main():
             while True:
                 connection, client_address = server_socket.accept()
                 with connection:
-                    connection.setsockopt(
-                        socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    SOCKET_PROFILE.apply_connected(connection)
                     logging.info(f"Connected by {client_address}")
                     print(f"Connected by {client_address}")
                     try:
-                        message = connection.recv(4).decode('utf-8').strip()
-                        data_size = int(message) 
-                        send_data(connection, data_size)
+                        # Serve requests until the client closes the connection
+                        while True:
+                            # A framed request, so sizes of any number of digits arrive whole
+                            request = framing.recv_request(connection)
+                            if request is None:
+                                break
+                            try:
+                                data_size = int(request['size_mb'])
+                            except (TypeError, ValueError):
+                                framing.send_error(
+                                    connection, f"Invalid data size {request['size_mb']!r}")
+                                continue
+                            send_data(connection, data_size)
                     except Exception as e:
                         logging.exception(
                             f"An error occurred with {client_address}: {e}")
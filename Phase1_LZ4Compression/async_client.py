@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import aio, codec_registry  # noqa: E402
+
+
+def decompress_data(header, compressed_data):
+    """
+    Decompresses one response with the codec named in its header; runs in the
+    event loop's executor.
+    """
+    return codec_registry.decode(header, compressed_data)
+
+
+def main():
+    """
+    Opens `--concurrency` connections to the LZ4 server at once, each requesting
+    every size in `--sizes`, and prints per-size latency statistics including decompression.
+    """
+    parser = argparse.ArgumentParser(description='Asyncio LZ4 client')
+    aio.add_client_arguments(parser, '0.0.0.0', 5000, codec='lz4')
+    aio.run_clients_main(parser.parse_args(), decompress_data)
+
+
+if __name__ == '__main__':
+    main()
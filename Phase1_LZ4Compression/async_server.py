@@ -0,0 +1,25 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import aio  # noqa: E402
+from server import encode_response, stream_encode_response  # noqa: E402
+
+
+def main():
+    """
+    Runs the LZ4 server on asyncio so a single process can hold hundreds of
+    concurrent connections. Compression is CPU-bound, so it runs in a process pool;
+    streamed requests are compressed block by block in the loop's thread pool.
+    """
+    parser = argparse.ArgumentParser(description='Asyncio LZ4 compressed data server')
+    aio.add_server_arguments(parser, '172.17.0.2', 5000, executor='process')
+    aio.run_server(parser.parse_args(), encode_response,
+                   stream_encode=stream_encode_response)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,15 @@
-import socket
+import argparse
+import os
+import sys
 import time
-import json
-import lz4.frame
 import logging
 
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import (codec_registry, datasets, framing, integrity,  # noqa: E402
+                    ranged, socket_tuning, striping, timing)
+
 # Configure logging
 logging.basicConfig(filename='client.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
@@ -11,67 +17,282 @@ logging.basicConfig(filename='client.log', level=logging.INFO,
 
 def connect_to_server(host, port):
     """
-    Establishes a TCP connection to a specified server using a socket.
+    Establishes a TCP connection to a specified server using a socket tuned
+    with the active socket_tuning profile.
     """
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client_socket.connect((host, port))
-    return client_socket
+    return socket_tuning.connect(host, port)
 
 
-def receive_and_decompress_data(client_socket):
+def receive_and_decompress_data(client_socket, buffer=None,
+                                read_size=framing.RECV_CHUNK_SIZE, span=None, verifier=None):
     """
-    Receives compressed data from the server and decompresses it using LZ4 compression.
+    Receives one framed response from the server and decompresses it with the
+    codec named in its header (LZ4 unless another codec was requested).
+
+    The compressed payload is received straight into `buffer` (a
+    framing.ReceiveBuffer reused across requests) when one is given. The
+    receive events and the decode stage are recorded on `span` (a timing.Span).
+    With a `verifier` (an integrity.BlockVerifier, for requests sent with
+    `verify`) the decompressed data is checked against the server's block
+    digests; a mismatch is logged and counts as a failure.
     """
-    compressed_data = bytearray()
+    span = span or timing.Span('client')
+
+    def on_header(header):
+        span.mark('first_byte_received')
+        if verifier is not None:
+            verifier.expect(header)
+
     try:
-        while True:
-            chunk = client_socket.recv(4096)
-            if not chunk:
-                break  # End of data
-            compressed_data.extend(chunk)
+        header, compressed_data = framing.recv_frame(
+            client_socket, read_size, buffer, on_header=on_header,
+            on_data=verifier.wire if verifier is not None else None)
+        span.mark('last_byte_received')
+        framing.verify_checksum(header, compressed_data)
+        logging.info(f"Received {header.codec_name} payload of {header.compressed_length} bytes"
+                     f"{' (selected adaptively)' if header.is_adaptive else ''}")
 
-        # Try to decompress after the loop ensures all data is received
+        # Try to decompress once the whole frame has been received
         try:
-            data = lz4.frame.decompress(compressed_data)
-            # Send acknowledgment after successful decompression
-            client_socket.sendall(b'ack')
-            return data
-        except RuntimeError as e:
+            with span.stage('decode'):
+                data = codec_registry.decode(header, compressed_data)
+        except (RuntimeError, ValueError, OSError, EOFError) as e:
             logging.error(f"Decompression error: {e}")
             logging.error(f"Received data size: {len(compressed_data)} bytes")
             return None
+        if len(data) != header.raw_length:
+            logging.error(
+                f"Decompressed {len(data)} bytes, expected {header.raw_length}")
+            return None
+        if verifier is not None:
+            verifier.check(header, data)
+        span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                    compressed_length=header.compressed_length, flags=header.flags)
+        return data
 
-    except Exception as e:
+    except (framing.FrameError, OSError) as e:
         logging.error(f"Error in reception: {e}")
         return None
 
 
+def receive_and_decompress_stream(client_socket, sink=None,
+                                  read_size=framing.RECV_CHUNK_SIZE,
+                                  block_size=1024 * 1024, span=None, verifier=None):
+    """
+    Receives a streamed response and decompresses each chunk as soon as it arrives.
+
+    Only the current chunk and the decompressor's window are held in memory; the
+    decompressed blocks are handed to `sink` instead of being accumulated. The
+    stream may hold one compressed stream or, in pipelined mode, one per block;
+    the codec comes from the header.
+
+    Parameters:
+    - client_socket (socket.socket): The connected socket to read from.
+    - sink (callable): Optional function called with every decompressed block.
+    - read_size (int): Largest single read from the socket, in bytes. Every chunk
+      is received into the same reused buffer.
+    - block_size (int): The block size of the request, needed by block-wise codecs.
+    - span (timing.Span): Optional span the receive events and decode stage go to.
+    - verifier (integrity.BlockVerifier): Optional, for requests sent with
+      `verify`; every decompressed block is hashed as soon as it is produced and
+      the stream is checked against the server's block digests at the end.
+
+    Returns:
+    - tuple: (total decompressed bytes, time.time() when the first decompressed
+      byte was available), or None on failure, including a digest mismatch.
+    """
+    span = span or timing.Span('client')
+    try:
+        header = framing.recv_header(client_socket)
+        span.mark('first_byte_received')
+        if header.is_error or not header.is_stream:
+            # The server did not stream (or failed); fall back to the whole-frame path
+            payload = framing.recv_payload(client_socket, header, read_size)
+            span.mark('last_byte_received')
+            if header.is_error:
+                logging.error(
+                    f"Server error: {bytes(payload).decode('utf-8', 'replace')}")
+                return None
+            framing.verify_checksum(header, payload)
+            with span.stage('decode'):
+                data = codec_registry.decode(header, payload)
+            if verifier is not None:
+                verifier.check(header, data)
+            if sink is not None:
+                sink(data)
+            span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                        compressed_length=header.compressed_length, flags=header.flags)
+            return len(data), time.time()
+
+        decompressor = codec_registry.by_id(header.codec_id).decompressor(
+            header.raw_length, block_size)
+        total_length = 0
+        first_byte_time = None
+        for chunk in framing.iter_stream(client_socket, header, read_size,
+                                         reuse_buffer=True):
+            with span.stage('decode'):
+                block = decompressor.decompress(chunk)
+            size = len(block)
+            if size and first_byte_time is None:
+                first_byte_time = time.time()
+            total_length += size
+            if verifier is not None and size:
+                verifier.update(block)
+            if sink is not None and size:
+                sink(block)
+        span.mark('last_byte_received')
+        if total_length != header.raw_length:
+            logging.error(
+                f"Decompressed {total_length} bytes, expected {header.raw_length}")
+            return None
+        if verifier is not None:
+            verifier.check(header)
+        span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                    compressed_length=header.compressed_length, flags=header.flags)
+        return total_length, first_byte_time or time.time()
+
+    except (framing.FrameError, RuntimeError, ValueError, OSError, EOFError) as e:
+        logging.error(f"Error in stream reception: {e}")
+        return None
+
+
 def main():
     """
     Main execution function for the client.
+
+    With `--stream` the server compresses and sends `--block-size` blocks as it goes
+    and the client decompresses them as they arrive, reporting time-to-first-byte.
+    Adding `--depth N` (and `--workers W`) pipelines compression on the server.
+    `--codec` asks for another codec than LZ4, e.g. `--codec zlib --codec-level 9`.
     """
-    server_host = '0.0.0.0'
-    server_port = 5000
+    parser = argparse.ArgumentParser(description='LZ4 client')
+    parser.add_argument('--host', default='0.0.0.0', help='Server address')
+    parser.add_argument('--port', type=int, default=5000, help='Server port')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100],
+                        help='Data sizes to request, in MB')
+    parser.add_argument('--stream', action='store_true',
+                        help='Use the streaming block-by-block mode')
+    parser.add_argument('--block-size', type=int, default=1024 * 1024,
+                        help='Block size in bytes for streaming mode')
+    parser.add_argument('--depth', type=int, default=None,
+                        help='Pipeline the stream with this many blocks in flight')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Server worker threads for the pipeline')
+    parser.add_argument('--read-size', type=int, default=framing.RECV_CHUNK_SIZE,
+                        help='Largest single socket read in bytes')
+    parser.add_argument('--source', choices=('memory', 'file'), default='memory',
+                        help='Compress each payload or serve a pre-compressed file with sendfile')
+    datasets.add_client_arguments(parser)
+    codec_registry.add_client_arguments(parser, default='lz4')
+    striping.add_client_arguments(parser)
+    ranged.add_client_arguments(parser)
+    integrity.add_client_arguments(parser)
+    socket_tuning.add_arguments(parser)
+    timing.add_arguments(parser)
+    args = parser.parse_args()
+    if args.stream and args.stripes > 1:
+        parser.error('--stripes cannot be combined with --stream')
+    if ranged.is_ranged(args) and (args.stream or args.stripes > 1):
+        parser.error('--offset, --length and --output cannot be combined with '
+                     '--stream or --stripes')
+    if args.trace:
+        timing.configure(args.trace)
+    socket_tuning.configure_from_arguments(args)
+
+    data_options = {'dataset': args.dataset, 'seed': args.seed,
+                    **codec_registry.client_options(args)}
+    if args.verify:
+        data_options['verify'] = True
+    stream_options = {'stream': True, 'block_size': args.block_size, **data_options}
+    if args.depth is not None:
+        stream_options['depth'] = args.depth
+        if args.workers is not None:
+            stream_options['workers'] = args.workers
+
+    if args.output:
+        for data_size in args.sizes:
+            path = ranged.output_path(args.output, data_size, args.sizes)
+            download = ranged.ResumableDownload(args.host, args.port, data_size, path,
+                                                args.piece_size, read_size=args.read_size)
+            logging.info(f"Downloading {data_size}MB of data into {path}.")
+            try:
+                elapsed_time = download.run(source=args.source, **data_options)
+            except (framing.FrameError, OSError, ValueError) as e:
+                logging.error(f"Download of {data_size}MB failed: {e}")
+                print(f"Failed to receive {data_size}MB of data ({download.describe()}).")
+                continue
+            print(f"Data Size: {data_size}MB, {download.describe(elapsed_time)}")
+        return
+    data_options.update(ranged.client_options(args))
+
+    if args.stripes > 1:
+        with striping.StripedClient(args.host, args.port, args.stripes,
+                                    args.read_size) as client:
+            for data_size in args.sizes:
+                logging.info(f"Requesting {data_size}MB of data in {args.stripes} stripes.")
+                _, elapsed_time, stripes = client.fetch(data_size, source=args.source,
+                                                        **data_options)
+                logging.info(striping.describe(data_size, elapsed_time, stripes))
+                print(f"Data Size: {data_size}MB, Time: {elapsed_time:.2f}s, "
+                      f"Throughput: {data_size / elapsed_time:.2f}MB/s, "
+                      f"Stripes: {len(stripes)}")
+        return
+
+    # Reused by every non-streamed request, so receiving allocates nothing once warm
+    buffer = framing.ReceiveBuffer()
 
-    with connect_to_server(server_host, server_port) as client_socket:
-        for data_size in [1, 10, 100]:  # Data sizes in MB
+    with connect_to_server(args.host, args.port) as client_socket:
+        for data_size in args.sizes:  # Data sizes in MB
             logging.info(f"Requesting {data_size}MB of data from the server.")
 
             # Send request
-            client_socket.sendall(str(data_size).encode('utf-8'))
+            if args.stream:
+                span, options = timing.client_span(data_size, stream_options)
+            else:
+                span, options = timing.client_span(data_size,
+                                                   {'source': args.source, **data_options})
+            framing.send_request(client_socket, data_size, **options)
+            span.mark('request_sent')
+            socket_tuning.rearm(client_socket)
 
             # Receive and decompress data
             start_time = time.time()
-            data = receive_and_decompress_data(client_socket)
+            ttfb = None
+            verifier = None
+            if args.verify:
+                verifier = integrity.BlockVerifier(
+                    args.block_size if args.stream else framing.DIGEST_BLOCK_SIZE)
+            if args.stream:
+                result = receive_and_decompress_stream(client_socket,
+                                                       read_size=args.read_size,
+                                                       block_size=args.block_size,
+                                                       span=span, verifier=verifier)
+                data = result
+                if result is not None:
+                    ttfb = result[1] - start_time
+            else:
+                data = receive_and_decompress_data(client_socket, buffer, args.read_size,
+                                                   span, verifier)
             elapsed_time = time.time() - start_time
-            throughput = data_size / elapsed_time
+            if data is None:
+                print(f"Failed to receive {data_size}MB of data.")
+                continue
+            # A slice is only part of the object; streams are never ranged
+            received_size = data_size if args.stream else len(data) / (1024 * 1024)
+            throughput = received_size / elapsed_time
 
             logging.info(
-                f"Received {data_size}MB of data in {elapsed_time:.2f} seconds with throughput of {throughput:.2f}MB/s")
+                f"Received {received_size}MB of data in {elapsed_time:.2f} seconds with throughput of {throughput:.2f}MB/s")
 
             # Output the result to the console
-            print(
-                f"Data Size: {data_size}MB, Time: {elapsed_time:.2f}s, Throughput: {throughput:.2f}MB/s")
+            summary = f"Data Size: {data_size}MB, Time: {elapsed_time:.2f}s, Throughput: {throughput:.2f}MB/s"
+            if ttfb is not None:
+                summary += f", TTFB: {ttfb * 1000:.1f}ms"
+            if ranged.is_ranged(args):
+                summary += f", Range: {len(data)} bytes from {args.offset or 0}"
+            if verifier is not None:
+                summary += f", {verifier.describe()}"
+            print(summary)
 
 
 if __name__ == '__main__':
@@ -1,67 +1,199 @@
-import time
-import socket
+import argparse
+import functools
 import os
-import lz4.frame
+import sys
 import logging
 
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import (adaptive, codec_registry, datasets, integrity,  # noqa: E402
+                    payload_cache, payload_store, pipeline, server_core, socket_tuning,
+                    timing)
+
 # Set up logging
 logging.basicConfig(filename='server.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
+# Default size of the blocks generated and compressed in streaming mode
+STREAM_BLOCK_SIZE = 1024 * 1024
 
-def generate_data(size_in_mb):
+
+def generate_data(size_in_mb, dataset=datasets.DEFAULT_DATASET, seed=0, offset=0, length=None):
     """
-    Generates a binary string of random bytes approximately equal to the specified size in megabytes.
+    Generates data of the specified size in megabytes.
 
     Parameters:
     - size_in_mb (int): The size of the data to generate in megabytes.
+    - dataset (str): One of datasets.DATASETS; 'random' gives uniform bytes.
+    - seed (int): The dataset seed.
+    - offset (int): First byte to generate, for a byte range of the data.
+    - length (int): Number of bytes to generate; the rest of the data by default.
 
     Returns:
-    - bytes: A bytes object containing random data of the specified size.
+    - bytes-like: The generated data.
     """
-    return os.urandom(size_in_mb * 1024 * 1024)
+    if length is None:
+        length = size_in_mb * 1024 * 1024 - offset
+    return datasets.generate_range(dataset, seed, offset, length)
 
 
-def compress_data(data):
+def generate_blocks(size_in_mb, block_size, dataset=datasets.DEFAULT_DATASET, seed=0):
     """
-    Compresses data using LZ4 compression algorithm.
+    Generates data of the specified size one block at a time.
 
     Parameters:
-    - data (bytes): The data to compress.
+    - size_in_mb (int): The total size of the data to generate in megabytes.
+    - block_size (int): The size of each block in bytes.
+    - dataset (str): One of datasets.DATASETS.
+    - seed (int): The dataset seed.
+
+    Yields:
+    - bytes-like: The blocks; the last one may be shorter.
+    """
+    total_size = size_in_mb * 1024 * 1024
+    for offset in range(0, total_size, block_size):
+        yield datasets.generate_range(dataset, seed, offset,
+                                      min(block_size, total_size - offset))
+
+
+def generate_block(index, size, block_size=STREAM_BLOCK_SIZE,
+                   dataset=datasets.DEFAULT_DATASET, seed=0):
+    """
+    Generates one block of data for the pipelined mode.
+
+    Parameters:
+    - index (int): Position of the block in the payload.
+    - size (int): The size of the block in bytes.
+    - block_size (int): The size of every block but the last, to locate this one.
+    - dataset (str): One of datasets.DATASETS.
+    - seed (int): The dataset seed.
 
     Returns:
-    - bytes: The compressed data.
+    - bytes-like: The block's data.
     """
-    return lz4.frame.compress(data)
+    return datasets.generate_range(dataset, seed, index * block_size, size)
 
 
-def send_data(client_socket, data_size):
+def stream_encode_response(request):
     """
-    Generates data of the specified size, compresses it, and sends it to the client.
+    Streams the response when the request asks for it (`"stream": true`).
+
+    Blocks of `block_size` bytes (default STREAM_BLOCK_SIZE) are generated and
+    compressed lazily while earlier blocks are already on the wire, so the client
+    sees the first byte after one block instead of after the whole payload.
+
+    If the request also sets `depth` (and optionally `workers`), blocks are
+    generated and compressed on a pool of worker threads up to `depth` blocks ahead
+    of the sender. Each block is then compressed on its own (one LZ4 frame per
+    block), since one compressor context cannot be shared between threads;
+    per-stage timings are logged.
 
     Parameters:
-    - client_socket (socket.socket): The client socket to send data to.
-    - data_size (int): The size of the data to generate and send in megabytes.
+    - request (dict): The decoded request; `codec` selects any streamable codec
+      of the registry (default 'lz4'). With `"verify": true` every raw block is
+      digested as it is generated.
+
+    File-backed requests (`"source": "file"`), byte ranges and codecs that cannot
+    stream are never streamed: they take the whole-frame path.
+
+    Returns:
+    - tuple: (codec id, raw length, iterator of compressed chunks, block digests
+      or None), or None if the request is not a streaming request.
 
-    Side Effects:
-    - Sends compressed data through the socket.
+    Raises:
+    - ValueError: If the requested size, block size, dataset, codec or verify
+      flag is invalid.
     """
-    try:
-        logging.info(f"Generating {data_size}MB of data.")
-        data = generate_data(data_size)
-        compressed_data = compress_data(data)
+    if (not request.get('stream') or payload_store.request_source(request) == 'file'
+            or server_core.is_ranged(request)):
+        return None
+    codec, params = codec_registry.request_codec(request, default='lz4')
+    if not codec.streamable:
+        return None
+    data_size = server_core.request_size_mb(request)
+    block_size = server_core.request_block_size(request, STREAM_BLOCK_SIZE)
+    dataset, seed = datasets.request_dataset(request)
+    raw_length = data_size * 1024 * 1024
+    digests = integrity.stream_digests(request, raw_length, block_size)
+    options = pipeline.request_pipeline_options(request)
+    if options is not None:
+        depth, workers = options
         logging.info(
-            f"Sending {len(compressed_data)} bytes of compressed data.")
-        client_socket.sendall(compressed_data)
-        # Wait for the client to confirm data reception
-        # Assuming the client sends back a simple "ack"
-        client_socket.recv(1024)
-        # Wait for a second before considering closing the connection (for testing)
-        time.sleep(1)
-    except socket.error as e:
-        logging.error(f"Error sending data: {e}")
-    finally:
-        logging.info("Completed sending data.")
+            f"Pipelining {data_size}MB of data in {block_size} byte blocks "
+            f"with {codec.name} (depth {depth}, {workers} workers).")
+        produce = functools.partial(generate_block, block_size=block_size,
+                                    dataset=dataset, seed=seed)
+        return (codec.codec_id, raw_length,
+                pipeline.pipeline(pipeline.block_sizes(raw_length, block_size),
+                                  integrity.digesting(produce, digests),
+                                  functools.partial(codec.encode_block, **params),
+                                  depth, workers),
+                digests)
+    logging.info(
+        f"Streaming {data_size}MB of data in {block_size} byte blocks with {codec.name}.")
+    blocks = generate_blocks(data_size, block_size, dataset, seed)
+    return (codec.codec_id, raw_length,
+            codec_registry.compress_blocks(codec, params,
+                                           integrity.digest_blocks(blocks, digests)),
+            digests)
+
+
+def encode_response(request):
+    """
+    Generates data of the requested size and compresses it.
+
+    The frame header carries the compressed length, so the client knows where the
+    payload ends without an acknowledgment round trip or closing the connection.
+    Runs inside a worker process in process mode, so it must stay a module-level function.
+
+    Parameters:
+    - request (dict): The decoded request; `size_mb` is the size of the data in
+      megabytes and the optional `dataset` and `seed` select the data. `codec`
+      selects any codec of the registry (default 'lz4') and its parameters,
+      e.g. `level`. With `offset` and `length` only that byte range of the data
+      is compressed and sent, as one stripe of a striped transfer. With
+      `"verify": true` the block digests of the raw data are sent after it.
+
+    With `"source": "file"` the payload is a pre-compressed file, created once from
+    a raw payload file and sent with sendfile, so compression and allocation are
+    not part of the measurement.
+
+    Returns:
+    - tuple: (codec id, raw length, compressed payload, block digests or None)
+      ready to be sent as one frame.
+
+    Raises:
+    - ValueError: If the requested size, range, source, dataset, codec or verify
+      flag is invalid.
+    """
+    data_size = server_core.request_size_mb(request)
+    offset, length = server_core.request_range(request, data_size)
+    dataset, seed = datasets.request_dataset(request)
+    codec, params = codec_registry.request_codec(request, default='lz4')
+    if payload_store.request_source(request) == 'file':
+        if not server_core.is_ranged(request):
+            with timing.stage('load'):
+                payload = codec_registry.file_payload(codec, params, data_size, dataset, seed)
+            if payload is not None:
+                logging.info(f"Sending {payload.length} bytes from {payload.path} "
+                             f"({payload_store.describe_peak_rss()}).")
+                raw = payload_store.get_store().raw(data_size, dataset, seed)
+                digests = integrity.digest_file(request, raw.path, raw.offset, raw.length)
+                return codec.codec_id, data_size * 1024 * 1024, payload, digests
+        with timing.stage('load'):
+            raw = payload_store.get_store().raw(data_size, dataset, seed)
+            data = payload_store.read_range(raw, offset, length)
+    else:
+        logging.info(f"Generating {length} bytes at {offset} of {data_size}MB of {dataset} data.")
+        with timing.stage('generate'):
+            data = generate_data(data_size, dataset, seed, offset, length)
+    digests = integrity.digest(request, data)
+    with timing.stage('encode'):
+        compressed_data = codec.encode(data, **params)
+    logging.info(
+        f"Sending {memoryview(compressed_data).nbytes} bytes of {codec.name} compressed data.")
+    return codec.codec_id, len(data), compressed_data, digests
 
 
 def main():
@@ -71,29 +203,39 @@ def main():
     Process:
     - Sets up the server socket and listens on a specific port.
     - Accepts connections, receives data size requests from clients, generates the requested size of data, compresses it, and sends the compressed data back to the client.
+    - Keeps each connection open until the client disconnects so it can serve any number of requests.
+    - Serves connections concurrently; compression is CPU-bound, so the default
+      process mode runs it in a pool of `--workers` processes.
+    - Requests with `"stream": true` are generated, compressed and sent block by block.
     """
-    host = '172.17.0.2'
-    port = 5000
-    print(f"Server is running and listening on port {port}")
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.bind((host, port))
-        server_socket.listen(5)
-        logging.info(f"Server listening on port {port}")
-
-        while True:
-            connection, client_address = server_socket.accept()
-            with connection:
-                logging.info(f"Connected by {client_address}")
-                try:
-                    message = connection.recv(16).decode('utf-8')
-                    data_size = int(message)
-                    send_data(connection, data_size)
-                except Exception as e:
-                    logging.exception(
-                        f"An error occurred with {client_address}: {e}")
-                finally:
-                    connection.close()
+    parser = argparse.ArgumentParser(description='LZ4 compressed data server')
+    server_core.add_server_arguments(parser, '172.17.0.2', 5000, mode='process')
+    args = parser.parse_args()
+    if args.payload_dir:
+        payload_store.configure(args.payload_dir)
+    datasets.configure_from_arguments(args, pooled=args.mode == 'process')
+    if args.trace:
+        timing.configure(args.trace)
+    socket_tuning.configure_from_arguments(args)
+
+    server = server_core.ServerCore(args.host, args.port, encode_response,
+                                    mode=args.mode, workers=args.workers,
+                                    stream_encode=stream_encode_response,
+                                    cache=payload_cache.from_arguments(args),
+                                    selector=adaptive.from_arguments(args))
+    print(f"Server is running and listening on port {args.port}")
+    logging.info(f"Server listening on port {args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Server shutdown requested by user.")
+    finally:
+        server.shutdown()
+        if server.cache is not None:
+            print(f"Payload cache: {server.cache.stats}")
+        if server.selector is not None:
+            print(f"Adaptive selection: {server.selector}")
 
 
 if __name__ == '__main__':
@@ -1,10 +1,19 @@
 
+import os
+import pickle
 import socket
+import sys
 import time
 import pywt
-import numpy as np
 import logging
 
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import framing  # noqa: E402
+
+READ_SIZE = 4 * 1024 * 1024  # Largest single read from the socket
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -30,7 +39,7 @@ def connect_to_server(host, port):
         logging.error(f'Failed to connect to server at {host}:{port}, error: {e}')
         raise
 
-def request_and_receive_data(client_socket, data_size):
+def request_and_receive_data(client_socket, data_size, buffer=None):
     """
     Sends a data size request to the server, receives compressed data, 
     decompresses it using wavelet transforms, and measures the time taken.
@@ -38,19 +47,28 @@ def request_and_receive_data(client_socket, data_size):
     Parameters:
     - client_socket (socket.socket): The client socket to use for communication.
     - data_size (int): The size of the data requested from the server.
+    - buffer (framing.ReceiveBuffer): Optional buffer the payload is received into.
 
     Returns:
     - np.array: Decompressed data as a numpy array.
     """
     try:
         # Send data request to the server
-        client_socket.sendall(str(data_size).encode())
-        # Receive the data from the server
-        received_data = client_socket.recv(1024)  # Adjust the buffer size if necessary
-        logging.info(f'Received data of size: {len(received_data)}')
+        framing.send_request(client_socket, data_size)
+        # Receive the whole frame; its header gives the payload length, so it is
+        # read straight into one buffer instead of a single fixed-size recv
+        start_time = time.time()
+        header = framing.recv_header(client_socket)
+        received_data = framing.recv_payload(client_socket, header, READ_SIZE, buffer)
+        elapsed_time = time.time() - start_time
+        if header.is_error:
+            raise framing.ServerError(
+                f"Server error: {bytes(received_data).decode('utf-8', 'replace')}")
+        framing.verify_checksum(header, received_data)
+        logging.info(f'Received data of size: {len(received_data)} in {elapsed_time:.4f} sec')
 
-        # Decompress data using wavelet transform
-        coeffs = pywt.wavedec(np.frombuffer(received_data, dtype=np.uint8), 'haar')
+        # Deserialize the coefficients and reconstruct the signal
+        coeffs = pickle.loads(received_data)
         decompressed_data = pywt.waverec(coeffs, 'haar')
 
         return decompressed_data
@@ -5,6 +5,12 @@ import time
 import os
 import logging
 import pickle  # Using pickle for serialization of complex objects
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import datasets, framing  # noqa: E402
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,7 +25,7 @@ def generate_data(size_in_mb):
     Returns:
     - bytes: A bytes object containing random data of the specified size.
     """
-    return os.urandom(size_in_mb * 1024 * 1024)
+    return datasets.generate('random', size_in_mb * 1024 * 1024)
 
 def send_data(client_socket, data_size):
     """
@@ -33,7 +39,8 @@ def send_data(client_socket, data_size):
     Process:
     - The data is first converted to a numpy array.
     - A wavelet decomposition is performed on the array.
-    - The wavelet coefficients are serialized using pickle and sent over the socket.
+    - The wavelet coefficients are serialized using pickle and sent over the socket
+      in one frame, so the client knows the payload length up front.
 
     Side Effects:
     - Sends data through a network socket.
@@ -46,7 +53,7 @@ def send_data(client_socket, data_size):
         # Serialize wavelet coefficients using pickle
         serialized_data = pickle.dumps(coeffs)
         # Send data to client
-        client_socket.sendall(serialized_data)
+        framing.send_frame(client_socket, framing.CODEC_FWT_PICKLE, len(data), serialized_data)
         logging.info(f'Sent data of size: {len(serialized_data)} bytes')
     except Exception as e:
         logging.error(f'Error in generating or sending data: {e}')
@@ -70,7 +77,18 @@ def main():
             client_socket, addr = server_socket.accept()
             logging.info(f'Connection from {addr}')
             try:
-                send_data(client_socket, 5)  # Sending 5MB of data; adjust as needed
+                # Read the requested size so the request is not left unread when the
+                # connection closes, which would reset it before the client is done
+                request = framing.recv_request(client_socket)
+                try:
+                    # 5MB unless the client asks otherwise
+                    data_size = int(request['size_mb']) if request is not None else 5
+                except (TypeError, ValueError):
+                    framing.send_error(client_socket, f"Invalid data size {request['size_mb']!r}")
+                else:
+                    send_data(client_socket, data_size)
+            except framing.FrameError as e:
+                logging.error(f'Malformed request from {addr}: {e}')
             finally:
                 client_socket.close()
                 logging.info('Client connection closed')
@@ -1,17 +1,24 @@
 import socket
+import sys
 import time
 import pywt
-import numpy as np
 import logging
-import pickle
 import os
 
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import framing, socket_tuning, wavelet_container  # noqa: E402
+
 # Creates a 'logs' directory in the current working directory
 log_dir = os.path.join(os.getcwd(), 'logs')
 os.makedirs(log_dir, exist_ok=True)  # Create the directory if it doesn't exist
 
 client_log_file = os.path.join(log_dir, 'client.log')
 
+# The receive buffer is set once, before connecting, so the window scale covers it
+SOCKET_PROFILE = socket_tuning.SocketProfile(rcvbuf=1024 * 1024)
+
 # Set up logging
 logging.basicConfig(filename=client_log_file, level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
@@ -31,11 +38,12 @@ def connect_to_server(host, port):
     try:
         # Create a TCP/IP socket
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        SOCKET_PROFILE.apply_before_connect(client_socket)
         # Set a timeout of 60 seconds for all socket operations
         client_socket.settimeout(60)
         # Connect the socket to the server's address
         client_socket.connect((host, port))
+        SOCKET_PROFILE.apply_connected(client_socket)
         print(f'Connected to server at {host}:{port}')
         logging.info(f'Connected to server at {host}:{port}')
         return client_socket
@@ -62,23 +70,23 @@ def request_and_receive_data(client_socket, data_size):
         print(f"Requesting {data_size} MB of data from the server.")
         logging.info(f"Requesting {data_size} MB of data from the server.")
         # Send data request to the server
-        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)  # Set receive buffer to 1 MB
-        client_socket.sendall(str(data_size).encode())
-        # Receive the data from the server
-        received_data = b''
-        while True:
-            # Adjust the buffer size if necessary
-            chunk = client_socket.recv(1024)
-            if not chunk:
-                break
-            received_data += chunk
+        framing.send_request(client_socket, data_size)
+        # The frame header announces the payload size, so the receive buffer is
+        # allocated once and filled in place
+        header = framing.recv_header(client_socket)
+        received_data = bytearray(header.compressed_length)
+        framing.recv_exact_into(client_socket, received_data)
+        if header.is_error:
+            raise framing.FrameError(
+                f"Server error: {received_data.decode('utf-8', 'replace')}")
+        framing.verify_checksum(header, received_data)
         print(f"Received data of size: {len(received_data)} bytes")
         logging.info(f'Received data of size: {len(received_data)} bytes')
 
-        # Deserialize wavelet coefficients using pickle
-        coeffs = pickle.loads(received_data)
+        # Decode the wavelet container as views on the receive buffer
+        wavelet, coeffs = wavelet_container.decode(received_data)
         # Decompress data using wavelet transform
-        decompressed_data = pywt.waverec(coeffs, 'haar')
+        decompressed_data = pywt.waverec(coeffs, wavelet)[:header.raw_length]
 
         return decompressed_data
     except socket.timeout as e:
@@ -1,10 +1,14 @@
 import pywt
 import numpy as np
 import socket
-import time
 import os
+import sys
 import logging
-import pickle  # Using pickle for serialization of complex objects
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import datasets, framing, socket_tuning, wavelet_container  # noqa: E402
 
 # Creates a 'logs' directory in the current working directory
 log_dir = os.path.join(os.getcwd(), 'logs')
@@ -27,13 +31,13 @@ def generate_data(size_in_mb):
     Returns:
     - bytes: A bytes object containing random data of the specified size.
     """
-    return os.urandom(size_in_mb * 1024 * 1024)
+    return datasets.generate('random', size_in_mb * 1024 * 1024)
 
 
 def send_data(client_socket, data_size):
     """
     Generates data, compresses it using Fast Wavelet Transform (FWT),
-    and sends the compressed data to the client using serialization.
+    and sends the coefficients to the client in a binary wavelet container.
 
     Parameters:
     - client_socket (socket.socket): The client socket to send data to.
@@ -42,7 +46,9 @@ def send_data(client_socket, data_size):
     Process:
     - The data is first converted to a numpy array.
     - A wavelet decomposition is performed on the array.
-    - The wavelet coefficients are serialized using pickle and sent over the socket.
+    - The container header (level count, dtype, per-band lengths) and the raw
+      coefficient arrays are sent with one scatter-gather call, without pickling
+      or copying the bands into a single buffer.
 
     Side Effects:
     - Sends data through a network socket.
@@ -54,18 +60,14 @@ def send_data(client_socket, data_size):
         data = generate_data(data_size)
         # Convert to numpy array and perform wavelet transform
         coeffs = pywt.wavedec(np.frombuffer(data, dtype=np.uint8), 'haar')
-        # Serialize wavelet coefficients using pickle
-        serialized_data = pickle.dumps(coeffs)
-        print(f"Sending {len(serialized_data)} bytes of compressed data.")
+        # Describe the bands in a container header; the arrays are sent as they are
+        parts = wavelet_container.encode_parts(coeffs, 'haar')
+        print(f"Sending {wavelet_container.encoded_size(parts)} bytes of compressed data.")
         logging.info(
-            f"Sending {len(serialized_data)} bytes of compressed data.")
+            f"Sending {wavelet_container.encoded_size(parts)} bytes of compressed data.")
         # Send data to client
-        total_sent = 0
-        while total_sent < len(serialized_data):
-            sent = client_socket.send(serialized_data[total_sent:])
-            if sent == 0:
-                raise RuntimeError("Socket connection broken")
-            total_sent += sent
+        framing.send_frame_parts(client_socket, framing.CODEC_FWT_CONTAINER,
+                                 len(data), parts)
         print("Completed sending data.")
         logging.info("Completed sending data.")
     except Exception as e:
@@ -78,7 +80,8 @@ def main():
 
     # Create a TCP/IP socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    profile = socket_tuning.SocketProfile()
+    profile.apply_listener(server_socket)
     # Bind the socket to the server address
     try:
         server_socket.bind((host, port))
@@ -90,15 +93,25 @@ def main():
             # Wait for a connection
             logging.info('Waiting for a connection')
             client_socket, addr = server_socket.accept()
+            # TCP_NODELAY belongs on the connected socket, not the listening one
+            profile.apply_connected(client_socket)
             logging.info(f'Connection from {addr}')
             print(f'Connection from {addr}')
             try:
-                # Receive data size request from the client
-                data_size_str = client_socket.recv(1024).decode()
-                data_size = int(data_size_str)
-                # Send the requested data size
-                send_data(client_socket, data_size)
-            except socket.error as e:
+                # Serve framed requests until the client disconnects
+                while True:
+                    request = framing.recv_request(client_socket)
+                    if request is None:
+                        break
+                    try:
+                        data_size = int(request['size_mb'])
+                    except (TypeError, ValueError):
+                        framing.send_error(
+                            client_socket, f"Invalid data size {request['size_mb']!r}")
+                        continue
+                    # Send the requested data size
+                    send_data(client_socket, data_size)
+            except (socket.error, framing.FrameError) as e:
                 logging.error(f'Socket error occurred: {e}')
             finally:
                 client_socket.close()
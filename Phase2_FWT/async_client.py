@@ -0,0 +1,27 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import aio, parallel_wavelet  # noqa: E402
+from client import decompress_data  # noqa: E402
+
+
+def main():
+    """
+    Opens `--concurrency` connections to the FWT server at once, each requesting
+    every size in `--sizes`, and prints per-size latency statistics including the
+    wavelet reconstruction.
+    """
+    parser = argparse.ArgumentParser(description='Asyncio FWT client')
+    aio.add_client_arguments(parser, '0.0.0.0', 5000, codec='fwt-haar')
+    parallel_wavelet.add_arguments(parser)
+    args = parser.parse_args()
+    parallel_wavelet.configure_from_arguments(args)
+    aio.run_clients_main(args, decompress_data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import aio, parallel_wavelet  # noqa: E402
+from server import encode_response, stream_encode_response  # noqa: E402
+
+
+def main():
+    """
+    Runs the FWT server on asyncio so a single process can hold hundreds of
+    concurrent connections. The wavelet decomposition runs in a process pool.
+    """
+    parser = argparse.ArgumentParser(description='Asyncio FWT compressed data server')
+    aio.add_server_arguments(parser, '0.0.0.0', 5000, executor='process')
+    parallel_wavelet.add_arguments(parser)
+    args = parser.parse_args()
+    parallel_wavelet.configure_from_arguments(args, pooled=args.executor == 'process')
+    aio.run_server(args, encode_response,
+                   stream_encode=stream_encode_response)
+
+
+if __name__ == '__main__':
+    main()
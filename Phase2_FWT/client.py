@@ -1,12 +1,23 @@
-import socket
+import argparse
+import os
+import sys
 import time
-import pywt
 import numpy as np
 
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import (codec_registry, datasets, framing, integrity,  # noqa: E402
+                    parallel_wavelet, progressive, ranged, socket_tuning, striping,
+                    timing)
+
+LEVEL = codec_registry.FWT_LEVEL
+
 
 def connect_to_server(host, port):
     """
-    Establishes a TCP connection to a specified server using a socket.
+    Establishes a TCP connection to a specified server using a socket tuned
+    with the active socket_tuning profile.
 
     Parameters:
     - host (str): The hostname or IP address of the server to connect to.
@@ -15,14 +26,31 @@ def connect_to_server(host, port):
     Returns:
     - socket.socket: A socket object that is connected to the server.
     """
-    # Create a TCP/IP socket
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # Connect the socket to the server's address
-    client_socket.connect((host, port))
-    return client_socket
+    # Buffers are tuned before the handshake, the per-connection flags after it
+    return socket_tuning.connect(host, port)
 
 
-def request_and_receive_data(client_socket, data_size):
+def decompress_data(header, compressed_data):
+    """
+    Reconstructs the original signal from the payload described by `header`.
+
+    Parameters:
+    - header (framing.FrameHeader): The header that described the payload.
+    - compressed_data (bytes-like): The float64 coefficient bands, approximation
+      first, a lossy wavelet codec payload, a container of integer lifting bands,
+      or the payload of any other registered codec.
+
+    Returns:
+    - np.ndarray: The reconstructed signal.
+    """
+    data = codec_registry.decode(header, compressed_data)
+    if isinstance(data, np.ndarray):
+        return data
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def request_and_receive_data(client_socket, data_size, buffer=None,
+                             read_size=framing.RECV_CHUNK_SIZE, verifier=None, **options):
     """
     Sends a data size request to the server, receives compressed data, 
     decompresses it using wavelet transforms, and measures the time taken.
@@ -30,39 +58,211 @@ def request_and_receive_data(client_socket, data_size):
     Parameters:
     - client_socket (socket.socket): The client socket to use for communication.
     - data_size (int): The size of the data requested from the server, in megabytes.
+    - buffer (framing.ReceiveBuffer): Optional buffer the payload is received into,
+      reused across requests.
+    - read_size (int): Largest single read from the socket, in bytes.
+    - verifier (integrity.BlockVerifier): Optional. The request then asks for
+      block digests and the reconstruction is checked against them, unless the
+      codec is lossy.
+    - **options: Extra request fields, e.g. `codec='fwt-lossy'` and its parameters.
 
     Returns:
     - tuple:
         - np.ndarray: The decompressed data array.
         - float: The total time elapsed during the data reception and decompression in seconds.
+        - framing.FrameHeader: The response header, for the compression ratio.
+
+    Raises:
+    - framing.ServerError: If the server rejected the request.
+    - framing.FrameError: If the response is incomplete or corrupt.
+    - integrity.IntegrityError: If the reconstruction does not match the digests.
     """
+    if verifier is not None:
+        options['verify'] = True
+
+    def on_header(header):
+        span.mark('first_byte_received')
+        if verifier is not None:
+            verifier.expect(header)
+
     # Send data request to server
-    client_socket.sendall(str(data_size).encode('utf-8'))
+    span, options = timing.client_span(data_size, options)
+    framing.send_request(client_socket, data_size, **options)
+    span.mark('request_sent')
+    socket_tuning.rearm(client_socket)
 
     # Start the timer
     start_time = time.time()
 
-    received_data = []
-    while True:
-        # Receive data in chunks
-        chunk = client_socket.recv(4096)
-        if not chunk:
-            break
-        received_data.append(chunk)
+    # Receive the header and exactly the number of payload bytes it announces
+    header, compressed_data = framing.recv_frame(
+        client_socket, read_size, buffer, on_header=on_header,
+        on_data=verifier.wire if verifier is not None else None)
 
     # Stop the timer
     end_time = time.time()
+    span.mark('last_byte_received')
 
     # Calculate the elapsed time
     elapsed_time = end_time - start_time
 
+    with span.stage('verify'):
+        framing.verify_checksum(header, compressed_data)
+
     # Decompress the received data
-    compressed_data = b''.join(received_data)
-    coeffs = [np.frombuffer(c, dtype='uint8') for c in np.split(
-        compressed_data, np.array([len(c) for c in compressed_data.split(b'\x00')])[:-1])]
-    decompressed_data = pywt.waverec(coeffs, 'haar')
+    with span.stage('decode'):
+        decompressed_data = decompress_data(header, compressed_data)
+    if verifier is not None:
+        verifier.check(header, decompressed_data)
+    span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                compressed_length=header.compressed_length, flags=header.flags)
+
+    return decompressed_data, elapsed_time, header
+
+
+def request_and_receive_stream(client_socket, data_size, block_size,
+                               read_size=framing.RECV_CHUNK_SIZE, verifier=None, **options):
+    """
+    Requests a streamed response and reconstructs each block as soon as its
+    coefficients arrive, writing it into a preallocated output array.
+
+    Parameters:
+    - client_socket (socket.socket): The client socket to use for communication.
+    - data_size (int): The size of the data requested from the server, in megabytes.
+    - block_size (int): Block size in bytes; a multiple of 2**LEVEL.
+    - read_size (int): Largest single read from the socket, in bytes. Every block
+      is received into the same reused buffer.
+    - verifier (integrity.BlockVerifier): Optional, with `block_size` blocks.
+      The request then asks for block digests; every reconstructed block is
+      hashed as soon as it is produced and the stream is checked at the end.
+    - **options: Extra request fields, e.g. the pipeline `depth` and `workers`.
+
+    Returns:
+    - tuple:
+        - np.ndarray: The reconstructed data array.
+        - float: The total time elapsed including reconstruction, in seconds.
+        - float: Time until the first block was reconstructed, in seconds.
+
+    Raises:
+    - framing.FrameError: If the server fails or the stream is malformed.
+    - integrity.IntegrityError: If the reconstruction does not match the digests.
+    """
+    if verifier is not None:
+        options['verify'] = True
+    span, options = timing.client_span(data_size, options)
+    framing.send_request(client_socket, data_size, stream=True,
+                         block_size=block_size, **options)
+    span.mark('request_sent')
+    socket_tuning.rearm(client_socket)
+    start_time = time.time()
 
-    return decompressed_data, elapsed_time
+    header = framing.recv_header(client_socket)
+    span.mark('first_byte_received')
+    if header.is_error or not header.is_stream:
+        payload = framing.recv_payload(client_socket, header, read_size)
+        span.mark('last_byte_received')
+        if header.is_error:
+            raise framing.ServerError(
+                f"Server error: {bytes(payload).decode('utf-8', 'replace')}")
+        framing.verify_checksum(header, payload)
+        with span.stage('decode'):
+            data = decompress_data(header, payload)
+        elapsed_time = time.time() - start_time
+        if verifier is not None:
+            verifier.check(header, data)
+        span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                    compressed_length=header.compressed_length, flags=header.flags)
+        return data, elapsed_time, elapsed_time
+
+    codec = codec_registry.by_id(header.codec_id)
+    # Byte codecs reconstruct uint8 samples; only fwt-haar needs 8 bytes per sample
+    output = np.empty(header.raw_length, dtype=codec.dtype)
+    decompressor = codec.decompressor(header.raw_length, block_size)
+    offset = 0
+    first_block_time = None
+    chunks = framing.iter_stream(client_socket, header, read_size, reuse_buffer=True)
+    for chunk in chunks:
+        try:
+            with span.stage('decode'):
+                block = decompressor.decompress(chunk)
+        except ValueError as e:
+            raise framing.FrameError(str(e))
+        if not isinstance(block, np.ndarray):
+            block = np.frombuffer(block, dtype=np.uint8)
+        if offset + len(block) > header.raw_length:
+            raise framing.FrameError("Server sent more data than announced")
+        output[offset:offset + len(block)] = block
+        if verifier is not None:
+            verifier.update(block)
+        offset += len(block)
+        if len(block) and first_block_time is None:
+            first_block_time = time.time() - start_time
+    span.mark('last_byte_received')
+    if offset != header.raw_length:
+        raise framing.FrameError(
+            f"Reconstructed {offset} samples, expected {header.raw_length}")
+    elapsed_time = time.time() - start_time
+    if verifier is not None:
+        verifier.check(header)
+    span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                compressed_length=header.compressed_length, flags=header.flags)
+    return output, elapsed_time, first_block_time
+
+
+def request_and_receive_progressive(client_socket, data_size,
+                                    read_size=framing.RECV_CHUNK_SIZE, verifier=None,
+                                    **options):
+    """
+    Requests a progressive stream of the lifting transform and reconstructs a
+    preview from every band as it arrives, coarse to fine.
+
+    Parameters:
+    - client_socket (socket.socket): The client socket to use for communication.
+    - data_size (int): The size of the data requested from the server, in megabytes.
+    - read_size (int): Largest single read from the socket, in bytes.
+    - verifier (integrity.BlockVerifier): Optional. The request then asks for
+      block digests and the final reconstruction is checked against them.
+    - **options: Extra request fields; `codec` must be 'fwt-lifting' for the
+      response to be progressive, and `level` limits the number of levels.
+
+    Returns:
+    - tuple:
+        - np.ndarray: The original samples.
+        - float: The total time elapsed until the last band was decoded, in seconds.
+        - list: (seconds since the request, levels still missing, samples) for
+          every preview, coarse to fine.
+
+    Raises:
+    - framing.FrameError: If the server fails or the stream is malformed.
+    - integrity.IntegrityError: If the reconstruction does not match the digests.
+    """
+    if verifier is not None:
+        options['verify'] = True
+    span, options = timing.client_span(data_size, options)
+    framing.send_request(client_socket, data_size, stream=True, **options)
+    span.mark('request_sent')
+    socket_tuning.rearm(client_socket)
+    start_time = time.time()
+
+    header = framing.recv_header(client_socket)
+    span.mark('first_byte_received')
+    previews = []
+    try:
+        for refinement in progressive.iter_refinements(client_socket, header, read_size):
+            if refinement.level:
+                previews.append((time.time() - start_time, refinement.level,
+                                 len(refinement.samples)))
+            data = refinement.samples
+    except ValueError as e:
+        raise framing.FrameError(str(e))
+    elapsed_time = time.time() - start_time
+    span.mark('last_byte_received')
+    if verifier is not None:
+        verifier.check(header, data)
+    span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                compressed_length=header.compressed_length, flags=header.flags,
+                previews=len(previews))
+    return data, elapsed_time, previews
 
 
 def main():
@@ -70,25 +270,180 @@ def main():
     Main execution function that manages the connection to the server, 
     requests data, receives and decompresses it, and logs the output.
 
-    This function connects to the server, iteratively requests data of predefined sizes, 
+    This function opens one persistent connection to the server, iteratively requests data of predefined sizes, 
     decompresses received data using wavelet transforms, and prints out the data size and elapsed time.
+    With `--stream` the server pipelines the transform block by block (`--block-size`,
+    `--depth`, `--workers`) and the client reconstructs each block as it arrives.
+    `--progressive` streams the lifting transform coarse to fine instead, and the
+    client reports when the first preview of the whole signal was available.
+    `--codec` compares against any other codec of the registry on the same server.
     """
-    server_host = '0.0.0.0'
-    server_port = 5000
+    parser = argparse.ArgumentParser(description='FWT client')
+    parser.add_argument('--host', default='0.0.0.0', help='Server address')
+    parser.add_argument('--port', type=int, default=5000, help='Server port')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100],
+                        help='Data sizes to request, in MB')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream the response block by block')
+    parser.add_argument('--block-size', type=int, default=1024 * 1024,
+                        help='Block size in bytes for streaming mode')
+    parser.add_argument('--depth', type=int, default=None,
+                        help='Blocks the server keeps in flight')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Server worker threads for the pipeline')
+    parser.add_argument('--read-size', type=int, default=framing.RECV_CHUNK_SIZE,
+                        help='Largest single socket read in bytes')
+    parser.add_argument('--source', choices=('memory', 'file'), default='memory',
+                        help='Generate each signal or read it from a payload file')
+    parser.add_argument('--lossy', action='store_true',
+                        help='Use the thresholding, quantizing wavelet codec')
+    parser.add_argument('--lossless', action='store_true',
+                        help='Use the in-place integer Haar lifting transform')
+    parser.add_argument('--progressive', action='store_true',
+                        help='Stream the lifting bands coarse to fine and refine a preview '
+                             'as each one arrives')
+    parser.add_argument('--wavelet', default='haar', help='Wavelet family for --lossy')
+    parser.add_argument('--level', type=int, default=None,
+                        help='Decomposition level for --lossy/--lossless/--progressive '
+                             '(default: maximum)')
+    parser.add_argument('--threshold', type=float, default=4.0,
+                        help='Detail coefficient threshold for --lossy')
+    parser.add_argument('--threshold-mode', choices=('hard', 'soft'), default='hard')
+    parser.add_argument('--quantization', choices=('int8', 'int16'), default='int8')
+    datasets.add_client_arguments(parser)
+    codec_registry.add_client_arguments(parser, default='fwt-haar')
+    striping.add_client_arguments(parser)
+    ranged.add_client_arguments(parser)
+    integrity.add_client_arguments(parser)
+    parallel_wavelet.add_arguments(parser)
+    socket_tuning.add_arguments(parser)
+    timing.add_arguments(parser)
+    args = parser.parse_args()
+    socket_tuning.configure_from_arguments(args)
+    parallel_wavelet.configure_from_arguments(args)
+    if (args.stream or args.progressive) and args.stripes > 1:
+        parser.error('--stripes cannot be combined with --stream or --progressive')
+    if args.progressive and (args.stream or args.lossy or args.lossless):
+        parser.error('--progressive cannot be combined with --stream, --lossy or --lossless')
+    if args.stream and (args.lossy or args.lossless):
+        parser.error('--stream cannot be combined with --lossy or --lossless; '
+                     'those codecs cannot stream')
+    if ranged.is_ranged(args) and (args.stream or args.progressive or args.stripes > 1):
+        parser.error('--offset, --length and --output cannot be combined with '
+                     '--stream, --progressive or --stripes')
+    if args.trace:
+        timing.configure(args.trace)
+
+    data_options = {'dataset': args.dataset, 'seed': args.seed,
+                    **codec_registry.client_options(args)}
+    if args.verify:
+        data_options['verify'] = True
+    codec_options = {'source': args.source, **data_options}
+    if args.lossy:
+        codec_options.update({'codec': 'fwt-lossy', 'wavelet': args.wavelet,
+                              'level': args.level, 'threshold': args.threshold,
+                              'threshold_mode': args.threshold_mode,
+                              'quantization': args.quantization,
+                              'report_error': True})
+    elif args.lossless:
+        codec_options.update({'codec': 'fwt-lifting', 'level': args.level})
+
+    progressive_options = {**data_options, 'codec': 'fwt-lifting', 'level': args.level}
+    stream_options = dict(data_options)
+    if args.depth is not None:
+        stream_options['depth'] = args.depth
+        if args.workers is not None:
+            stream_options['workers'] = args.workers
+
+    if args.output:
+        for data_size in args.sizes:
+            path = ranged.output_path(args.output, data_size, args.sizes)
+            download = ranged.ResumableDownload(args.host, args.port, data_size, path,
+                                                args.piece_size, read_size=args.read_size)
+            try:
+                elapsed_time = download.run(**codec_options)
+            except (framing.FrameError, OSError, ValueError) as e:
+                print(f"Failed to receive {data_size}MB of data: {e} ({download.describe()})")
+                continue
+            print(f"Requested {data_size}MB: {download.describe(elapsed_time)}")
+        return
+    codec_options.update(ranged.client_options(args))
+
+    if args.stripes > 1:
+        # Every stripe is transformed on its own and reassembled into one array
+        with striping.StripedClient(args.host, args.port, args.stripes,
+                                    args.read_size) as client:
+            for data_size in args.sizes:
+                decompressed_data, elapsed_time, stripes = client.fetch(data_size,
+                                                                        **codec_options)
+                print(f"Requested {data_size}MB: Received "
+                      f"{len(decompressed_data) / (1024 * 1024)}MB in {elapsed_time} sec "
+                      f"({striping.describe(data_size, elapsed_time, stripes)})")
+        return
+
+    # Reused by every non-streamed request, so receiving allocates nothing once warm
+    buffer = framing.ReceiveBuffer()
 
-    client_socket = connect_to_server(server_host, server_port)
+    client_socket = connect_to_server(args.host, args.port)
 
     try:
-        for data_size in [1, 10, 100]:  # Data sizes in MB
-            decompressed_data, elapsed_time = request_and_receive_data(
-                client_socket, data_size)
+        for data_size in args.sizes:  # Data sizes in MB
+            verifier = None
+            if args.verify:
+                verifier = integrity.BlockVerifier(
+                    args.block_size if args.stream else framing.DIGEST_BLOCK_SIZE)
+            try:
+                if client_socket is None:
+                    client_socket = connect_to_server(args.host, args.port)
+                if args.progressive:
+                    decompressed_data, elapsed_time, previews = request_and_receive_progressive(
+                        client_socket, data_size, args.read_size, verifier,
+                        **progressive_options)
+                elif args.stream:
+                    decompressed_data, elapsed_time, first_block_time = \
+                        request_and_receive_stream(client_socket, data_size,
+                                                   args.block_size, args.read_size,
+                                                   verifier, **stream_options)
+                else:
+                    decompressed_data, elapsed_time, header = request_and_receive_data(
+                        client_socket, data_size, buffer, args.read_size, verifier,
+                        **codec_options)
+            except (framing.ServerError, integrity.IntegrityError) as e:
+                # Error frames and checked responses are received whole, so the
+                # connection stays usable
+                print(f"Failed to receive {data_size}MB of data: {e}")
+                continue
+            except (framing.FrameError, OSError) as e:
+                # A broken or malformed response leaves the connection out of sync;
+                # the next size reconnects
+                print(f"Failed to receive {data_size}MB of data: {e}")
+                if client_socket is not None:
+                    client_socket.close()
+                    client_socket = None
+                continue
             decompressed_size = len(decompressed_data) / \
                 (1024 * 1024)  # Size in MB
-            print(
-                f"Requested {data_size}MB: Received {decompressed_size}MB in {elapsed_time} sec")
+            summary = f"Requested {data_size}MB: Received {decompressed_size}MB in {elapsed_time} sec"
+            if args.progressive:
+                if previews:
+                    first_time, _, samples = previews[0]
+                    summary += (f" (first preview of {samples} samples after "
+                                f"{first_time:.4f} sec, {len(previews)} previews)")
+            elif args.stream:
+                if first_block_time is not None:
+                    summary += f" (first block after {first_block_time:.4f} sec)"
+            else:
+                summary += (f" ({header.codec_name}, compression ratio "
+                            f"{header.raw_length / max(header.compressed_length, 1):.3f}"
+                            f"{', cached' if header.is_cached else ''}"
+                            f"{', adaptive' if header.is_adaptive else ''})")
+            if verifier is not None:
+                summary += f" ({verifier.describe()})"
+            print(summary)
 
     finally:
-        client_socket.close()
+        if client_socket is not None:
+            client_socket.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,36 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import lifting  # noqa: E402
+
+
+def main():
+    """
+    Compares the in-place integer Haar lifting transform with PyWavelets.
+
+    For every size a random uint8 signal is transformed to the maximum level and
+    back; the best of `--repeat` runs is printed as throughput in MB/s, together
+    with whether the lifting round trip reproduced the input exactly.
+    """
+    parser = argparse.ArgumentParser(description='Integer lifting vs pywt benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100],
+                        help='Signal sizes in MB')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement')
+    args = parser.parse_args()
+
+    for size_mb in args.sizes:
+        results = lifting.benchmark(size_mb * 1024 * 1024, repeat=args.repeat)
+        print(f"{size_mb}MB, {results['level']} levels: "
+              f"lifting forward {results['lifting_forward_mb_s']:.1f} MB/s, "
+              f"inverse {results['lifting_inverse_mb_s']:.1f} MB/s, "
+              f"lossless {results['lossless']} | "
+              f"pywt forward {results['pywt_forward_mb_s']:.1f} MB/s, "
+              f"inverse {results['pywt_inverse_mb_s']:.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
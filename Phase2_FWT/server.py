@@ -1,51 +1,238 @@
-import pywt
 import numpy as np
-import socket
-import time
+import argparse
+import functools
 import os
+import sys
 
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def generate_data(size_in_mb):
+from common import (adaptive, codec_registry, datasets, framing,  # noqa: E402
+                    integrity, parallel_wavelet, payload_cache, payload_store, pipeline,
+                    progressive, server_core, socket_tuning, timing, wavelet_codec)
+
+WAVELET = codec_registry.FWT_WAVELET
+LEVEL = codec_registry.FWT_LEVEL
+
+# Default block size for streamed responses. Haar filters do not overlap, so as long
+# as blocks are a multiple of 2**LEVEL samples the block-wise transform produces
+# exactly the coefficients of the whole-signal transform.
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+
+def generate_data(size_in_mb, dataset=datasets.DEFAULT_DATASET, seed=0, offset=0, length=None):
     """
-    Generates a binary string of random bytes approximately equal to the specified size in megabytes.
+    Generates data of the specified size in megabytes.
 
     Parameters:
     - size_in_mb (int): The size of the data to generate in megabytes.
+    - dataset (str): One of datasets.DATASETS; 'random' gives uniform bytes.
+    - seed (int): The dataset seed.
+    - offset (int): First byte to generate, for a byte range of the data.
+    - length (int): Number of bytes to generate; the rest of the data by default.
+
+    Returns:
+    - bytes-like: The generated data.
+    """
+    if length is None:
+        length = size_in_mb * 1024 * 1024 - offset
+    return datasets.generate_range(dataset, seed, offset, length)
+
+
+def load_data(request, data_size):
+    """
+    Produces the input signal for one request.
+
+    Parameters:
+    - request (dict): The decoded request; `dataset` and `seed` select the data, and
+      with `"source": "file"` the samples are read from a payload file created
+      once, instead of being generated. `offset` and `length` select a byte range.
+    - data_size (int): The size of the data in megabytes.
 
     Returns:
-    - bytes: A bytes object containing random data of the specified size.
+    - bytes-like: The samples.
+
+    Raises:
+    - ValueError: If the source, range or dataset is invalid.
     """
-    return os.urandom(size_in_mb * 1024 * 1024)
+    dataset, seed = datasets.request_dataset(request)
+    offset, length = server_core.request_range(request, data_size)
+    if payload_store.request_source(request) == 'file':
+        with timing.stage('load'):
+            payload = payload_store.get_store().raw(data_size, dataset, seed)
+            return np.fromfile(payload.path, dtype=np.uint8, count=length,
+                               offset=payload.offset + offset)
+    with timing.stage('generate'):
+        return generate_data(data_size, dataset, seed, offset, length)
 
 
-def send_data(client_socket, data_size):
+def encode_response(request):
     """
-    Generates data, compresses it using Fast Wavelet Transform (FWT), 
-    and sends the compressed data to the client.
+    Generates data and compresses it using Fast Wavelet Transform (FWT).
 
     Parameters:
-    - client_socket (socket.socket): The client socket to send data to.
-    - data_size (int): The size of the data to generate and send in megabytes.
+    - request (dict): The decoded request; `size_mb` is the size of the data in
+      megabytes and the optional `dataset` and `seed` select the data. `offset`
+      and `length` restrict it to one byte range, e.g. a stripe.
 
     Process:
     - The data is first converted to a numpy array.
     - A wavelet decomposition is performed on the array.
-    - The wavelet coefficients are serialized and sent over the socket.
+    - The coefficient bands are concatenated (approximation first) and sent as one frame.
+      The client derives the band boundaries from the raw length in the header.
+    - `"codec"` selects any other codec of the registry (common/codec_registry.py),
+      e.g. 'fwt-lossy' for the lossy wavelet codec, 'fwt-lifting' for the lossless
+      integer transform or 'lz4' to compare against on the same server.
+    - With `"verify": true` the block digests of the signal are sent after the
+      payload, so the client can check that its reconstruction is lossless.
+    - Runs inside a worker process in process mode, so it must stay a module-level function.
+
+    Returns:
+    - tuple: (codec id, raw length, encoded payload, block digests or None) ready
+      to be sent as one frame.
+
+    Raises:
+    - ValueError: If the requested size, range, dataset, codec, codec parameters
+      or verify flag are invalid.
+    """
+    data_size = server_core.request_size_mb(request)
+    codec, params = codec_registry.request_codec(request, default='fwt-haar')
+    if server_core.is_ranged(request):
+        offset, length = server_core.request_range(request, data_size)
+        print(f"Requested bytes {offset}+{length} of {data_size}MB ({codec.name})")
+    else:
+        print(f"Requested data size: {data_size}MB ({codec.name})")
+    data = load_data(request, data_size)
+    digests = integrity.digest(request, data)
+    with timing.stage('encode'):
+        payload = codec.encode(data, **params)
+    if codec.codec_id == framing.CODEC_FWT_LOSSY:
+        report_lossy(request, data, payload, params['params'])
+    return codec.codec_id, len(data), payload, digests
+
+
+def report_lossy(request, data, payload, params):
+    """
+    Prints the compression ratio of a lossy wavelet codec payload and, with
+    `"report_error": true` in the request, the reconstruction MSE and PSNR.
+
+    Parameters:
+    - request (dict): The decoded request.
+    - data (bytes-like): The encoded samples.
+    - payload (bytes): The codec payload.
+    - params (wavelet_codec.WaveletParams): The codec parameters.
+    """
+    summary = (f"fwt-lossy {params.wavelet}: {len(data)} -> {len(payload)} bytes "
+               f"(ratio {len(data) / len(payload):.2f})")
+    if request.get('report_error'):
+        reconstructed = wavelet_codec.decode(payload)
+        summary += (f", MSE {wavelet_codec.mse(data, reconstructed):.3f}, "
+                    f"PSNR {wavelet_codec.psnr(data, reconstructed):.2f}dB")
+    print(summary)
+
 
-    Side Effects:
-    - Sends compressed data through the socket.
+def generate_block(index, size, block_size=STREAM_BLOCK_SIZE,
+                   dataset=datasets.DEFAULT_DATASET, seed=0):
     """
-    data = generate_data(data_size)
+    Generates one block of data for the pipelined mode.
 
-    # Convert binary data to numpy array
-    data_array = np.frombuffer(data, dtype='uint8')
+    Parameters:
+    - index (int): Position of the block in the payload.
+    - size (int): The size of the block in bytes.
+    - block_size (int): The size of every block but the last, to locate this one.
+    - dataset (str): One of datasets.DATASETS.
+    - seed (int): The dataset seed.
+
+    Returns:
+    - bytes-like: The block's data.
+    """
+    return datasets.generate_range(dataset, seed, index * block_size, size)
+
+
+def stream_encode_response(request):
+    """
+    Streams the response block by block when the request sets `"stream": true`.
+
+    Blocks of `block_size` bytes are generated and transformed on a pool of
+    `workers` threads (NumPy and PyWavelets release the GIL) up to `depth` blocks
+    ahead of the sender, so block N+1 is being transformed while block N is on the
+    wire. Each chunk holds the concatenated coefficient bands of one block, and the
+    per-stage timings are printed once the response is sent.
+
+    Parameters:
+    - request (dict): The decoded request; `codec` selects any streamable codec of
+      the registry (default 'fwt-haar'). With `"verify": true` every block is
+      digested on the worker that generates it.
+
+    'fwt-lifting' is streamed progressively instead, see
+    `progressive_encode_response`. File-backed requests, byte ranges and codecs
+    that cannot stream are not streamed; they take the whole-frame path.
+
+    Returns:
+    - tuple: (codec id, raw length, iterator of encoded chunks, block digests or
+      None), or None if the request is not a streaming request.
+
+    Raises:
+    - ValueError: If the size, block size, dataset, codec, pipeline options or
+      verify flag are invalid.
+    """
+    if (not request.get('stream') or payload_store.request_source(request) == 'file'
+            or server_core.is_ranged(request)):
+        return None
+    codec, params = codec_registry.request_codec(request, default='fwt-haar')
+    if codec.codec_id == framing.CODEC_FWT_LIFTING:
+        return progressive_encode_response(request, codec, params)
+    if not codec.streamable:
+        return None
+    data_size = server_core.request_size_mb(request)
+    block_size = server_core.request_block_size(request, STREAM_BLOCK_SIZE)
+    if codec.codec_id == framing.CODEC_FWT_HAAR and block_size % (1 << LEVEL):
+        raise ValueError(
+            f"Block size must be a multiple of {1 << LEVEL} for a level {LEVEL} transform")
+    depth, workers = pipeline.request_pipeline_options(request) or \
+        (pipeline.DEFAULT_DEPTH, pipeline.DEFAULT_WORKERS)
+    dataset, seed = datasets.request_dataset(request)
+    raw_length = data_size * 1024 * 1024
+    digests = integrity.stream_digests(request, raw_length, block_size)
+    print(f"Streaming {data_size}MB in {block_size} byte blocks with {codec.name} "
+          f"(depth {depth}, {workers} workers)")
+    produce = functools.partial(generate_block, block_size=block_size,
+                                dataset=dataset, seed=seed)
+    return (codec.codec_id, raw_length,
+            pipeline.pipeline(pipeline.block_sizes(raw_length, block_size),
+                              integrity.digesting(produce, digests),
+                              functools.partial(codec.encode_block, **params), depth, workers,
+                              report=lambda timings: print(f"Pipeline finished: {timings}")),
+            digests)
+
+
+def progressive_encode_response(request, codec, params):
+    """
+    Streams the integer lifting transform of the whole signal coarse to fine:
+    the container header, the approximation and then the detail bands from the
+    coarsest level to the finest, in chunks of at most progressive.CHUNK_SIZE
+    bytes. The client can reconstruct a preview from the first bands while the
+    finer ones are still on the wire (progressive.iter_refinements).
 
-    # Apply FWT compression
-    coeffs = pywt.wavedec(data_array, 'haar', level=3)
-    compressed_data = np.array([np.array(c).tobytes() for c in coeffs])
+    Parameters:
+    - request (dict): The decoded request; `level` limits the number of levels
+      (default: the maximum). With `"verify": true` the block digests of the
+      signal are sent after the stream.
+    - codec (codec_registry.FwtLiftingCodec): The lifting codec.
+    - params (dict): Its parameters.
+
+    Returns:
+    - tuple: (codec id, raw length, iterator of chunks, block digests or None).
 
-    # Send the compressed data
-    client_socket.sendall(compressed_data)
+    Raises:
+    - ValueError: If the size, dataset, level or verify flag is invalid.
+    """
+    data_size = server_core.request_size_mb(request)
+    data = load_data(request, data_size)
+    digests = integrity.digest(request, data)
+    parts = codec.encode_parts(data, **params)
+    print(f"Streaming {data_size}MB progressively in {len(parts) - 1} bands")
+    return codec.codec_id, len(data), progressive.chunks(parts), digests
 
 
 def main():
@@ -55,45 +242,46 @@ def main():
 
     Process:
     - Sets up the server socket and listens on a specified port.
-    - Accepts connections and handles incoming data size requests from clients.
+    - Accepts connections and handles incoming data size requests from clients,
+    serving any number of requests per connection.
     - Generates the requested size of data, compresses it using wavelet transforms, 
     and sends the compressed data back to the client.
+    - The wavelet decomposition is CPU-bound, so the default process mode runs it in
+    a pool of `--workers` processes while threads handle the connections.
+    - Streamed requests are transformed block by block in a pipeline of worker threads.
+    - In serial and thread mode large signals are transformed block-parallel by
+    `--fwt-workers` processes instead (common/parallel_wavelet.py).
     """
-    host = '0.0.0.0'
-    port = 5000
-
-    # Create a TCP/IP socket
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-    # Bind the socket to the port
-    server_socket.bind((host, port))
-    print(f"Server is running on port {port}")
+    parser = argparse.ArgumentParser(description='FWT compressed data server')
+    server_core.add_server_arguments(parser, '0.0.0.0', 5000, mode='process')
+    parallel_wavelet.add_arguments(parser)
+    args = parser.parse_args()
+    parallel_wavelet.configure_from_arguments(args, pooled=args.mode == 'process')
+    if args.payload_dir:
+        payload_store.configure(args.payload_dir)
+    datasets.configure_from_arguments(args, pooled=args.mode == 'process')
+    if args.trace:
+        timing.configure(args.trace)
+    socket_tuning.configure_from_arguments(args)
 
-    # Listen for incoming connections
-    server_socket.listen(5)
+    server = server_core.ServerCore(args.host, args.port, encode_response,
+                                    mode=args.mode, workers=args.workers,
+                                    stream_encode=stream_encode_response,
+                                    cache=payload_cache.from_arguments(args),
+                                    selector=adaptive.from_arguments(args))
+    print(f"Server is running on port {args.port} "
+          f"({server.mode} mode, {server.workers} workers)")
 
     try:
-        while True:
-            # Wait for a connection
-            print('waiting for a connection')
-            connection, client_address = server_socket.accept()
-            print('connection from', client_address)
-
-            try:
-                # Receive the message from the client
-                message = connection.recv(16).decode('utf-8')
-                # Assuming the client sends the size as a string
-                data_size = int(message)
-                print(f"Requested data size: {data_size}MB")
-
-                # Send the data
-                send_data(connection, data_size)
-            finally:
-                # Clean up the connection
-                connection.close()
+        server.serve_forever()
     except KeyboardInterrupt:
         print("Server is shutting down.")
-        server_socket.close()
+    finally:
+        server.shutdown()
+        if server.cache is not None:
+            print(f"Payload cache: {server.cache.stats}")
+        if server.selector is not None:
+            print(f"Adaptive selection: {server.selector}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,38 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import benchmark, netem, striping  # noqa: E402
+
+
+def main():
+    """
+    Runs the benchmark matrix: every combination of `--codecs`, `--sizes`,
+    `--datasets` and `--concurrency` against one phase server on localhost.
+
+    Each case prints its median/p95/p99 latency, throughput, compression ratio
+    and CPU time as it completes; `--csv` and `--json` save all cases for
+    comparing codecs or spotting regressions between runs. `--links` repeats
+    the matrix over emulated links, e.g. `--links direct 10mbit 100mbit 1gbit`,
+    and `--stripes 1 4 8` over parallel byte-range connections like `iperf3 -P`.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark matrix runner')
+    benchmark.add_arguments(parser)
+    args = parser.parse_args()
+    for link in args.links:
+        if link != benchmark.DIRECT_LINK:
+            try:
+                netem.parse_link(link)
+            except ValueError as e:
+                parser.error(str(e))
+    for stripes in args.stripes:
+        if not 1 <= stripes <= striping.MAX_STRIPES:
+            parser.error(f"--stripes must be between 1 and {striping.MAX_STRIPES}")
+    benchmark.run_from_arguments(args)
+
+
+if __name__ == '__main__':
+    main()
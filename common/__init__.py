@@ -0,0 +1,7 @@
+"""
+Shared building blocks for the Phase1/Phase2 client and server scripts.
+
+The phase directories stay runnable as plain scripts (``python3 server.py``);
+each script puts the repository root on ``sys.path`` and imports the modules
+it needs from this package.
+"""
@@ -0,0 +1,223 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from common import codec_registry, datasets, framing
+
+# Adaptive codec selection for requests with `"codec": "auto"`. Whether
+# compression pays off depends on how compressible the data is, how fast the CPU
+# encodes and decodes it and how fast the link is. Per byte of raw data a codec
+# costs roughly
+#
+#   1 / encode speed + 1 / (ratio * link bandwidth) + 1 / decode speed
+#
+# and the selector picks the candidate (the identity codec included) with the
+# lowest estimate. The ratio and codec speeds come from compressing a sample of
+# the request's first block with every candidate. Samples are cached per dataset
+# and seed, but every request re-times the codecs on its sample, so the speeds
+# follow the current CPU load. The bandwidth is a moving average of the wire
+# throughput the server achieves sending whole-frame responses. The chosen codec
+# id goes into the response header together with FLAG_ADAPTIVE.
+AUTO_CODEC = 'auto'
+DEFAULT_CANDIDATES = tuple(name for name in ('raw', 'lz4', 'zlib', 'zstd')
+                           if name in codec_registry.names())
+SAMPLE_SIZE = 64 * 1024
+MAX_SAMPLES = 64
+DEFAULT_BANDWIDTH_MB = 125.0  # About 1 Gbit/s until the first measurement
+# Sends smaller than this mostly measure the copy into the socket buffer
+MIN_SEND_SAMPLE = 256 * 1024
+SMOOTHING = 0.3
+MB = 1024 * 1024
+
+
+def _smooth(previous, value):
+    return value if previous is None else previous + SMOOTHING * (value - previous)
+
+
+class Decision:
+    """
+    Outcome of one adaptive selection.
+
+    Attributes:
+    - codec (str): Name of the chosen codec.
+    - estimates (dict): Estimated seconds per raw megabyte for every candidate.
+    - ratios (dict): Sampled compression ratio of every candidate.
+    - bandwidth (float): Link bandwidth assumed, in bytes per second.
+    """
+
+    def __init__(self, codec, estimates, ratios, bandwidth):
+        self.codec = codec
+        self.estimates = estimates
+        self.ratios = ratios
+        self.bandwidth = bandwidth
+
+    def __repr__(self):
+        candidates = ', '.join(f"{name} {seconds * 1000:.2f}ms/MB (ratio {self.ratios[name]:.2f})"
+                               for name, seconds in sorted(self.estimates.items(),
+                                                           key=lambda item: item[1]))
+        return (f"Decision(codec={self.codec!r}, bandwidth={self.bandwidth / MB:.1f}MB/s, "
+                f"candidates: {candidates})")
+
+
+class AdaptiveSelector:
+    """
+    Picks the codec that minimizes the estimated end-to-end time of a request.
+    Thread-safe; one instance is shared by all connections of a server.
+
+    Parameters:
+    - bandwidth (float): Initial link bandwidth estimate in bytes per second.
+    - candidates (tuple): Codec names considered when a request lists none.
+    - sample_size (int): Bytes of the request's data compressed per candidate.
+    """
+
+    def __init__(self, bandwidth=DEFAULT_BANDWIDTH_MB * MB, candidates=DEFAULT_CANDIDATES,
+                 sample_size=SAMPLE_SIZE):
+        if bandwidth <= 0:
+            raise ValueError(f"Bandwidth must be positive, got {bandwidth}")
+        self.bandwidth = float(bandwidth)
+        self.candidates = tuple(candidates)
+        self.sample_size = sample_size
+        self.encode_speeds = {}
+        self.decode_speeds = {}
+        self.decisions = {}
+        self._samples = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_auto(request):
+        return request.get('codec') == AUTO_CODEC
+
+    def request_candidates(self, request):
+        """
+        The candidate codecs of a request: its `candidates` list or the defaults.
+
+        Raises:
+        - ValueError: If a candidate is unknown, lossy or cannot stream.
+        """
+        names = request.get('candidates', self.candidates)
+        if not isinstance(names, (list, tuple)) or not names:
+            raise ValueError(f"candidates must be a non-empty list of codec names, got {names!r}")
+        for name in names:
+            codec = codec_registry.get(name)
+            if not codec.lossless or not codec.streamable:
+                raise ValueError(f"Codec {name!r} cannot be selected adaptively")
+        return tuple(names)
+
+    def _sample(self, dataset, seed):
+        key = (dataset, seed)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is not None:
+                self._samples.move_to_end(key)
+                return sample
+        sample = bytes(datasets.generate_range(dataset, seed, 0, self.sample_size))
+        with self._lock:
+            self._samples[key] = sample
+            while len(self._samples) > MAX_SAMPLES:
+                self._samples.popitem(last=False)
+        return sample
+
+    def _measure(self, codec, params, sample):
+        start = time.perf_counter()
+        encoded = codec.encode(sample, **params)
+        encoded_time = time.perf_counter()
+        codec.decode(encoded, len(sample))
+        decoded_time = time.perf_counter()
+        ratio = len(sample) / max(memoryview(encoded).nbytes, 1)
+        # A floor of 1us keeps the speeds finite when a tiny sample beats the timer
+        encode_speed = len(sample) / max(encoded_time - start, 1e-6)
+        decode_speed = len(sample) / max(decoded_time - encoded_time, 1e-6)
+        with self._lock:
+            self.encode_speeds[codec.name] = _smooth(self.encode_speeds.get(codec.name),
+                                                     encode_speed)
+            self.decode_speeds[codec.name] = _smooth(self.decode_speeds.get(codec.name),
+                                                     decode_speed)
+        return ratio
+
+    def choose(self, request):
+        """
+        Estimates every candidate codec for a request and picks the fastest.
+
+        Parameters:
+        - request (dict): The decoded request.
+
+        Returns:
+        - Decision: The chosen codec and the estimates behind it.
+
+        Raises:
+        - ValueError: If the dataset, candidates or codec parameters are invalid.
+        """
+        dataset, seed = datasets.request_dataset(request)
+        sample = self._sample(dataset, seed)
+        estimates = {}
+        ratios = {}
+        with self._lock:
+            bandwidth = self.bandwidth
+        for name in self.request_candidates(request):
+            codec = codec_registry.get(name)
+            if codec.codec_id == framing.CODEC_RAW:
+                # Sending the data as it is costs no CPU time worth modelling
+                ratios[name] = 1.0
+                estimates[name] = MB / bandwidth
+                continue
+            ratios[name] = self._measure(codec, codec.params(request), sample)
+            with self._lock:
+                cpu_seconds = 1 / self.encode_speeds[name] + 1 / self.decode_speeds[name]
+            estimates[name] = (cpu_seconds + 1 / (ratios[name] * bandwidth)) * MB
+        codec = min(estimates, key=estimates.get)
+        with self._lock:
+            self.decisions[codec] = self.decisions.get(codec, 0) + 1
+        return Decision(codec, estimates, ratios, bandwidth)
+
+    def resolve(self, request):
+        """
+        Replaces `"codec": "auto"` in a request with the chosen codec.
+
+        Returns:
+        - tuple: (request to encode, Decision), or (request, None) if the request
+          does not ask for adaptive selection.
+        """
+        if not self.is_auto(request):
+            return request, None
+        decision = self.choose(request)
+        logging.info(f"Adaptive codec selection: {decision}")
+        return dict(request, codec=decision.codec), decision
+
+    def record_send(self, size, seconds):
+        """
+        Feeds the wire throughput of one sent response into the bandwidth estimate.
+
+        Parameters:
+        - size (int): Bytes sent.
+        - seconds (float): Time the send took.
+        """
+        if size < MIN_SEND_SAMPLE or seconds <= 0:
+            return
+        with self._lock:
+            self.bandwidth = _smooth(self.bandwidth, size / seconds)
+
+    def __repr__(self):
+        with self._lock:
+            return (f"AdaptiveSelector(bandwidth={self.bandwidth / MB:.1f}MB/s, "
+                    f"decisions={self.decisions})")
+
+
+def from_arguments(args):
+    """
+    Builds an AdaptiveSelector from parsed `add_arguments` options, or None
+    unless --adaptive was given.
+    """
+    if not args.adaptive:
+        return None
+    return AdaptiveSelector(args.link_mb * MB)
+
+
+def add_arguments(parser):
+    """
+    Adds the adaptive selection options to a server's argparse parser.
+    """
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Choose the codec of "codec": "auto" requests per request')
+    parser.add_argument('--link-mb', type=float, default=DEFAULT_BANDWIDTH_MB,
+                        help='Initial link bandwidth estimate for --adaptive, in MB/s')
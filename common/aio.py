@@ -0,0 +1,618 @@
+import asyncio
+import logging
+import socket
+import statistics
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from common import (adaptive, codec_registry, datasets, framing, payload_cache,
+                    payload_store, server_core, socket_tuning, timing)
+
+# Payloads are written in slices of this size, waiting for the transport to drain
+# between slices so a slow reader applies backpressure instead of the server
+# buffering a whole 100 MB response in memory.
+WRITE_CHUNK_SIZE = 256 * 1024
+DEFAULT_CONCURRENCY = 100
+
+
+async def read_request(reader):
+    """
+    Reads one framed request from a stream.
+
+    Parameters:
+    - reader (asyncio.StreamReader): The connection's reader.
+
+    Returns:
+    - dict: The decoded request, or None if the client closed the connection.
+    """
+    try:
+        prefix = await reader.readexactly(framing.REQUEST_STRUCT.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise framing.FrameError("Connection closed inside a request")
+    body_length = framing.parse_request_prefix(prefix)
+    body = await reader.readexactly(body_length) if body_length else b''
+    return framing.parse_request_body(body)
+
+
+async def write_payload(writer, payload, chunk_size=WRITE_CHUNK_SIZE):
+    """
+    Writes a payload in slices, draining the transport after each one.
+
+    Parameters:
+    - writer (asyncio.StreamWriter): The connection's writer.
+    - payload (bytes-like): The bytes to send.
+    - chunk_size (int): Size of each slice in bytes.
+    """
+    view = memoryview(payload).cast('B')
+    for offset in range(0, view.nbytes, chunk_size):
+        writer.write(view[offset:offset + chunk_size])
+        await writer.drain()
+
+
+async def write_frame(writer, codec_id, raw_length, payload, flags=0,
+                      chunk_size=WRITE_CHUNK_SIZE, digests=None):
+    """
+    Writes a response header followed by its payload with backpressure.
+
+    Parameters:
+    - writer (asyncio.StreamWriter): The connection's writer.
+    - codec_id (int): One of the framing.CODEC_* identifiers.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - payload (bytes-like or payload_store.FilePayload): The encoded payload; a
+      file-backed payload is sent with `write_file_frame`.
+    - flags (int): Bit field of framing.FLAG_* values.
+    - chunk_size (int): Size of each written slice in bytes.
+    - digests (framing.BlockDigests): Optional digests written after the payload.
+
+    Returns:
+    - framing.FrameHeader: The header that was sent.
+    """
+    if isinstance(payload, payload_store.FilePayload):
+        return await write_file_frame(writer, codec_id, raw_length, payload, flags, digests)
+    if digests is not None:
+        flags |= framing.FLAG_DIGESTS
+    header = framing.build_header(codec_id, raw_length, payload, flags)
+    writer.write(header.pack())
+    await write_payload(writer, payload, chunk_size)
+    if digests is not None:
+        writer.write(digests.pack())
+        await writer.drain()
+    return header
+
+
+async def write_file_frame(writer, codec_id, raw_length, payload, flags=0, digests=None):
+    """
+    Writes a response whose payload is stored in a file with `loop.sendfile`,
+    which uses `os.sendfile` when the transport supports it.
+
+    Parameters:
+    - writer (asyncio.StreamWriter): The connection's writer.
+    - codec_id (int): One of the framing.CODEC_* identifiers.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - payload (payload_store.FilePayload): The file, byte range and checksum to send.
+    - flags (int): Bit field of framing.FLAG_* values.
+    - digests (framing.BlockDigests): Optional digests written after the payload.
+
+    Returns:
+    - framing.FrameHeader: The header that was sent.
+    """
+    if digests is not None:
+        flags |= framing.FLAG_DIGESTS
+    header = framing.FrameHeader(codec_id, flags, raw_length, payload.length,
+                                 payload.checksum)
+    writer.write(header.pack())
+    await writer.drain()
+    with open(payload.path, 'rb') as source:
+        await asyncio.get_running_loop().sendfile(
+            writer.transport, source, payload.offset, payload.length)
+    if digests is not None:
+        writer.write(digests.pack())
+        await writer.drain()
+    return header
+
+
+async def write_stream(writer, codec_id, raw_length, chunks, digests=None, executor=None,
+                       flags=0):
+    """
+    Writes a streamed response, producing each chunk in `executor` so encoding
+    never blocks the event loop, and draining after every chunk.
+
+    Parameters:
+    - writer (asyncio.StreamWriter): The connection's writer.
+    - codec_id (int): One of the framing.CODEC_* identifiers.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - chunks (iterator): Produces the bytes-like chunks of the encoded payload.
+    - digests (framing.BlockDigests): Optional digests, filled in while `chunks`
+      is produced and written after the stream trailer.
+    - executor (concurrent.futures.Executor): Thread executor used to advance
+      `chunks`; None uses the loop's default thread pool.
+    - flags (int): framing.FLAG_* values to set besides FLAG_STREAM.
+
+    Returns:
+    - framing.FrameHeader: The header with the final length and checksum filled in.
+    """
+    loop = asyncio.get_running_loop()
+    if digests is not None:
+        flags |= framing.FLAG_DIGESTS
+    header = framing.FrameHeader(codec_id, framing.FLAG_STREAM | flags, raw_length, 0, 0)
+    writer.write(header.pack())
+    checksum = 0
+    chunks = iter(chunks)
+    while True:
+        chunk = await loop.run_in_executor(executor, next, chunks, None)
+        if chunk is None:
+            break
+        view = memoryview(chunk).cast('B')
+        if not view.nbytes:
+            continue
+        checksum = zlib.crc32(view, checksum)
+        header.compressed_length += view.nbytes
+        writer.write(framing.CHUNK_STRUCT.pack(view.nbytes))
+        writer.write(view)
+        await writer.drain()
+    header.checksum = checksum & 0xFFFFFFFF
+    writer.write(framing.CHUNK_STRUCT.pack(0) +
+                 framing.STREAM_TRAILER_STRUCT.pack(header.checksum))
+    if digests is not None:
+        writer.write(digests.pack())
+    await writer.drain()
+    return header
+
+
+async def read_stream(reader, header):
+    """
+    Reads a streamed payload into one buffer and verifies its trailer checksum.
+
+    Parameters:
+    - reader (asyncio.StreamReader): The connection's reader.
+    - header (framing.FrameHeader): The header of the response, with FLAG_STREAM set.
+
+    Returns:
+    - bytearray: The concatenated chunks.
+    """
+    payload = bytearray()
+    while True:
+        (length,) = framing.CHUNK_STRUCT.unpack(
+            await reader.readexactly(framing.CHUNK_STRUCT.size))
+        if length == 0:
+            break
+        payload.extend(await reader.readexactly(length))
+    (header.checksum,) = framing.STREAM_TRAILER_STRUCT.unpack(
+        await reader.readexactly(framing.STREAM_TRAILER_STRUCT.size))
+    header.compressed_length = len(payload)
+    framing.verify_checksum(header, payload)
+    await read_digests(reader, header)
+    return payload
+
+
+async def read_digests(reader, header):
+    """
+    Reads the block digests that follow a payload with framing.FLAG_DIGESTS into
+    `header.digests`; does nothing for other responses.
+    """
+    if not header.has_digests:
+        return
+    block_size, count = framing.parse_digest_prefix(
+        await reader.readexactly(framing.DIGEST_STRUCT.size))
+    header.digests = framing.unpack_digests(block_size, await reader.readexactly(4 * count))
+
+
+async def read_frame(reader, on_header=None):
+    """
+    Reads one complete framed response.
+
+    Parameters:
+    - reader (asyncio.StreamReader): The connection's reader.
+    - on_header (callable): Optional function called with the header as soon as
+      it has arrived.
+
+    Returns:
+    - tuple: (framing.FrameHeader, bytes payload).
+
+    Raises:
+    - framing.FrameError: If the frame is malformed or the server reported an error.
+    - asyncio.IncompleteReadError: If the connection closes early.
+    """
+    header = framing.FrameHeader.unpack(
+        await reader.readexactly(framing.HEADER_SIZE))
+    if on_header is not None:
+        on_header(header)
+    if header.is_stream:
+        return header, await read_stream(reader, header)
+    payload = await reader.readexactly(header.compressed_length)
+    await read_digests(reader, header)
+    if header.is_error:
+        raise framing.ServerError(
+            f"Server error: {payload.decode('utf-8', 'replace')}")
+    return header, payload
+
+
+class AsyncServer:
+    """
+    asyncio server that keeps every connection on one event loop and runs the
+    encoder in an executor, so thousands of idle or slow connections cost no threads.
+
+    Parameters:
+    - encode (callable): Module-level function taking a request dict and returning
+      (codec id, raw length, payload, digests); runs in `executor`.
+    - executor (concurrent.futures.Executor): Where `encode` runs. Use a process
+      pool for CPU-bound codecs; None uses the loop's default thread pool.
+    - chunk_size (int): Slice size used when writing payloads.
+    - stream_encode (callable): Optional, see `server_core.handle_connection`.
+      Chunks are produced in the loop's default thread pool.
+    - cache (payload_cache.PayloadCache): Optional encoded-payload cache; stores
+      run in the default thread pool, since they may spill to disk.
+    - selector (adaptive.AdaptiveSelector): Optional, see
+      `server_core.handle_connection`; selections run in the default thread pool.
+    """
+
+    def __init__(self, encode, executor=None, chunk_size=WRITE_CHUNK_SIZE,
+                 stream_encode=None, cache=None, selector=None):
+        self.encode = encode
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.stream_encode = stream_encode
+        self.cache = cache
+        self.selector = selector
+
+    async def handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            socket_tuning.tune_accepted(sock)
+        logging.info(f"Connected by {client_address}")
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                span = timing.Span('server', request_id=request.get('request_id'),
+                                   size_mb=request.get('size_mb'),
+                                   codec=request.get('codec'))
+                flags = 0
+                try:
+                    if self.selector is not None:
+                        request, decision = await loop.run_in_executor(
+                            None, self.selector.resolve, request)
+                        if decision is not None:
+                            flags |= framing.FLAG_ADAPTIVE
+                    elif adaptive.AdaptiveSelector.is_auto(request):
+                        raise ValueError("This server was started without --adaptive")
+                    stream = None
+                    if self.stream_encode is not None:
+                        # Stream setup may encode (e.g. the progressive wavelet
+                        # transform), so it runs off the loop like the chunks do
+                        stream = await loop.run_in_executor(None, self.stream_encode, request)
+                    if stream is None:
+                        key = self.cache.key(request) if self.cache is not None else None
+                        entry = self.cache.get(key) if key is not None else None
+                        if entry is not None:
+                            codec_id, raw_length, payload, digests = entry
+                            flags |= framing.FLAG_CACHED
+                        else:
+                            (codec_id, raw_length, payload, digests), stages = \
+                                await loop.run_in_executor(self.executor, timing.collect,
+                                                           self.encode, request)
+                            span.stages.update(stages)
+                            if key is not None:
+                                await loop.run_in_executor(
+                                    None, self.cache.put, key, codec_id, raw_length,
+                                    payload, digests)
+                        span.mark('encoded')
+                except ValueError as e:
+                    message = str(e).encode('utf-8')
+                    await write_frame(writer, framing.CODEC_RAW, len(message),
+                                      message, flags=framing.FLAG_ERROR)
+                    span.finish(error=str(e))
+                    continue
+                # Writes only queue data until the transport drains, so the first
+                # byte is marked as the response starts going out
+                span.mark('first_byte_sent')
+                if stream is not None:
+                    header = await write_stream(writer, *stream, flags=flags)
+                else:
+                    start_time = time.perf_counter()
+                    header = await write_frame(writer, codec_id, raw_length, payload,
+                                               flags, chunk_size=self.chunk_size,
+                                               digests=digests)
+                    if self.selector is not None:
+                        self.selector.record_send(header.compressed_length,
+                                                  time.perf_counter() - start_time)
+                span.mark('last_byte_sent')
+                span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                            compressed_length=header.compressed_length,
+                            flags=header.flags)
+        except (framing.FrameError, asyncio.IncompleteReadError, ConnectionError) as e:
+            logging.error(f"Connection from {client_address} failed: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            logging.info(f"Connection from {client_address} closed")
+
+    async def start(self, host, port, backlog=server_core.DEFAULT_BACKLOG):
+        """
+        Starts listening on a socket tuned with the active socket_tuning profile.
+
+        Returns:
+        - asyncio.base_events.Server: The listening server.
+        """
+        return await asyncio.start_server(self.handle_connection,
+                                          sock=socket_tuning.listen(host, port, backlog))
+
+    async def serve_forever(self, host, port, backlog=server_core.DEFAULT_BACKLOG):
+        server = await self.start(host, port, backlog)
+        addresses = ', '.join(str(s.getsockname()) for s in server.sockets)
+        logging.info(f"Async server listening on {addresses}")
+        async with server:
+            await server.serve_forever()
+
+
+async def fetch(reader, writer, data_size, decode=None, executor=None, options=None):
+    """
+    Requests `data_size` megabytes on an open connection and waits for the response.
+
+    Parameters:
+    - reader (asyncio.StreamReader): The connection's reader.
+    - writer (asyncio.StreamWriter): The connection's writer.
+    - data_size (int): The size of the data to request in megabytes.
+    - decode (callable): Optional function of (header, payload) returning the
+      decoded data; runs in `executor` so it does not block the event loop.
+    - executor (concurrent.futures.Executor): Where `decode` runs.
+    - options (dict): Extra request fields, e.g. the `dataset` and `seed`.
+
+    Returns:
+    - tuple: (framing.FrameHeader, decoded data, elapsed seconds).
+    """
+    # Decoding runs in the executor, so the span gets a 'decoded' event rather
+    # than a stage, whose CPU time would be the event loop's
+    span, options = timing.client_span(data_size, options)
+    start_time = time.perf_counter()
+    writer.write(framing.encode_request(data_size, **options))
+    await writer.drain()
+    span.mark('request_sent')
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        socket_tuning.rearm(sock)
+    header, payload = await read_frame(
+        reader, on_header=lambda header: span.mark('first_byte_received'))
+    span.mark('last_byte_received')
+    data = payload
+    if decode is not None:
+        data = await asyncio.get_running_loop().run_in_executor(
+            executor, decode, header, payload)
+        span.mark('decoded')
+    elapsed_time = time.perf_counter() - start_time
+    span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                compressed_length=header.compressed_length, flags=header.flags)
+    return header, data, elapsed_time
+
+
+async def open_connection(host, port):
+    """
+    Opens a stream connection tuned with the active socket_tuning profile; the
+    options that must precede the handshake are set before connecting.
+
+    Returns:
+    - tuple: (asyncio.StreamReader, asyncio.StreamWriter).
+    """
+    loop = asyncio.get_running_loop()
+    family, kind, proto, _, address = (
+        await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM))[0]
+    sock = socket.socket(family, kind, proto)
+    try:
+        sock.setblocking(False)
+        socket_tuning.active().apply_before_connect(sock)
+        await loop.sock_connect(sock, address)
+        socket_tuning.active().apply_connected(sock)
+    except OSError:
+        sock.close()
+        raise
+    return await asyncio.open_connection(sock=sock)
+
+
+async def run_client(host, port, sizes, repeat, decode=None, executor=None, options=None):
+    """
+    Opens one connection and issues every size in `sizes`, `repeat` times.
+
+    Returns:
+    - list: (data size, elapsed seconds) for every completed request.
+    """
+    reader, writer = await open_connection(host, port)
+    results = []
+    try:
+        for _ in range(repeat):
+            for data_size in sizes:
+                _, _, elapsed_time = await fetch(reader, writer, data_size,
+                                                 decode, executor, options)
+                results.append((data_size, elapsed_time))
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+    return results
+
+
+async def run_clients(host, port, sizes, concurrency=DEFAULT_CONCURRENCY,
+                      repeat=1, decode=None, executor=None, options=None):
+    """
+    Runs `concurrency` clients side by side against one server.
+
+    Returns:
+    - list: (data size, elapsed seconds) for every completed request across all clients.
+    """
+    results = await asyncio.gather(
+        *(run_client(host, port, sizes, repeat, decode, executor, options)
+          for _ in range(concurrency)),
+        return_exceptions=True)
+    completed = []
+    for result in results:
+        if isinstance(result, BaseException):
+            logging.error(f"Client failed: {result}")
+            continue
+        completed.extend(result)
+    return completed
+
+
+def summarize(results):
+    """
+    Groups request latencies by size.
+
+    Parameters:
+    - results (list): (data size, elapsed seconds) pairs.
+
+    Returns:
+    - dict: For each size, a dict with count, median, p95 and max latency in seconds.
+    """
+    by_size = {}
+    for data_size, elapsed_time in results:
+        by_size.setdefault(data_size, []).append(elapsed_time)
+    summary = {}
+    for data_size, latencies in sorted(by_size.items()):
+        latencies.sort()
+        p95_index = min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))
+        summary[data_size] = {
+            'count': len(latencies),
+            'median': statistics.median(latencies),
+            'p95': latencies[p95_index],
+            'max': latencies[-1],
+        }
+    return summary
+
+
+def print_summary(results, wall_time):
+    """
+    Prints per-size latency statistics and aggregate throughput.
+
+    Parameters:
+    - results (list): (data size, elapsed seconds) pairs.
+    - wall_time (float): Total wall-clock time of the run in seconds.
+    """
+    total_mb = sum(data_size for data_size, _ in results)
+    for data_size, stats in summarize(results).items():
+        print(f"Data Size: {data_size}MB, Requests: {stats['count']}, "
+              f"Median: {stats['median']:.3f}s, P95: {stats['p95']:.3f}s, "
+              f"Max: {stats['max']:.3f}s")
+    if wall_time > 0:
+        print(f"Completed {len(results)} requests in {wall_time:.2f}s, "
+              f"aggregate throughput {total_mb / wall_time:.2f}MB/s")
+
+
+def make_executor(kind, workers=None):
+    """
+    Creates the executor the async server hands encoding to.
+
+    Parameters:
+    - kind (str): 'thread' for I/O-bound or GIL-releasing work, 'process' for CPU-bound codecs.
+    - workers (int): Pool size; defaults to `server_core.default_workers(kind)`.
+
+    Returns:
+    - concurrent.futures.Executor: The executor.
+    """
+    workers = workers or server_core.default_workers(kind)
+    if kind == 'process':
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='encode')
+
+
+def add_server_arguments(parser, host, port, executor='thread'):
+    """
+    Adds the async server command line options to an argparse parser.
+    """
+    parser.add_argument('--host', default=host, help='Address to bind to')
+    parser.add_argument('--port', type=int, default=port,
+                        help='Port to listen on')
+    parser.add_argument('--executor', choices=('thread', 'process'),
+                        default=executor, help='Where encoding runs')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Executor size (default depends on the executor)')
+    parser.add_argument('--chunk-size', type=int, default=WRITE_CHUNK_SIZE,
+                        help='Bytes written between drains')
+    payload_store.add_arguments(parser)
+    payload_cache.add_arguments(parser)
+    datasets.add_arguments(parser)
+    adaptive.add_arguments(parser)
+    socket_tuning.add_arguments(parser)
+    timing.add_arguments(parser)
+
+
+def run_server(args, encode, stream_encode=None):
+    """
+    Runs an AsyncServer configured from parsed `add_server_arguments` options
+    until interrupted.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed options.
+    - encode (callable): Module-level function taking a request dict and returning
+      (codec id, raw length, payload).
+    - stream_encode (callable): Optional streaming encoder, see AsyncServer.
+    """
+    if args.payload_dir:
+        payload_store.configure(args.payload_dir)
+    datasets.configure_from_arguments(args, pooled=args.executor == 'process')
+    if args.trace:
+        timing.configure(args.trace)
+    socket_tuning.configure_from_arguments(args)
+    with make_executor(args.executor, args.workers) as executor:
+        server = AsyncServer(encode, executor, chunk_size=args.chunk_size,
+                             stream_encode=stream_encode,
+                             cache=payload_cache.from_arguments(args),
+                             selector=adaptive.from_arguments(args))
+        print(f"Async server listening on {args.host}:{args.port} "
+              f"({args.executor} executor)")
+        try:
+            asyncio.run(server.serve_forever(args.host, args.port))
+        except KeyboardInterrupt:
+            print("Server is shutting down.")
+        finally:
+            if server.cache is not None:
+                print(f"Payload cache: {server.cache.stats}")
+            if server.selector is not None:
+                print(f"Adaptive selection: {server.selector}")
+
+
+def add_client_arguments(parser, host, port, codec=codec_registry.DEFAULT_CODEC):
+    """
+    Adds the async client command line options to an argparse parser; `codec` is
+    the default of --codec.
+    """
+    parser.add_argument('--host', default=host, help='Server address')
+    parser.add_argument('--port', type=int, default=port, help='Server port')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100],
+                        help='Data sizes to request, in MB')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Number of concurrent connections')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Times each connection requests every size')
+    datasets.add_client_arguments(parser)
+    codec_registry.add_client_arguments(parser, default=codec)
+    socket_tuning.add_arguments(parser)
+    timing.add_arguments(parser)
+
+
+def run_clients_main(args, decode=None):
+    """
+    Runs `run_clients` from parsed `add_client_arguments` options and prints a summary.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed options.
+    - decode (callable): Optional function of (header, payload) returning the decoded data.
+    """
+    if args.trace:
+        timing.configure(args.trace)
+    socket_tuning.configure_from_arguments(args)
+    start_time = time.perf_counter()
+    options = {'dataset': args.dataset, 'seed': args.seed,
+               **codec_registry.client_options(args)}
+    results = asyncio.run(run_clients(args.host, args.port, args.sizes,
+                                      args.concurrency, args.repeat, decode,
+                                      options=options))
+    print_summary(results, time.perf_counter() - start_time)
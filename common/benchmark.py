@@ -0,0 +1,761 @@
+import contextlib
+import csv
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from common import (adaptive, codec_registry, datasets, framing, integrity, netem,
+                    server_core, socket_tuning, striping, units)
+
+# Benchmark matrix runner. Every combination of codec, payload size, dataset and
+# concurrency is one case. A case opens `concurrency` connections. Each connection
+# sends `warmup` requests that are not measured. Then all connections start
+# together and send `repetitions` measured requests each. A request's latency
+# runs from sending it until its payload has been received, checked and decoded,
+# so it covers the whole path the clients measure.
+#
+# The server is one of the phase servers and serves every case. It runs either
+# as a subprocess on localhost (the default, so its CPU time can be told apart
+# from the client's), in a thread of this process, or elsewhere (`external`).
+#
+# Links are a dimension of the matrix too. 'direct' connects straight to the
+# server. Any other entry is a common/netem.py link specification, and its
+# cases go through a netem_proxy.py subprocess that emulates that link.
+#
+# With more than one stripe, every connection of a case is a
+# striping.StripedClient that fetches each object as that many byte ranges over
+# parallel connections, for comparison with `iperf3 -P`.
+#
+# The matrix runs once per socket tuning profile (`--socket`, see
+# common/socket_tuning.py). The profile is applied to the client's sockets and
+# handed to a started server; every row records it together with the options a
+# client socket actually got. `--sweep-buffers` runs every profile with a range
+# of buffer sizes and reports the fastest size for every case.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROXY_SCRIPT = os.path.join(REPO_ROOT, 'netem_proxy.py')
+DIRECT_LINK = 'direct'
+SERVER_SCRIPTS = {
+    'baseline': os.path.join(REPO_ROOT, 'Phase1_Baseline', 'server.py'),
+    'lz4': os.path.join(REPO_ROOT, 'Phase1_LZ4Compression', 'server.py'),
+    'fwt': os.path.join(REPO_ROOT, 'Phase2_FWT', 'server.py'),
+}
+SERVER_KINDS = ('subprocess', 'inprocess', 'external')
+PERCENTILES = (50, 95, 99)
+STARTUP_TIMEOUT = 30.0
+MB = 1024 * 1024
+
+# Columns of the CSV output, in order
+FIELDS = ('link', 'socket', 'codec', 'size_mb', 'dataset', 'concurrency', 'stripes',
+          'requests', 'errors',
+          'latency_mean_ms', 'latency_min_ms', 'latency_p50_ms', 'latency_p95_ms',
+          'latency_p99_ms', 'latency_max_ms', 'latency_stdev_ms', 'decode_p50_ms',
+          'verify_p50_ms', 'throughput_mb_s', 'wire_mb_s', 'compression_ratio', 'wall_s',
+          'cpu_s', 'client_cpu_s', 'server_cpu_s', 'cpu_ms_per_mb', 'socket_effective')
+
+
+def percentile(values, percent):
+    """
+    Linearly interpolated percentile of already sorted values.
+
+    Parameters:
+    - values (list): Sorted numbers; must not be empty.
+    - percent (float): Percentile between 0 and 100.
+
+    Returns:
+    - float: The percentile.
+    """
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def process_cpu_seconds(pid):
+    """
+    CPU time (user + system) of a process and all its live descendants, read
+    from /proc. Worker processes of a process-mode server are included.
+
+    Parameters:
+    - pid (int): The process id.
+
+    Returns:
+    - float: CPU seconds, or None where /proc is not available.
+    """
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            try:
+                with open(f'/proc/{current}/stat') as stat:
+                    # The command name may contain spaces, so split after it
+                    fields = stat.read().rsplit(')', 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+                for task in os.listdir(f'/proc/{current}/task'):
+                    with open(f'/proc/{current}/task/{task}/children') as children:
+                        pending.extend(int(child) for child in children.read().split())
+            except ProcessLookupError:
+                continue
+    except OSError:
+        return None
+    return total / ticks
+
+
+def free_port(host):
+    """A port on `host` that nothing listens on right now."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def wait_until_listening(host, port, process=None):
+    """
+    Waits until `host:port` accepts connections.
+
+    Parameters:
+    - process (subprocess.Popen): The process that should be listening; its
+      exit is reported at once instead of waiting for the timeout.
+
+    Raises:
+    - RuntimeError: If nothing listens within STARTUP_TIMEOUT or the process exits.
+    """
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{process.args[1]} exited with code {process.returncode}")
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Nothing is listening on {host}:{port}")
+            time.sleep(0.1)
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+class BenchmarkServer:
+    """
+    A phase server the benchmark runs against, started on localhost.
+
+    Parameters:
+    - phase (str): One of SERVER_SCRIPTS.
+    - kind (str): One of SERVER_KINDS.
+    - mode (str): Execution mode of the server (see server_core.EXECUTION_MODES).
+    - workers (int): Server workers; None keeps the server's default.
+    - host (str): Address of an external server.
+    - port (int): Port of an external server; 0 picks a free port otherwise.
+    - extra_args (list): More command line options for a subprocess server.
+    """
+
+    def __init__(self, phase='fwt', kind='subprocess', mode='thread', workers=None,
+                 host='127.0.0.1', port=0, extra_args=()):
+        if phase not in SERVER_SCRIPTS:
+            raise ValueError(f"Unknown server {phase!r}, expected one of {tuple(SERVER_SCRIPTS)}")
+        if kind not in SERVER_KINDS:
+            raise ValueError(f"Unknown server kind {kind!r}, expected one of {SERVER_KINDS}")
+        self.phase = phase
+        self.kind = kind
+        self.mode = mode
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.extra_args = list(extra_args)
+        self._process = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the server and waits until it accepts connections.
+
+        Raises:
+        - RuntimeError: If the server does not come up within STARTUP_TIMEOUT.
+        """
+        if self.kind == 'inprocess':
+            module = self._load_module()
+            self._server = server_core.ServerCore(
+                self.host, self.port, module.encode_response, mode=self.mode,
+                workers=self.workers,
+                stream_encode=getattr(module, 'stream_encode_response', None),
+                selector=adaptive.AdaptiveSelector())
+            self.port = self._server.address[1]
+            self._thread = threading.Thread(target=self._server.serve_forever,
+                                            name='benchmark-server', daemon=True)
+            self._thread.start()
+        elif self.kind == 'subprocess':
+            self.port = self.port or free_port(self.host)
+            command = [sys.executable, SERVER_SCRIPTS[self.phase], '--host', self.host,
+                       '--port', str(self.port), '--mode', self.mode]
+            if self.workers:
+                command += ['--workers', str(self.workers)]
+            self._process = subprocess.Popen(command + self.extra_args,
+                                             stdout=subprocess.DEVNULL,
+                                             stderr=subprocess.DEVNULL)
+        wait_until_listening(self.host, self.port, self._process)
+        return self
+
+    def _load_module(self):
+        # The phase directories are not packages, so load the script by path. It is
+        # registered in sys.modules so process-mode workers can unpickle its encoder.
+        name = f'nca_benchmark_{self.phase}_server'
+        if name not in sys.modules:
+            spec = importlib.util.spec_from_file_location(name, SERVER_SCRIPTS[self.phase])
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module
+            spec.loader.exec_module(module)
+        return sys.modules[name]
+
+    def cpu_seconds(self):
+        """
+        CPU seconds used by the server so far, or None if they cannot be told
+        apart from the client's (in-process) or are unknown (external).
+        """
+        if self._process is None:
+            return None
+        return process_cpu_seconds(self._process.pid)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._thread.join(timeout=5)
+        if self._process is not None:
+            stop_process(self._process)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __repr__(self):
+        return (f"BenchmarkServer(phase={self.phase!r}, kind={self.kind!r}, "
+                f"mode={self.mode!r}, address={self.host}:{self.port})")
+
+
+class EmulatedLink:
+    """
+    A netem_proxy.py subprocess in front of the server that emulates one link.
+    It runs in its own process so its CPU time counts for neither side.
+
+    Parameters:
+    - spec (str): Link specification, see common/netem.py.
+    - target (tuple): (host, port) of the server.
+    - host (str): Address the proxy listens on.
+    - seed (int): Seed for jitter and loss; None varies between runs.
+
+    Raises:
+    - ValueError: If the specification is invalid.
+    """
+
+    def __init__(self, spec, target, host='127.0.0.1', seed=None):
+        netem.parse_link(spec)  # Report a bad specification before starting anything
+        self.spec = spec
+        self.target = target
+        self.host = host
+        self.port = None
+        self.seed = seed
+        self._process = None
+
+    def start(self):
+        self.port = free_port(self.host)
+        command = [sys.executable, PROXY_SCRIPT, '--host', self.host, '--port', str(self.port),
+                   '--target', f"{self.target[0]}:{self.target[1]}", '--link', self.spec]
+        if self.seed is not None:
+            command += ['--link-seed', str(self.seed)]
+        self._process = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.DEVNULL)
+        wait_until_listening(self.host, self.port, self._process)
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            stop_process(self._process)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _Connection:
+    """
+    One client connection of a case, with its own reused receive buffer, or a
+    striped client with one connection per stripe.
+    """
+
+    def __init__(self, host, port, size_mb, request, stripes=1):
+        self.size_mb = size_mb
+        self.request = request
+        self.buffer = framing.ReceiveBuffer()
+        self.latencies = []
+        self.decode_times = []
+        self.verify_times = []
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.errors = 0
+        self.host = host
+        self.port = port
+        self.stripes = stripes
+        self.client_socket = None
+        self.striped = None
+        self._connect()
+        self.effective = socket_tuning.effective(self.client_socket or self.striped.sockets[0])
+
+    def _connect(self):
+        if self.stripes > 1:
+            self.striped = striping.StripedClient(self.host, self.port, self.stripes)
+        else:
+            self.client_socket = socket_tuning.connect(self.host, self.port)
+
+    def reopen(self):
+        """
+        Replaces a connection that can no longer be used with a new one.
+
+        Returns:
+        - bool: False if the server could not be reached.
+        """
+        self.close()
+        try:
+            self._connect()
+        except OSError as e:
+            logging.error(f"Reconnecting failed: {e}")
+            return False
+        return True
+
+    def _fetch_striped(self):
+        data, _, stripes = self.striped.fetch(self.size_mb, **self.request)
+        compressed_length = sum(stripe['compressed_length'] for stripe in stripes)
+        # The stripes decode side by side; the slowest one holds up the response
+        decode_time = max(stripe['decode_seconds'] for stripe in stripes)
+        verify_time = max(stripe['verify_seconds'] or 0.0 for stripe in stripes)
+        return len(data), compressed_length, decode_time, verify_time
+
+    def fetch(self, measure=True):
+        """
+        Sends one request and receives, verifies and decodes the response. With
+        `verify` in the request the decoded data is also checked against the
+        server's block digests, timed apart from decoding.
+
+        Returns:
+        - bool: False if the connection can no longer be used and has to be
+          reopened.
+        """
+        start_time = time.perf_counter()
+        try:
+            if self.striped is not None:
+                raw_length, compressed_length, decode_time, verify_time = \
+                    self._fetch_striped()
+            else:
+                verifier = integrity.BlockVerifier() if self.request.get('verify') else None
+                framing.send_request(self.client_socket, self.size_mb, **self.request)
+                socket_tuning.rearm(self.client_socket)
+                header, payload = framing.recv_frame(
+                    self.client_socket, buffer=self.buffer,
+                    on_header=verifier.expect if verifier is not None else None,
+                    on_data=verifier.wire if verifier is not None else None)
+                framing.verify_checksum(header, payload)
+                received_time = time.perf_counter()
+                data = codec_registry.decode(header, payload)
+                if len(data) != header.raw_length:
+                    raise framing.FrameError(
+                        f"Decoded {len(data)} bytes, expected {header.raw_length}")
+                raw_length, compressed_length = header.raw_length, header.compressed_length
+                decode_time = time.perf_counter() - received_time
+                if verifier is not None:
+                    verifier.check(header, data)
+                verify_time = verifier.seconds if verifier is not None else None
+        except (framing.ServerError, integrity.IntegrityError, ValueError, RuntimeError,
+                EOFError) as e:
+            # The error frame or a bad payload was consumed whole; the connection
+            # is still in sync
+            logging.error(f"Request for {self.size_mb}MB failed: {e}")
+            self.errors += measure
+            return True
+        except (framing.FrameError, OSError) as e:
+            # A truncated or malformed response leaves the connection out of sync
+            logging.error(f"Connection failed: {e}")
+            self.errors += measure
+            return False
+        end_time = time.perf_counter()
+        if measure:
+            self.latencies.append(end_time - start_time)
+            self.decode_times.append(decode_time)
+            if verify_time is not None:
+                self.verify_times.append(verify_time)
+            self.raw_bytes += raw_length
+            self.wire_bytes += compressed_length
+        return True
+
+    def close(self):
+        if self.striped is not None:
+            self.striped.close()
+            self.striped = None
+        if self.client_socket is not None:
+            self.client_socket.close()
+            self.client_socket = None
+
+
+def run_case(host, port, codec, size_mb, dataset, concurrency, repetitions,
+             warmup=1, seed=0, options=None, server=None, link=DIRECT_LINK, stripes=1):
+    """
+    Runs one case of the matrix.
+
+    Parameters:
+    - host (str): Server address.
+    - port (int): Server port.
+    - codec (str): Codec name (see codec_registry), or adaptive.AUTO_CODEC.
+    - size_mb (int): Requested size in megabytes.
+    - dataset (str): One of datasets.DATASETS.
+    - concurrency (int): Connections sending requests side by side.
+    - repetitions (int): Measured requests per connection.
+    - warmup (int): Unmeasured requests per connection before the measurement.
+    - seed (int): Dataset seed.
+    - options (dict): Extra request fields, e.g. `source` or `level`.
+    - server (BenchmarkServer): The server, for its CPU time; optional.
+    - link (str): The link the case runs over, for the result row; `host` and
+      `port` already lead through it.
+    - stripes (int): Byte-range stripes, each over its own connection, that every
+      request is split into.
+
+    Returns:
+    - dict: One result row with the keys of FIELDS.
+    """
+    request = {'codec': codec, 'dataset': dataset, 'seed': seed, **(options or {})}
+    connections = []
+    try:
+        for _ in range(concurrency):
+            connections.append(_Connection(host, port, size_mb, request, stripes))
+        # A barrier party for every connection plus this thread, which reads the clocks
+        barrier = threading.Barrier(concurrency + 1)
+
+        def run(connection):
+            usable = all(connection.fetch(measure=False) for _ in range(warmup))
+            barrier.wait()
+            for _ in range(repetitions):
+                if not usable and not connection.reopen():
+                    connection.errors += 1
+                    continue
+                usable = connection.fetch()
+
+        threads = [threading.Thread(target=run, args=(connection,), daemon=True)
+                   for connection in connections]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        server_cpu = server.cpu_seconds() if server is not None else None
+        cpu = time.process_time()
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - start_time
+        cpu = time.process_time() - cpu
+        if server_cpu is not None:
+            server_cpu = server.cpu_seconds() - server_cpu
+    finally:
+        for connection in connections:
+            connection.close()
+
+    latencies = sorted(itertools.chain.from_iterable(c.latencies for c in connections))
+    decode_times = sorted(itertools.chain.from_iterable(c.decode_times for c in connections))
+    verify_times = sorted(itertools.chain.from_iterable(c.verify_times for c in connections))
+    raw_bytes = sum(c.raw_bytes for c in connections)
+    wire_bytes = sum(c.wire_bytes for c in connections)
+    row = dict.fromkeys(FIELDS)
+    row.update({
+        'link': link, 'socket': socket_tuning.active().spec, 'codec': codec,
+        'size_mb': size_mb, 'dataset': dataset,
+        'concurrency': concurrency, 'stripes': stripes, 'requests': len(latencies),
+        'errors': sum(c.errors for c in connections), 'wall_s': wall_time,
+        'socket_effective': (socket_tuning.describe_effective(connections[0].effective)
+                             if connections else None),
+    })
+    if latencies:
+        row.update({
+            'latency_mean_ms': statistics.fmean(latencies) * 1000,
+            'latency_min_ms': latencies[0] * 1000,
+            'latency_max_ms': latencies[-1] * 1000,
+            'latency_stdev_ms': (statistics.stdev(latencies) * 1000
+                                 if len(latencies) > 1 else 0.0),
+            'decode_p50_ms': percentile(decode_times, 50) * 1000,
+            'verify_p50_ms': (percentile(verify_times, 50) * 1000
+                              if verify_times else None),
+            'throughput_mb_s': raw_bytes / MB / wall_time,
+            'wire_mb_s': wire_bytes / MB / wall_time,
+            'compression_ratio': raw_bytes / max(wire_bytes, 1),
+        })
+        for percent in PERCENTILES:
+            row[f'latency_p{percent}_ms'] = percentile(latencies, percent) * 1000
+    # In-process, this process's CPU time includes the server threads
+    if server is not None and server.kind == 'inprocess':
+        row['cpu_s'] = cpu
+    else:
+        row['client_cpu_s'] = cpu
+        row['server_cpu_s'] = server_cpu
+        row['cpu_s'] = cpu + server_cpu if server_cpu is not None else None
+    if row['cpu_s'] is not None and raw_bytes:
+        row['cpu_ms_per_mb'] = row['cpu_s'] * 1000 / (raw_bytes / MB)
+    return row
+
+
+def expand_matrix(codecs, sizes, dataset_names, concurrencies, links=(DIRECT_LINK,),
+                  stripe_counts=(1,)):
+    """
+    Lists every case of the matrix as (link, codec, size_mb, dataset, concurrency,
+    stripes), links and then datasets outermost so related cases run together.
+    """
+    return [(link, codec, size_mb, dataset, concurrency, stripes)
+            for link, dataset, size_mb, codec, concurrency, stripes
+            in itertools.product(links, dataset_names, sizes, codecs, concurrencies,
+                                 stripe_counts)]
+
+
+def run_matrix(addresses, cases, repetitions, warmup=1, seed=0, options=None,
+               server=None, report=None):
+    """
+    Runs every case in order.
+
+    Parameters:
+    - addresses (dict): (host, port) to connect to for every link of the cases.
+    - cases (list): (link, codec, size_mb, dataset, concurrency, stripes) tuples,
+      see `expand_matrix`.
+    - report (callable): Optional function called with every result row as it completes.
+    - The remaining parameters are passed to `run_case`.
+
+    Returns:
+    - list: The result rows.
+    """
+    rows = []
+    for link, codec, size_mb, dataset, concurrency, stripes in cases:
+        host, port = addresses[link]
+        row = run_case(host, port, codec, size_mb, dataset, concurrency, repetitions,
+                       warmup, seed, options, server, link, stripes)
+        rows.append(row)
+        if report is not None:
+            report(row)
+    return rows
+
+
+def environment(args=None):
+    """
+    Describes the machine and the settings of a run, stored with JSON results
+    so they can be compared later.
+    """
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'codecs_available': codec_registry.names(),
+        'arguments': vars(args) if args is not None else None,
+    }
+
+
+def format_row(row):
+    """
+    One line of human readable output for a result row.
+    """
+    summary = '' if row['link'] == DIRECT_LINK else f"[{row['link']}] "
+    if row['socket'] != socket_tuning.SocketProfile().spec:
+        summary += f"[{row['socket']}] "
+    summary += (f"{row['codec']:>10} {row['size_mb']:>5}MB {row['dataset']:>7} "
+               f"x{row['concurrency']:<3} n={row['requests']}")
+    if row['stripes'] > 1:
+        summary += f" P{row['stripes']}"
+    if row['requests']:
+        summary += (f" p50 {row['latency_p50_ms']:.1f}ms p95 {row['latency_p95_ms']:.1f}ms"
+                    f" p99 {row['latency_p99_ms']:.1f}ms, {row['throughput_mb_s']:.1f}MB/s,"
+                    f" ratio {row['compression_ratio']:.2f}")
+    if row['verify_p50_ms'] is not None:
+        summary += f", verify p50 {row['verify_p50_ms']:.1f}ms"
+    if row['cpu_s'] is not None:
+        summary += f", cpu {row['cpu_s']:.2f}s"
+    if row['errors']:
+        summary += f", {row['errors']} errors"
+    return summary
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: (f"{value:.6g}" if isinstance(value, float) else value)
+                             for key, value in row.items()})
+
+
+def write_json(path, rows, args=None):
+    with open(path, 'w') as output:
+        # Socket profiles among the arguments are stored as their specifications
+        json.dump({'environment': environment(args), 'results': rows}, output, indent=2,
+                  default=str)
+        output.write('\n')
+
+
+def add_arguments(parser):
+    """
+    Adds the benchmark matrix options to an argparse parser.
+    """
+    parser.add_argument('--server', choices=tuple(SERVER_SCRIPTS), default='fwt',
+                        help='Phase server to benchmark; every server accepts every codec')
+    parser.add_argument('--server-kind', choices=SERVER_KINDS, default='subprocess',
+                        help='Run the server as a subprocess, in this process, or use '
+                             'an already running one at --host/--port')
+    parser.add_argument('--server-mode', choices=server_core.EXECUTION_MODES,
+                        default='thread', help='Execution mode of the started server')
+    parser.add_argument('--server-workers', type=int, default=None,
+                        help='Workers of the started server')
+    parser.add_argument('--host', default='127.0.0.1', help='Server address')
+    parser.add_argument('--port', type=int, default=0,
+                        help='Server port (0 picks a free one for a started server)')
+    parser.add_argument('--codecs', nargs='+', default=['raw', 'lz4', 'fwt-haar'],
+                        choices=codec_registry.names() + (adaptive.AUTO_CODEC,),
+                        help='Codecs to compare (see common/codec_registry.py)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10],
+                        help='Payload sizes in MB')
+    parser.add_argument('--datasets', nargs='+', choices=datasets.DATASETS,
+                        default=['random', 'text', 'sensor'], help='Datasets to request')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1],
+                        help='Concurrent connections per case')
+    parser.add_argument('--stripes', type=int, nargs='+', default=[1],
+                        help='Byte-range stripes per request, each over its own connection '
+                             '(compare with iperf3 -P)')
+    parser.add_argument('--repetitions', type=int, default=10,
+                        help='Measured requests per connection')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Unmeasured requests per connection before measuring')
+    parser.add_argument('--links', nargs='+', default=[DIRECT_LINK],
+                        help=f'Links to run every case over: {DIRECT_LINK!r} or a link '
+                             f'specification such as {", ".join(netem.LINK_PRESETS)} or '
+                             '"rate=10mbit,delay=20ms" (see common/netem.py)')
+    parser.add_argument('--link-seed', type=int, default=None,
+                        help='Seed for emulated jitter and loss')
+    parser.add_argument('--socket', type=socket_tuning.profile_argument, nargs='+',
+                        default=[socket_tuning.SocketProfile()],
+                        help='Socket tuning profiles to run the matrix with, applied to the '
+                             'client and a started server (see common/socket_tuning.py)')
+    parser.add_argument('--sweep-buffers', type=units.parse_size, nargs='*', default=None,
+                        help='Run every profile with these SO_SNDBUF/SO_RCVBUF sizes (0 keeps '
+                             'autotuning; default: '
+                             f'{" ".join(socket_tuning.format_size(size) for size in socket_tuning.SWEEP_BUFFER_SIZES)}) '
+                             'and report the fastest for every case')
+    parser.add_argument('--seed', type=int, default=0, help='Dataset seed')
+    parser.add_argument('--source', choices=('memory', 'file'), default='memory',
+                        help='Generate each payload or serve it from a payload file')
+    integrity.add_client_arguments(parser)
+    parser.add_argument('--csv', default=None, help='Write the results to this CSV file')
+    parser.add_argument('--json', default=None,
+                        help='Write the results and the environment to this JSON file')
+
+
+def socket_profiles(args):
+    """
+    The socket tuning profiles of parsed `add_arguments` options: the `--socket`
+    profiles, each with every `--sweep-buffers` size when sweeping.
+    """
+    if args.sweep_buffers is None:
+        return list(args.socket)
+    sizes = args.sweep_buffers or socket_tuning.SWEEP_BUFFER_SIZES
+    return [profile.with_buffers(size) for profile in args.socket for size in sizes]
+
+
+def best_profiles(rows):
+    """
+    Picks the socket profile with the highest throughput for every case that ran
+    with more than one profile.
+
+    Returns:
+    - list: The fastest row of every such case.
+    """
+    cases = {}
+    for row in rows:
+        key = tuple(row[field] for field in ('link', 'codec', 'size_mb', 'dataset',
+                                             'concurrency', 'stripes'))
+        cases.setdefault(key, []).append(row)
+    return [max(candidates, key=lambda row: row['throughput_mb_s'] or 0)
+            for candidates in cases.values() if len(candidates) > 1]
+
+
+def _run_profile(args, cases, profile, output):
+    # Clients of this process and in-process servers use the active profile; a
+    # started server gets it on the command line
+    socket_tuning.configure(profile)
+    extra_args = ['--socket', profile.spec]
+    if adaptive.AUTO_CODEC in args.codecs:
+        extra_args.append('--adaptive')
+    server = BenchmarkServer(args.server, args.server_kind, args.server_mode,
+                             args.server_workers, args.host, args.port,
+                             extra_args=extra_args)
+    options = {'source': args.source}
+    if args.verify:
+        options['verify'] = True
+    with contextlib.ExitStack() as stack:
+        if args.server_kind != 'external':
+            stack.enter_context(server)
+        if args.server_kind == 'inprocess':
+            # Keep the server's per-request prints out of the report
+            stack.enter_context(contextlib.redirect_stdout(
+                stack.enter_context(open(os.devnull, 'w'))))
+        addresses = {}
+        for link in args.links:
+            if link == DIRECT_LINK:
+                addresses[link] = (server.host, server.port)
+            else:
+                emulated = stack.enter_context(EmulatedLink(
+                    link, (server.host, server.port), seed=args.link_seed))
+                addresses[link] = (emulated.host, emulated.port)
+        print(f"Running {len(cases)} cases against {server} with {profile}", file=output)
+        return run_matrix(
+            addresses, cases, args.repetitions, args.warmup, args.seed,
+            options, server if args.server_kind != 'external' else None,
+            report=lambda row: print(format_row(row), file=output, flush=True))
+
+
+def run_from_arguments(args):
+    """
+    Runs the matrix described by parsed `add_arguments` options once per socket
+    profile, printing each case as it completes and writing the requested output
+    files. With more than one profile the fastest one of every case is listed.
+
+    Returns:
+    - list: The result rows.
+    """
+    cases = expand_matrix(args.codecs, args.sizes, args.datasets, args.concurrency,
+                          args.links, args.stripes)
+    output = sys.stdout
+    rows = []
+    previous = socket_tuning.active()
+    try:
+        for profile in socket_profiles(args):
+            rows += _run_profile(args, cases, profile, output)
+    finally:
+        socket_tuning.configure(previous)
+    best = best_profiles(rows)
+    if best:
+        print("Fastest socket profile per case:", file=output)
+        for row in best:
+            print(f"  {format_row(row)} (effective {row['socket_effective']})", file=output)
+    if args.csv:
+        write_csv(args.csv, rows)
+    if args.json:
+        write_json(args.json, rows, args)
+    return rows
@@ -0,0 +1,652 @@
+import bz2
+import lzma
+import zlib
+
+import lz4.frame
+import numpy as np
+
+from common import (framing, lifting, parallel_wavelet, payload_store, wavelet_codec,
+                    wavelet_container)
+
+try:
+    import zstandard
+except ImportError:  # Optional; the 'zstd' codec is only registered when installed
+    zstandard = None
+
+# Every encoding the servers can apply, behind one interface, so one server
+# process can serve any codec to the same client. A request names the codec with
+# `"codec"`, either one name or a list in order of preference; the server uses
+# the first one it has and reports it as the codec id of the response header, so
+# the client always knows how to decode. Codec parameters are further request
+# fields, e.g. `"level"`, or `"zstd_level"` for a level only that codec takes.
+#
+# A codec encodes whole payloads (`encode`/`decode`) and, if `streamable`, also
+# block by block: `compressor` returns an object whose `compress(block)` output is
+# decodable as soon as it arrives and `decompressor` one that undoes it chunk by
+# chunk. `encode_block` encodes one block on its own, for the pipelined mode; a
+# stream of such blocks decodes with the same decompressor.
+DEFAULT_CODEC = 'raw'
+
+LZ4_BLOCK_SIZES = {
+    64: lz4.frame.BLOCKSIZE_MAX64KB,
+    256: lz4.frame.BLOCKSIZE_MAX256KB,
+    1024: lz4.frame.BLOCKSIZE_MAX1MB,
+    4096: lz4.frame.BLOCKSIZE_MAX4MB,
+}
+
+# The float64 Haar transform has fixed parameters: the client derives the band
+# boundaries from the raw length alone.
+FWT_WAVELET = 'haar'
+FWT_LEVEL = 3
+
+
+def _int_param(request, name, default, low, high):
+    value = request.get(name, default)
+    if value is None:
+        return default
+    if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+        raise ValueError(f"{name} must be an integer between {low} and {high}, got {value!r}")
+    return value
+
+
+def _level_param(request, codec_name, default, low, high):
+    # `<codec>_level` (e.g. `zstd_level`) holds a level meant for that codec
+    # only, so a preference list falls back without it; `level` applies to any
+    name = f"{codec_name}_level"
+    if request.get(name) is None:
+        name = 'level'
+    return _int_param(request, name, default, low, high)
+
+
+class Codec:
+    """
+    Base class of the registered codecs; the default implementation sends the
+    data unchanged.
+
+    Attributes:
+    - name (str): The name requests use.
+    - codec_id (int): The framing.CODEC_* identifier carried in the header.
+    - streamable (bool): Whether the codec can encode block by block.
+    - lossless (bool): Whether decoding reproduces the input exactly.
+    - dtype (np.dtype): Element type of the decoded data; samples are bytes
+      unless the codec decodes to float64.
+    """
+
+    name = 'raw'
+    codec_id = framing.CODEC_RAW
+    streamable = True
+    lossless = True
+    dtype = np.uint8
+
+    def params(self, request):
+        """
+        Extracts and validates the codec's parameters from a request.
+
+        Returns:
+        - dict: Keyword arguments for `encode`, `encode_block` and `compressor`.
+
+        Raises:
+        - ValueError: If a parameter is invalid.
+        """
+        return {}
+
+    def encode(self, data, **params):
+        return data
+
+    def decode(self, payload, raw_length):
+        return payload
+
+    def encode_block(self, block, **params):
+        return self.encode(block, **params)
+
+    def compressor(self, **params):
+        return _Identity()
+
+    def decompressor(self, raw_length, block_size):
+        return _Identity()
+
+    def tag(self, params):
+        """
+        Names an encoding with its parameters for payload files, e.g. 'lz4-level9'.
+        """
+        return '-'.join([self.name] + [f"{key}{value}" for key, value in sorted(params.items())
+                                       if value is not None])
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name={self.name!r}, codec_id={self.codec_id})"
+
+
+class _Identity:
+    eof = False
+
+    def compress(self, block):
+        return block
+
+    def decompress(self, chunk):
+        return chunk
+
+    def flush(self):
+        return b''
+
+
+class _Sequential:
+    """
+    Decompresses a byte stream of one or more concatenated compressed streams
+    (pipelined responses hold one per block) with a fresh decompressor per stream.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.decompressor = factory()
+        self.eof = False
+
+    def decompress(self, chunk):
+        output = []
+        while chunk:
+            if self.decompressor.eof:
+                self.decompressor = self.factory()
+            output.append(self.decompressor.decompress(chunk))
+            chunk = self.decompressor.unused_data if self.decompressor.eof else b''
+        self.eof = self.decompressor.eof
+        return b''.join(output)
+
+    def flush(self):
+        return b''
+
+
+class LZ4Codec(Codec):
+    """LZ4 frames; `level` is the compression level and `block_kb` the LZ4 block size."""
+
+    name = 'lz4'
+    codec_id = framing.CODEC_LZ4
+
+    def params(self, request):
+        block_kb = _int_param(request, 'block_kb', 64, 64, 4096)
+        if block_kb not in LZ4_BLOCK_SIZES:
+            raise ValueError(f"block_kb must be one of {sorted(LZ4_BLOCK_SIZES)}, got {block_kb}")
+        return {'level': _level_param(request, self.name, 0, 0, 16), 'block_kb': block_kb}
+
+    def encode(self, data, level=0, block_kb=64):
+        return lz4.frame.compress(data, compression_level=level,
+                                  block_size=LZ4_BLOCK_SIZES[block_kb])
+
+    def decode(self, payload, raw_length):
+        return lz4.frame.decompress(payload)
+
+    def compressor(self, level=0, block_kb=64):
+        return _LZ4Compressor(level, block_kb)
+
+    def decompressor(self, raw_length, block_size):
+        return _Sequential(lz4.frame.LZ4FrameDecompressor)
+
+    def tag(self, params):
+        # Default parameters keep the historical payload file name 'lz4'
+        return self.name if params == {'level': 0, 'block_kb': 64} else super().tag(params)
+
+
+class _LZ4Compressor:
+    def __init__(self, level, block_kb):
+        self.compressor = lz4.frame.LZ4FrameCompressor(
+            compression_level=level, block_size=LZ4_BLOCK_SIZES[block_kb], auto_flush=True)
+        self.pending = self.compressor.begin()
+
+    def compress(self, block):
+        output = self.pending + self.compressor.compress(block)
+        self.pending = b''
+        return output
+
+    def flush(self):
+        return self.pending + self.compressor.flush()
+
+
+class ZlibCodec(Codec):
+    """DEFLATE in a zlib stream; `level` 0-9."""
+
+    name = 'zlib'
+    codec_id = framing.CODEC_ZLIB
+
+    def params(self, request):
+        return {'level': _level_param(request, self.name, 6, 0, 9)}
+
+    def encode(self, data, level=6):
+        return zlib.compress(data, level)
+
+    def decode(self, payload, raw_length):
+        return zlib.decompress(payload, bufsize=max(raw_length, 1))
+
+    def compressor(self, level=6):
+        return _ZlibCompressor(level)
+
+    def decompressor(self, raw_length, block_size):
+        return _Sequential(zlib.decompressobj)
+
+
+class _ZlibCompressor:
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level)
+
+    def compress(self, block):
+        # A sync flush per block lets the client decode it without waiting for more
+        return self.compressor.compress(block) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class BZ2Codec(Codec):
+    """bzip2; `level` 1-9. Output appears in 100-900KB steps when streamed."""
+
+    name = 'bz2'
+    codec_id = framing.CODEC_BZ2
+
+    def params(self, request):
+        return {'level': _level_param(request, self.name, 9, 1, 9)}
+
+    def encode(self, data, level=9):
+        return bz2.compress(data, level)
+
+    def decode(self, payload, raw_length):
+        return bz2.decompress(payload)
+
+    def compressor(self, level=9):
+        return bz2.BZ2Compressor(level)
+
+    def decompressor(self, raw_length, block_size):
+        return _Sequential(bz2.BZ2Decompressor)
+
+
+class LZMACodec(Codec):
+    """xz/LZMA2; `level` is the preset 0-9."""
+
+    name = 'lzma'
+    codec_id = framing.CODEC_LZMA
+
+    def params(self, request):
+        return {'level': _level_param(request, self.name, 6, 0, 9)}
+
+    def encode(self, data, level=6):
+        return lzma.compress(data, preset=level)
+
+    def decode(self, payload, raw_length):
+        return lzma.decompress(payload)
+
+    def compressor(self, level=6):
+        return _LZMACompressor(level)
+
+    def decompressor(self, raw_length, block_size):
+        return _Sequential(lzma.LZMADecompressor)
+
+
+class _LZMACompressor:
+    def __init__(self, level):
+        self.compressor = lzma.LZMACompressor(preset=level)
+
+    def compress(self, block):
+        return self.compressor.compress(block)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class ZstdCodec(Codec):
+    """Zstandard; `level` 1-22. Needs the optional `zstandard` package."""
+
+    name = 'zstd'
+    codec_id = framing.CODEC_ZSTD
+
+    def params(self, request):
+        return {'level': _level_param(request, self.name, 3, 1, 22)}
+
+    def encode(self, data, level=3):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    def decode(self, payload, raw_length):
+        return zstandard.ZstdDecompressor().decompress(payload, max_output_size=raw_length)
+
+    def compressor(self, level=3):
+        return _ZstdCompressor(level)
+
+    def decompressor(self, raw_length, block_size):
+        return _Sequential(lambda: zstandard.ZstdDecompressor().decompressobj())
+
+
+class _ZstdCompressor:
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, block):
+        return (self.compressor.compress(block)
+                + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK))
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+def coefficient_lengths(raw_length, wavelet=FWT_WAVELET, level=FWT_LEVEL):
+    """
+    Computes the band lengths `pywt.wavedec` produces for a signal of `raw_length` samples.
+
+    Parameters:
+    - raw_length (int): Number of samples in the original signal.
+    - wavelet (str): Wavelet name used by the server.
+    - level (int): Decomposition level used by the server.
+
+    Returns:
+    - list: Band lengths ordered like the `wavedec` output (approximation first).
+    """
+    # wavedec returns [cA_n, cD_n, ..., cD_1]
+    return parallel_wavelet.band_lengths(raw_length, wavelet, level)
+
+
+class FwtHaarCodec(Codec):
+    """
+    The float64 `pywt.wavedec` Haar bands (level 3), concatenated approximation
+    first. Lossless up to floating point, but 8 bytes per 8-bit sample.
+    """
+
+    name = 'fwt-haar'
+    codec_id = framing.CODEC_FWT_HAAR
+    dtype = np.float64
+
+    def encode(self, data):
+        if not len(data):
+            # pywt rejects empty signals; an empty signal has empty bands
+            return np.empty(0, dtype=np.float64)
+        # Block-parallel for large signals, see common.parallel_wavelet
+        return parallel_wavelet.wavedec(data, FWT_WAVELET, FWT_LEVEL)
+
+    def decode(self, payload, raw_length):
+        flat = np.frombuffer(payload, dtype=np.float64)
+        if not raw_length:
+            return flat
+        return parallel_wavelet.waverec(flat, raw_length, FWT_WAVELET, FWT_LEVEL)
+
+    def compressor(self):
+        return _BlockCompressor(self.encode)
+
+    def decompressor(self, raw_length, block_size):
+        return _FwtDecompressor(self, raw_length, block_size)
+
+
+class _BlockCompressor:
+    def __init__(self, encode):
+        self.encode = encode
+
+    def compress(self, block):
+        return self.encode(block)
+
+    def flush(self):
+        return b''
+
+
+class _FwtDecompressor:
+    """Every chunk holds the bands of one `block_size` block."""
+
+    def __init__(self, codec, raw_length, block_size):
+        self.codec = codec
+        self.remaining = raw_length
+        self.block_size = block_size
+        self.eof = raw_length == 0
+
+    def decompress(self, chunk):
+        if self.eof:
+            raise ValueError("Received more blocks than the raw length covers")
+        size = min(self.block_size, self.remaining)
+        self.remaining -= size
+        self.eof = self.remaining == 0
+        return self.codec.decode(chunk, size)
+
+    def flush(self):
+        return b''
+
+
+class FwtLossyCodec(Codec):
+    """The thresholding, quantizing wavelet codec of common.wavelet_codec."""
+
+    name = 'fwt-lossy'
+    codec_id = framing.CODEC_FWT_LOSSY
+    streamable = False
+    lossless = False
+    dtype = np.float64
+
+    def params(self, request):
+        return {'params': wavelet_codec.WaveletParams.from_request(request)}
+
+    def encode(self, data, params=None):
+        if not len(data):
+            raise ValueError(f"{self.name} cannot encode an empty signal")
+        return wavelet_codec.encode(data, params)
+
+    def decode(self, payload, raw_length):
+        return wavelet_codec.decode(payload)
+
+    def tag(self, params):
+        return '-'.join([self.name] + [f"{key}{value}" for key, value
+                                       in sorted(params['params'].as_dict().items())])
+
+
+class FwtLiftingCodec(Codec):
+    """
+    The lossless integer Haar lifting transform of common.lifting, int16 bands in
+    a wavelet container; `level` limits the number of levels. The container
+    holds the bands coarse to fine, so it can be decoded progressively (see
+    common.progressive).
+    """
+
+    name = 'fwt-lifting'
+    codec_id = framing.CODEC_FWT_LIFTING
+    streamable = False
+
+    def params(self, request):
+        level = request.get('level')
+        if level is not None and (not isinstance(level, int) or level < 0):
+            raise ValueError(f"Invalid lifting level {level!r}")
+        return {'level': level}
+
+    def encode(self, data, level=None):
+        return b''.join(self.encode_parts(data, level))
+
+    def encode_parts(self, data, level=None):
+        """
+        Like `encode`, but returns the container header and the bands as
+        separate buffers, approximation first, see wavelet_container.encode_parts.
+        """
+        signal, level = lifting.encode_bytes(data, level)
+        return wavelet_container.encode_parts(lifting.band_views(signal, level), 'haar-int')
+
+    def decode(self, payload, raw_length):
+        _, bands = wavelet_container.decode(payload)
+        signal, level = lifting.from_bands(bands, raw_length)
+        return lifting.decode_bytes(signal, level)
+
+
+_registry = {}
+_by_id = {}
+
+
+def register(codec):
+    """
+    Adds a codec to the registry under its name and codec id.
+
+    Parameters:
+    - codec (Codec): The codec instance.
+    """
+    _registry[codec.name] = codec
+    _by_id[codec.codec_id] = codec
+
+
+for _codec in (Codec(), LZ4Codec(), ZlibCodec(), BZ2Codec(), LZMACodec(),
+               FwtHaarCodec(), FwtLossyCodec(), FwtLiftingCodec()):
+    register(_codec)
+if zstandard is not None:
+    register(ZstdCodec())
+
+
+def names():
+    """Names of the registered codecs."""
+    return tuple(_registry)
+
+
+def get(name):
+    """
+    Looks up a codec by name.
+
+    Raises:
+    - ValueError: If no such codec is registered.
+    """
+    codec = _registry.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown codec {name!r}, expected one of {names()}")
+    return codec
+
+
+def by_id(codec_id):
+    """
+    Looks up a codec by the codec id of a response header.
+
+    Raises:
+    - ValueError: If no registered codec has this id.
+    """
+    codec = _by_id.get(codec_id)
+    if codec is None:
+        raise ValueError(f"No codec for codec id {codec_id}")
+    return codec
+
+
+def request_codec(request, default=DEFAULT_CODEC):
+    """
+    Picks the codec a request asks for and parses its parameters.
+
+    `"codec"` is one name or a list of names in order of preference; the first
+    registered one is used.
+
+    Parameters:
+    - request (dict): The decoded request.
+    - default (str): Codec used when the request names none.
+
+    Returns:
+    - tuple: (Codec, parameter dict).
+
+    Raises:
+    - ValueError: If no requested codec is available or a parameter is invalid.
+    """
+    wanted = request.get('codec') or default
+    if isinstance(wanted, str):
+        wanted = [wanted]
+    if not isinstance(wanted, list) or not all(isinstance(name, str) for name in wanted):
+        raise ValueError(f"codec must be a name or a list of names, got {wanted!r}")
+    for name in wanted:
+        codec = _registry.get(name)
+        if codec is not None:
+            return codec, codec.params(request)
+    raise ValueError(f"None of the codecs {wanted} is available; this server has {names()}")
+
+
+def compress_blocks(codec, params, blocks):
+    """
+    Encodes blocks through one streaming compressor context.
+
+    Parameters:
+    - codec (Codec): A streamable codec.
+    - params (dict): Its parameters, see `request_codec`.
+    - blocks (iterable): The raw blocks.
+
+    Yields:
+    - bytes-like: Encoded output as each block is compressed, then the end of
+      the stream. Empty outputs are skipped.
+    """
+    compressor = codec.compressor(**params)
+    for block in blocks:
+        output = compressor.compress(block)
+        if len(output):
+            yield output
+    output = compressor.flush()
+    if len(output):
+        yield output
+
+
+def compress_file(codec, params, block_size=payload_store.WRITE_BLOCK_SIZE):
+    """
+    Builds a `payload_store.PayloadStore.derived` transform that encodes a file
+    with a streamable codec, one block at a time.
+
+    Returns:
+    - callable: Called with (source file, destination file).
+    """
+    def transform(source, destination):
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        compressor = codec.compressor(**params)
+        while True:
+            count = source.readinto(buffer)
+            if not count:
+                break
+            destination.write(compressor.compress(view[:count]))
+        destination.write(compressor.flush())
+
+    return transform
+
+
+def file_payload(codec, params, size_in_mb, dataset, seed):
+    """
+    Returns the payload file of a file-backed request, creating it if needed.
+
+    Parameters:
+    - codec (Codec): The codec the request selected.
+    - params (dict): Its parameters.
+    - size_in_mb (int): Size of the raw payload in megabytes.
+    - dataset (str): Dataset of the raw payload.
+    - seed (int): The dataset seed.
+
+    Returns:
+    - payload_store.FilePayload: The raw file for the identity codec or a file
+      encoded once with a streamable codec; None for the other codecs, which the
+      caller encodes from the raw file.
+    """
+    store = payload_store.get_store()
+    if codec.codec_id == framing.CODEC_RAW:
+        return store.raw(size_in_mb, dataset, seed)
+    if not codec.streamable:
+        return None
+    return store.derived(codec.tag(params), size_in_mb, compress_file(codec, params),
+                         dataset, seed)
+
+
+def decode(header, payload):
+    """
+    Decodes a whole-frame response with the codec named in its header.
+
+    Parameters:
+    - header (framing.FrameHeader): The response header.
+    - payload (bytes-like): The encoded payload.
+
+    Returns:
+    - bytes-like or np.ndarray: The decoded data; the wavelet codecs return arrays.
+
+    Raises:
+    - ValueError: If the codec id is unknown.
+    """
+    return by_id(header.codec_id).decode(payload, header.raw_length)
+
+
+def add_client_arguments(parser, default=DEFAULT_CODEC):
+    """
+    Adds the --codec and --codec-level options to a client's argparse parser.
+    """
+    parser.add_argument('--codec', nargs='+', default=[default],
+                        help=f'Codec, or codecs in order of preference (available: {", ".join(names())})')
+    parser.add_argument('--codec-level', type=int, default=None,
+                        help='Compression level of the first --codec (codec specific); '
+                             'the others use their default. Not for the wavelet codecs')
+
+
+def client_options(args):
+    """
+    Request fields for parsed `add_client_arguments` options. The level is sent
+    as `<codec>_level` of the first codec, so a fallback codec never gets a level
+    outside its range and the wavelet codecs never take it for a decomposition level.
+    """
+    options = {'codec': args.codec[0] if len(args.codec) == 1 else args.codec}
+    if args.codec_level is not None:
+        options[f"{args.codec[0]}_level"] = args.codec_level
+    return options
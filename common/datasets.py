@@ -0,0 +1,546 @@
+import concurrent.futures
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Data sources for the servers. Random bytes cannot be compressed by LZ4 nor
+# sparsified by wavelets, so besides 'random' the servers can generate data that
+# resembles real traffic, selected per request with `"dataset"` and `"seed"`.
+#
+# Every generated dataset is an endless byte stream cut into BLOCK_SIZE blocks.
+# Block i depends only on (seed, i), so the same request always yields the same
+# bytes and any byte range can be regenerated without producing what precedes it.
+#
+# 'random' is the raw output of a PCG64 generator seeded per block. It is several
+# times faster than os.urandom, which goes through the kernel's CSPRNG, and the
+# benchmark needs uniform bytes rather than secret ones. A range is generated into
+# one preallocated buffer: its blocks are filled side by side by a thread pool,
+# which works because NumPy releases the GIL while it draws the numbers.
+#
+# The other generators can only produce whole blocks. A range that starts or
+# ends inside a block (a byte range, a stripe or a stream block below BLOCK_SIZE)
+# keeps that block in a small per-process cache, so the neighbouring range
+# reuses it instead of generating it again.
+BLOCK_SIZE = 1024 * 1024
+# Partially used blocks kept for the neighbouring ranges
+BLOCK_CACHE_BLOCKS = 8
+# Ranges shorter than this are filled on the calling thread
+MIN_PARALLEL_LENGTH = 2 * BLOCK_SIZE
+DEFAULT_DATASET = 'random'
+CORPUS_DATASET = 'corpus'
+# Read by worker processes too, so it works with fork and spawn alike
+CORPUS_DIR_ENV = 'NCA_CORPUS_DIR'
+MAX_SEED = 2 ** 63 - 1
+
+WORDS = (
+    'the of and to in is that for it as was with be by on not he this are or his '
+    'from at which but have an they you were her she there been one all we their '
+    'has would when if so no will more can said who out about up what some into '
+    'them time only other new like could these two may first then do any now such '
+    'people my over also its after most made should did many before must through '
+    'years where much your way well down even because here between both each just '
+    'those how too under never same another while last might great since against '
+    'right three states still world own public however during without again place '
+    'around home small large number system data network packet server client '
+    'request response latency throughput buffer stream signal wavelet compression '
+    'block frame socket kernel memory cache window queue thread process value'
+).split()
+WORD_BYTES = [word.encode('ascii') for word in WORDS]
+# Zipf-Mandelbrot word frequencies: a few very common words and a long tail
+WORD_CDF = np.cumsum(1.0 / (np.arange(len(WORDS)) + 2.7))
+WORD_CDF /= WORD_CDF[-1]
+SEPARATORS = (b' ', b'. ', b', ', b'.\n')
+SEPARATOR_CDF = np.cumsum((0.86, 0.08, 0.05, 0.01))
+SEPARATOR_CDF /= SEPARATOR_CDF[-1]
+# Every word followed by every separator, indexed by word * len(SEPARATORS) + separator
+TOKENS = [word + separator for word in WORD_BYTES for separator in SEPARATORS]
+LOG_LEVELS = ('DEBUG', 'INFO', 'INFO', 'INFO', 'INFO', 'WARN', 'ERROR')
+LOG_SERVICES = ('api', 'auth', 'billing', 'search', 'storage', 'gateway')
+LOG_METHODS = ('GET', 'GET', 'GET', 'POST', 'PUT', 'DELETE')
+LOG_PATHS = ('/api/v1/items/{}', '/api/v1/users/{}', '/api/v1/orders/{}',
+             '/static/img/{}.png', '/healthz', '/api/v1/search?q={}')
+LOG_STATUSES = (200, 200, 200, 200, 201, 204, 301, 304, 400, 404, 500, 503)
+JSON_EVENTS = ('view', 'click', 'purchase', 'login', 'logout', 'scroll', 'share')
+JSON_TAGS = ('mobile', 'desktop', 'beta', 'eu', 'us', 'apac', 'returning', 'new')
+# Fixed epoch (2024-01-01T00:00:00Z) for generated timestamps, in milliseconds
+BASE_TIMESTAMP_MS = 1704067200000
+
+
+def _block_rng(seed, index, tag):
+    return np.random.default_rng([seed, index, tag])
+
+
+def _fit(data, size):
+    """Trims or cyclically extends `data` to exactly `size` bytes."""
+    if len(data) >= size:
+        return data[:size]
+    return (data * (size // max(len(data), 1) + 1))[:size]
+
+
+def text_block(seed, index, size):
+    """English-like prose: Zipf-distributed words with sentence punctuation."""
+    rng = _block_rng(seed, index, 1)
+    count = size // 4 + 16
+    words = np.searchsorted(WORD_CDF, rng.random(count))
+    separators = np.searchsorted(SEPARATOR_CDF, rng.random(count))
+    tokens = words * len(SEPARATORS) + separators
+    return _fit(b''.join(map(TOKENS.__getitem__, tokens.tolist())), size)
+
+
+def logs_block(seed, index, size):
+    """Access-log lines with increasing timestamps and skewed field values."""
+    rng = _block_rng(seed, index, 2)
+    count = size // 80 + 16
+    timestamps = BASE_TIMESTAMP_MS + index * 3_600_000 + np.cumsum(rng.integers(0, 40, count))
+    levels = rng.integers(0, len(LOG_LEVELS), count)
+    services = rng.integers(0, len(LOG_SERVICES), count)
+    methods = rng.integers(0, len(LOG_METHODS), count)
+    paths = rng.integers(0, len(LOG_PATHS), count)
+    ids = rng.zipf(1.5, count) % 100000
+    statuses = rng.integers(0, len(LOG_STATUSES), count)
+    latencies = rng.lognormal(3.0, 0.8, count)
+    lines = []
+    for ts, level, service, method, path, item, status, latency in zip(
+            timestamps.tolist(), levels.tolist(), services.tolist(), methods.tolist(),
+            paths.tolist(), ids.tolist(), statuses.tolist(), latencies.tolist()):
+        seconds, millis = divmod(ts, 1000)
+        lines.append(
+            f"{seconds}.{millis:03d} {LOG_LEVELS[level]} [{LOG_SERVICES[service]}] "
+            f"{LOG_METHODS[method]} {LOG_PATHS[path].format(item)} "
+            f"status={LOG_STATUSES[status]} latency_ms={latency:.1f}\n")
+    return _fit(''.join(lines).encode('ascii'), size)
+
+
+def json_block(seed, index, size):
+    """Newline-delimited JSON event records."""
+    rng = _block_rng(seed, index, 3)
+    count = size // 120 + 16
+    first_id = index * (BLOCK_SIZE // 100)
+    timestamps = BASE_TIMESTAMP_MS + index * 3_600_000 + np.cumsum(rng.integers(0, 100, count))
+    users = rng.zipf(1.4, count) % 50000
+    events = rng.integers(0, len(JSON_EVENTS), count)
+    values = np.round(rng.gamma(2.0, 20.0, count), 2)
+    flags = rng.random(count) < 0.9
+    tag_pairs = rng.integers(0, len(JSON_TAGS), (count, 2))
+    records = []
+    for offset, (ts, user, event, value, ok, tags) in enumerate(zip(
+            timestamps.tolist(), users.tolist(), events.tolist(), values.tolist(),
+            flags.tolist(), tag_pairs.tolist())):
+        records.append(
+            f'{{"id":{first_id + offset},"ts":{ts},"user":"user_{user}",'
+            f'"event":"{JSON_EVENTS[event]}","value":{value},'
+            f'"ok":{"true" if ok else "false"},'
+            f'"tags":["{JSON_TAGS[tags[0]]}","{JSON_TAGS[tags[1]]}"]}}\n')
+    return _fit(''.join(records).encode('ascii'), size)
+
+
+def sensor_block(seed, index, size):
+    """
+    A smooth 8-bit sensor trace: slow periodic components plus a small amount of
+    noise. The periodic components are continuous across blocks.
+    """
+    params = np.random.default_rng([seed, 4])
+    periods = params.uniform(2_000, 200_000, 3)
+    amplitudes = params.uniform(10, 40, 3)
+    phases = params.uniform(0, 2 * np.pi, 3)
+    rng = _block_rng(seed, index, 4)
+    start = index * BLOCK_SIZE
+    steps = np.arange(size, dtype=np.float32)
+    signal = rng.standard_normal(size, dtype=np.float32)
+    signal *= 1.5
+    signal += 128.0
+    for period, amplitude, phase in zip(periods, amplitudes, phases):
+        # Reduce the block's starting phase in float64 so float32 stays accurate
+        phase0 = (2 * np.pi * (start % period) / period + phase) % (2 * np.pi)
+        signal += amplitude * np.sin(steps * np.float32(2 * np.pi / period) + np.float32(phase0))
+    return np.clip(np.rint(signal), 0, 255).astype(np.uint8).tobytes()
+
+
+def image_block(seed, index, size, width=1024):
+    """
+    8-bit grayscale raster rows: a gradient background with a few filled shapes
+    and mild noise, `width` pixels per row.
+    """
+    rng = _block_rng(seed, index, 5)
+    rows = -(-size // width)
+    angle = rng.uniform(0, 2 * np.pi)
+    x = np.arange(width, dtype=np.float32) * np.float32(64 * np.cos(angle) / width)
+    y = np.arange(rows, dtype=np.float32) * np.float32(64 * np.sin(angle) / max(rows, 1))
+    image = 96 + x[np.newaxis, :] + y[:, np.newaxis]
+    for _ in range(rng.integers(4, 10)):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, rows)
+        radius = rng.uniform(20, 200)
+        shade = rng.uniform(0, 255)
+        # Only the shape's bounding box is touched
+        top, bottom = int(max(cy - radius, 0)), int(min(cy + radius + 1, rows))
+        left, right = int(max(cx - radius, 0)), int(min(cx + radius + 1, width))
+        if top >= bottom or left >= right:
+            continue
+        box = image[top:bottom, left:right]
+        if rng.random() < 0.5:
+            yy, xx = np.ogrid[top:bottom, left:right]
+            box[(xx - cx) ** 2 + (yy - cy) ** 2 < radius ** 2] = shade
+        else:
+            yy = np.arange(top, bottom)[:, np.newaxis]
+            box[np.broadcast_to(np.abs(yy - cy) < radius / 2, box.shape)] = shade
+    image += 2.0 * rng.standard_normal(image.shape, dtype=np.float32)
+    return np.clip(np.rint(image), 0, 255).astype(np.uint8).tobytes()[:size]
+
+
+def sparse_block(seed, index, size, density=0.02):
+    """Mostly zero bytes with about `density` of random non-zero values."""
+    rng = _block_rng(seed, index, 6)
+    data = np.zeros(size, dtype=np.uint8)
+    count = rng.binomial(size, density)
+    positions = rng.choice(size, count, replace=False) if count else []
+    data[positions] = rng.integers(1, 256, count, dtype=np.uint8)
+    return data.tobytes()
+
+
+def random_fill(seed, index, start, target):
+    """
+    Writes bytes [start, start + len(target)) of a 'random' block into `target`.
+    The block is the little-endian output of PCG64, so a prefix of the stream is
+    all that has to be drawn.
+    """
+    words = _block_rng(seed, index, 0).bit_generator.random_raw(-(-(start + len(target)) // 8))
+    target[:] = words.view(np.uint8)[start:start + len(target)]
+
+
+def random_block(seed, index, size):
+    """Uniform bytes from a PCG64 generator seeded per block."""
+    block = bytearray(size)
+    random_fill(seed, index, 0, np.frombuffer(block, dtype=np.uint8))
+    return block
+
+
+def noise_block(seed, index, size):
+    """Incompressible bytes like 'random', but reproducible from the seed."""
+    return _block_rng(seed, index, 8).bytes(size)
+
+
+MIXED_SEGMENT = 64 * 1024
+
+
+def mixed_block(seed, index, size):
+    """64KB segments drawn from the other generated datasets and seeded noise."""
+    rng = _block_rng(seed, index, 7)
+    kinds = [text_block, logs_block, json_block, sensor_block, image_block,
+             sparse_block, noise_block]
+    segments = []
+    for segment in range(-(-size // MIXED_SEGMENT)):
+        generator = kinds[rng.integers(0, len(kinds))]
+        length = min(MIXED_SEGMENT, size - segment * MIXED_SEGMENT)
+        segments.append(generator(seed, index * 1024 + segment, length))
+    return b''.join(segments)
+
+
+GENERATORS = {
+    'random': random_block,
+    'text': text_block,
+    'logs': logs_block,
+    'json': json_block,
+    'sensor': sensor_block,
+    'image': image_block,
+    'sparse': sparse_block,
+    'mixed': mixed_block,
+}
+DATASETS = tuple(GENERATORS) + (CORPUS_DATASET,)
+
+
+class Corpus:
+    """
+    A file or a directory of files read as one endless byte stream: the files in
+    sorted order, repeated as often as needed.
+
+    Parameters:
+    - path (str): A file or a directory (searched recursively).
+    """
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name)
+                           for root, _, names in os.walk(path) for name in names)
+        else:
+            files = [path]
+        self.files = [(name, os.path.getsize(name)) for name in files
+                      if os.path.getsize(name) > 0]
+        self.length = sum(size for _, size in self.files)
+        if not self.length:
+            raise ValueError(f"Corpus {path!r} holds no data")
+
+    def read(self, offset, length):
+        """
+        Reads `length` bytes starting at `offset`, wrapping around at the end.
+
+        Returns:
+        - bytearray: The bytes.
+        """
+        output = bytearray(length)
+        view = memoryview(output)
+        position = 0
+        offset %= self.length
+        while position < length:
+            for name, size in self.files:
+                if offset >= size:
+                    offset -= size
+                    continue
+                count = min(size - offset, length - position)
+                with open(name, 'rb') as source:
+                    source.seek(offset)
+                    source.readinto(view[position:position + count])
+                position += count
+                offset = 0
+                if position == length:
+                    break
+        return output
+
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+
+def configure_corpus(path):
+    """
+    Selects the corpus for this process and the worker processes it starts.
+
+    Parameters:
+    - path (str): A file or directory.
+    """
+    os.environ[CORPUS_DIR_ENV] = os.path.abspath(path)
+
+
+def get_corpus():
+    """
+    Returns the configured Corpus.
+
+    Raises:
+    - ValueError: If no corpus was configured.
+    """
+    path = os.environ.get(CORPUS_DIR_ENV)
+    if not path:
+        raise ValueError("The server was started without --corpus-dir")
+    with _corpora_lock:
+        corpus = _corpora.get(path)
+        if corpus is None:
+            corpus = _corpora[path] = Corpus(path)
+        return corpus
+
+
+_workers = 1
+_executor = None
+_executor_lock = threading.Lock()
+_block_cache = OrderedDict()
+_block_cache_lock = threading.Lock()
+
+
+def _cached_block(dataset, seed, index):
+    """
+    A whole block of a dataset, from the cache of partially used blocks if it
+    is there. Two threads may generate the same block at once; both get equal bytes.
+    """
+    key = (dataset, seed, index)
+    with _block_cache_lock:
+        block = _block_cache.get(key)
+        if block is not None:
+            _block_cache.move_to_end(key)
+            return block
+    block = bytes(GENERATORS[dataset](seed, index, BLOCK_SIZE))
+    with _block_cache_lock:
+        _block_cache[key] = block
+        while len(_block_cache) > BLOCK_CACHE_BLOCKS:
+            _block_cache.popitem(last=False)
+    return block
+
+
+def configure_generation(workers=None):
+    """
+    Sets how many threads fill the blocks of a generated range in this process.
+
+    Parameters:
+    - workers (int): Pool size; None uses every CPU and 1 fills on the calling thread.
+
+    Raises:
+    - ValueError: If `workers` is not positive.
+    """
+    global _workers, _executor
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f"Workers must be positive, got {workers}")
+    with _executor_lock:
+        if _executor is not None and workers != _workers:
+            _executor.shutdown()
+            _executor = None
+        _workers = workers
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_workers, thread_name_prefix='generate')
+        return _executor
+
+
+def _block_pieces(offset, length):
+    # (block index, start inside the block, position in the output, count)
+    pieces = []
+    position = 0
+    while position < length:
+        index, start = divmod(offset + position, BLOCK_SIZE)
+        count = min(BLOCK_SIZE - start, length - position)
+        pieces.append((index, start, position, count))
+        position += count
+    return pieces
+
+
+def generate_into(dataset, seed, offset, target):
+    """
+    Fills `target` with bytes [offset, offset + len(target)) of a generated dataset.
+
+    Parameters:
+    - dataset (str): One of GENERATORS.
+    - seed (int): The dataset seed.
+    - offset (int): First byte.
+    - target (writable bytes-like): The buffer to fill, e.g. a slice of a larger one.
+    """
+    output = np.frombuffer(target, dtype=np.uint8)
+    generator = GENERATORS[dataset]
+
+    def fill(piece):
+        index, start, position, count = piece
+        if generator is random_block:
+            random_fill(seed, index, start, output[position:position + count])
+        else:
+            if count < BLOCK_SIZE:
+                block = _cached_block(dataset, seed, index)
+            else:
+                block = generator(seed, index, BLOCK_SIZE)
+            output[position:position + count] = np.frombuffer(block, np.uint8, count, start)
+
+    pieces = _block_pieces(offset, output.size)
+    if _workers > 1 and output.size >= MIN_PARALLEL_LENGTH:
+        # list() waits for every block and re-raises the first error
+        list(_get_executor().map(fill, pieces))
+    else:
+        for piece in pieces:
+            fill(piece)
+
+
+def generate_range(dataset, seed, offset, length):
+    """
+    Produces bytes [offset, offset + length) of a dataset.
+
+    Parameters:
+    - dataset (str): One of DATASETS.
+    - seed (int): The dataset seed.
+    - offset (int): First byte.
+    - length (int): Number of bytes.
+
+    Returns:
+    - bytes-like: Exactly `length` bytes.
+    """
+    if dataset == CORPUS_DATASET:
+        return get_corpus().read(offset, length)
+    output = bytearray(length)
+    generate_into(dataset, seed, offset, output)
+    return output
+
+
+def payload_name(dataset, seed):
+    """
+    Names a dataset instance for payload files, e.g. 'text-s7'.
+
+    A corpus is named after a hash of its path, since its content depends on the
+    --corpus-dir rather than the seed.
+    """
+    if dataset == CORPUS_DATASET:
+        path = os.environ.get(CORPUS_DIR_ENV, '')
+        return f"corpus-{zlib.crc32(path.encode('utf-8')):08x}"
+    return f"{dataset}-s{seed}"
+
+
+def generate(dataset, size, seed=0):
+    """
+    Produces the first `size` bytes of a dataset.
+
+    Returns:
+    - bytes-like: The data.
+    """
+    return generate_range(dataset, seed, 0, size)
+
+
+def request_dataset(request):
+    """
+    Extracts and validates the optional `dataset` and `seed` of a request.
+
+    Parameters:
+    - request (dict): The decoded request.
+
+    Returns:
+    - tuple: (dataset name, seed).
+
+    Raises:
+    - ValueError: If the dataset is unknown or the seed is not a non-negative integer.
+    """
+    dataset = request.get('dataset', DEFAULT_DATASET)
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset {dataset!r}, expected one of {DATASETS}")
+    seed = request.get('seed', 0)
+    if not isinstance(seed, int) or isinstance(seed, bool) or not 0 <= seed <= MAX_SEED:
+        raise ValueError(f"Invalid seed {seed!r}")
+    return dataset, seed
+
+
+def generate_for_request(request, size):
+    """
+    Produces `size` bytes of the dataset a request selects.
+
+    Raises:
+    - ValueError: If the dataset or seed is invalid.
+    """
+    dataset, seed = request_dataset(request)
+    return generate(dataset, size, seed)
+
+
+def configure_from_arguments(args, pooled=False):
+    """
+    Configures the corpus and block-parallel generation from parsed `add_arguments` options.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed options.
+    - pooled (bool): Whether requests already run in a pool of one process per
+      CPU; generation then stays on the calling thread unless --generate-workers
+      says otherwise.
+    """
+    if args.corpus_dir:
+        configure_corpus(args.corpus_dir)
+    workers = args.generate_workers
+    if workers is None and pooled:
+        workers = 1
+    configure_generation(workers)
+
+
+def add_arguments(parser):
+    """
+    Adds the --corpus-dir and --generate-workers options to a server's argparse parser.
+    """
+    parser.add_argument('--corpus-dir', default=None,
+                        help='File or directory served for requests with "dataset": "corpus"')
+    parser.add_argument('--generate-workers', type=int, default=None,
+                        help='Threads that generate the blocks of large payloads in '
+                             'parallel (default: one per CPU; 1 fills them serially)')
+
+
+def add_client_arguments(parser):
+    """
+    Adds the --dataset and --seed options to a client's argparse parser.
+    """
+    parser.add_argument('--dataset', choices=DATASETS, default=DEFAULT_DATASET,
+                        help='Kind of data the server generates')
+    parser.add_argument('--seed', type=int, default=0, help='Dataset seed')
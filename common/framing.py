@@ -0,0 +1,751 @@
+import json
+import socket
+import struct
+import zlib
+
+# Every response starts with a fixed-size header so the receiver knows exactly
+# how many payload bytes follow and can keep the connection open afterwards.
+#   magic (4s) | version (B) | codec id (B) | flags (H) |
+#   raw length (Q) | compressed length (Q) | CRC32 of the payload (I)
+HEADER_MAGIC = b'NCA1'
+HEADER_VERSION = 1
+HEADER_STRUCT = struct.Struct('!4sBBHQQI')
+HEADER_SIZE = HEADER_STRUCT.size
+
+# Requests are a small JSON object prefixed with its length.
+#   magic (4s) | body length (I) | UTF-8 JSON body
+REQUEST_MAGIC = b'NCRQ'
+REQUEST_STRUCT = struct.Struct('!4sI')
+MAX_REQUEST_BODY = 64 * 1024
+
+# Codec identifiers carried in the response header
+CODEC_RAW = 0
+CODEC_LZ4 = 1
+CODEC_FWT_HAAR = 2
+CODEC_FWT_CONTAINER = 3  # Coefficient bands in a common.wavelet_container
+CODEC_FWT_LOSSY = 4  # Thresholded, quantized, entropy coded, see common.wavelet_codec
+CODEC_FWT_LIFTING = 5  # Lossless integer Haar bands in a wavelet container, see common.lifting
+CODEC_FWT_PICKLE = 6  # Pickled pywt.wavedec output (legacy WinReady pair)
+CODEC_ZLIB = 7
+CODEC_BZ2 = 8
+CODEC_LZMA = 9
+CODEC_ZSTD = 10
+
+CODEC_NAMES = {
+    CODEC_RAW: 'raw',
+    CODEC_LZ4: 'lz4',
+    CODEC_FWT_HAAR: 'fwt-haar',
+    CODEC_FWT_CONTAINER: 'fwt-container',
+    CODEC_FWT_LOSSY: 'fwt-lossy',
+    CODEC_FWT_LIFTING: 'fwt-lifting',
+    CODEC_FWT_PICKLE: 'fwt-pickle',
+    CODEC_ZLIB: 'zlib',
+    CODEC_BZ2: 'bz2',
+    CODEC_LZMA: 'lzma',
+    CODEC_ZSTD: 'zstd',
+}
+
+# Header flags
+FLAG_ERROR = 0x0001  # Payload is a UTF-8 error message instead of data
+FLAG_STREAM = 0x0002  # Payload is a sequence of chunks, see send_stream
+FLAG_CACHED = 0x0004  # Payload was served from the server's encoded-payload cache
+FLAG_ADAPTIVE = 0x0008  # The server picked the codec itself ("codec": "auto")
+FLAG_DIGESTS = 0x0010  # The payload is followed by block digests, see BlockDigests
+
+# Streamed payloads: each chunk is prefixed with its length; a zero-length chunk
+# ends the stream and is followed by the CRC32 of all chunk bytes, since neither
+# the total length nor the checksum is known when the header goes out.
+CHUNK_STRUCT = struct.Struct('!I')
+STREAM_TRAILER_STRUCT = struct.Struct('!I')
+
+# Block digests: the CRC32 of every `block size` block of the decoded data, sent
+# after the payload (after the stream trailer for streams).
+#   block size (I) | block count (I) | block count CRC32s (I each)
+DIGEST_STRUCT = struct.Struct('!II')
+DIGEST_BLOCK_SIZE = 1024 * 1024
+MAX_DIGEST_BLOCKS = 1 << 20
+
+# Largest single read requested from the kernel. Receives go straight into
+# preallocated buffers, so a large value only means fewer system calls.
+RECV_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class FrameError(Exception):
+    """Raised when the peer sends something that does not follow the framing protocol."""
+
+
+class ServerError(FrameError):
+    """
+    Raised when the server answered with an error frame. The frame was received
+    whole, so the connection can still be used.
+    """
+
+
+class FrameHeader:
+    """
+    Decoded response header.
+
+    Attributes:
+    - codec_id (int): Identifier of the codec used to encode the payload.
+    - flags (int): Bit field of FLAG_* values.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - compressed_length (int): Number of payload bytes following the header.
+    - checksum (int): CRC32 of the payload bytes as sent on the wire.
+    - digests (BlockDigests): The block digests that followed the payload, once
+      received; None if the response has none.
+    """
+
+    __slots__ = ('codec_id', 'flags', 'raw_length',
+                 'compressed_length', 'checksum', 'digests')
+
+    def __init__(self, codec_id, flags, raw_length, compressed_length, checksum):
+        self.codec_id = codec_id
+        self.flags = flags
+        self.raw_length = raw_length
+        self.compressed_length = compressed_length
+        self.checksum = checksum
+        self.digests = None
+
+    @property
+    def codec_name(self):
+        return CODEC_NAMES.get(self.codec_id, f'unknown-{self.codec_id}')
+
+    @property
+    def is_error(self):
+        return bool(self.flags & FLAG_ERROR)
+
+    @property
+    def is_stream(self):
+        return bool(self.flags & FLAG_STREAM)
+
+    @property
+    def is_cached(self):
+        return bool(self.flags & FLAG_CACHED)
+
+    @property
+    def is_adaptive(self):
+        return bool(self.flags & FLAG_ADAPTIVE)
+
+    @property
+    def has_digests(self):
+        return bool(self.flags & FLAG_DIGESTS)
+
+    def pack(self):
+        return HEADER_STRUCT.pack(HEADER_MAGIC, HEADER_VERSION, self.codec_id,
+                                  self.flags, self.raw_length,
+                                  self.compressed_length, self.checksum)
+
+    @classmethod
+    def unpack(cls, data):
+        magic, version, codec_id, flags, raw_length, compressed_length, checksum = \
+            HEADER_STRUCT.unpack(data)
+        if magic != HEADER_MAGIC:
+            raise FrameError(f"Bad frame magic {magic!r}")
+        if version != HEADER_VERSION:
+            raise FrameError(f"Unsupported frame version {version}")
+        return cls(codec_id, flags, raw_length, compressed_length, checksum)
+
+    def __repr__(self):
+        return (f"FrameHeader(codec={self.codec_name}, flags={self.flags:#x}, "
+                f"raw_length={self.raw_length}, "
+                f"compressed_length={self.compressed_length}, "
+                f"checksum={self.checksum:#010x})")
+
+
+class BlockDigests:
+    """
+    CRC32 of every `block_size` block of a response's decoded data, so the client
+    can check what the codec reproduced, not only what crossed the wire.
+
+    Parameters:
+    - block_size (int): Bytes per block; the last block may be shorter.
+    - checksums (list): One CRC32 per block, in order.
+    """
+
+    __slots__ = ('block_size', 'checksums')
+
+    def __init__(self, block_size, checksums):
+        self.block_size = block_size
+        self.checksums = checksums
+
+    @classmethod
+    def compute(cls, data, block_size=DIGEST_BLOCK_SIZE):
+        """
+        Digests `data` (any contiguous bytes-like object, e.g. a uint8 array).
+        """
+        view = memoryview(data).cast('B')
+        return cls(block_size, [zlib.crc32(view[offset:offset + block_size]) & 0xFFFFFFFF
+                                for offset in range(0, view.nbytes, block_size)])
+
+    @classmethod
+    def blank(cls, raw_length, block_size):
+        """
+        Digests for `raw_length` bytes to be filled in block by block with `set`,
+        e.g. while a stream is produced.
+        """
+        return cls(block_size, [0] * -(-raw_length // block_size))
+
+    def set(self, index, block):
+        """Records the CRC32 of block `index`."""
+        self.checksums[index] = zlib.crc32(memoryview(block).cast('B')) & 0xFFFFFFFF
+
+    def pack(self):
+        return (DIGEST_STRUCT.pack(self.block_size, len(self.checksums))
+                + struct.pack(f'!{len(self.checksums)}I', *self.checksums))
+
+    def __len__(self):
+        return len(self.checksums)
+
+    def __repr__(self):
+        return f"BlockDigests(block_size={self.block_size}, blocks={len(self.checksums)})"
+
+
+class ReceiveBuffer:
+    """
+    A receive buffer reused across transfers, so a client measuring many
+    responses allocates memory only when a payload is larger than any before it.
+
+    Parameters:
+    - size (int): Initial capacity in bytes.
+    """
+
+    def __init__(self, size=0):
+        self._buffer = bytearray(size)
+
+    @property
+    def capacity(self):
+        return len(self._buffer)
+
+    def view(self, size):
+        """
+        Returns a writable view of exactly `size` bytes, growing the buffer if needed.
+
+        Views returned earlier must not be used once the buffer has grown or been
+        handed out again.
+        """
+        if len(self._buffer) < size:
+            self._buffer = bytearray(size)
+        return memoryview(self._buffer)[:size]
+
+
+def recv_exact(sock, size, read_size=RECV_CHUNK_SIZE):
+    """
+    Receives exactly `size` bytes from a socket into one preallocated buffer.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to read from.
+    - size (int): The number of bytes to read.
+    - read_size (int): Largest number of bytes requested from the kernel per call.
+
+    Returns:
+    - bytearray: The received bytes, or None if the peer closed the connection
+      before sending anything.
+
+    Raises:
+    - FrameError: If the connection closes part way through.
+    """
+    received = bytearray(size)
+    if size and recv_exact_into(sock, received, read_size, allow_eof=True) == 0:
+        return None
+    return received
+
+
+def recv_exact_into(sock, buffer, read_size=RECV_CHUNK_SIZE, allow_eof=False, on_data=None):
+    """
+    Fills a preallocated buffer from a socket without intermediate copies.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to read from.
+    - buffer (bytes-like): Writable buffer, e.g. a bytearray or NumPy array;
+      exactly its size is read.
+    - read_size (int): Largest number of bytes requested from the kernel per call.
+    - allow_eof (bool): Return 0 instead of raising if the peer closes the
+      connection before the first byte.
+    - on_data (callable): Optional function called with a view of every piece
+      as it arrives, while it is still in the CPU cache.
+
+    Returns:
+    - int: The number of bytes received, or 0 on a clean close with `allow_eof`.
+
+    Raises:
+    - FrameError: If the connection closes before the buffer is full.
+    """
+    view = memoryview(buffer).cast('B')
+    received = 0
+    while received < view.nbytes:
+        count = sock.recv_into(view[received:], min(view.nbytes - received, read_size))
+        if not count:
+            if allow_eof and not received:
+                return 0
+            raise FrameError(
+                f"Connection closed after {received} of {view.nbytes} bytes")
+        if on_data is not None:
+            on_data(view[received:received + count])
+        received += count
+    return received
+
+
+def encode_request(data_size, **options):
+    """
+    Encodes a request for `data_size` megabytes of data.
+
+    Parameters:
+    - data_size (int): The size of the data to request in megabytes.
+    - **options: Extra request fields understood by the server.
+
+    Returns:
+    - bytes: The request prefix and body, ready to send.
+    """
+    request = dict(options, size_mb=data_size)
+    body = json.dumps(request, separators=(',', ':')).encode('utf-8')
+    return REQUEST_STRUCT.pack(REQUEST_MAGIC, len(body)) + body
+
+
+def send_request(sock, data_size, **options):
+    """
+    Sends a request for `data_size` megabytes of data.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to send the request on.
+    - data_size (int): The size of the data to request in megabytes.
+    - **options: Extra request fields understood by the server.
+    """
+    sock.sendall(encode_request(data_size, **options))
+
+
+def recv_request(sock):
+    """
+    Receives one request from a client.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to read from.
+
+    Returns:
+    - dict: The decoded request, or None if the client closed the connection.
+
+    Raises:
+    - FrameError: If the request is malformed.
+    """
+    prefix = recv_exact(sock, REQUEST_STRUCT.size)
+    if prefix is None:
+        return None
+    body_length = parse_request_prefix(prefix)
+    body = recv_exact(sock, body_length) if body_length else b''
+    if body is None:
+        raise FrameError("Connection closed before the request body arrived")
+    return parse_request_body(body)
+
+
+def parse_request_prefix(prefix):
+    """
+    Validates the fixed-size request prefix.
+
+    Parameters:
+    - prefix (bytes): The REQUEST_STRUCT sized prefix.
+
+    Returns:
+    - int: The length of the JSON body that follows.
+    """
+    magic, body_length = REQUEST_STRUCT.unpack(prefix)
+    if magic != REQUEST_MAGIC:
+        raise FrameError(f"Bad request magic {magic!r}")
+    if body_length > MAX_REQUEST_BODY:
+        raise FrameError(f"Request body of {body_length} bytes is too large")
+    return body_length
+
+
+def parse_request_body(body):
+    """
+    Decodes the JSON request body.
+
+    Parameters:
+    - body (bytes-like): The request body.
+
+    Returns:
+    - dict: The decoded request.
+    """
+    try:
+        request = json.loads(bytes(body).decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise FrameError(f"Malformed request body: {e}")
+    if not isinstance(request, dict) or 'size_mb' not in request:
+        raise FrameError(f"Malformed request {request!r}")
+    return request
+
+
+def build_header(codec_id, raw_length, payload, flags=0):
+    """
+    Builds the response header describing `payload`.
+
+    Parameters:
+    - codec_id (int): One of the CODEC_* identifiers.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - payload (bytes-like): The bytes that will follow the header.
+    - flags (int): Bit field of FLAG_* values.
+
+    Returns:
+    - FrameHeader: The header for the payload.
+    """
+    view = memoryview(payload)
+    return FrameHeader(codec_id, flags, raw_length, view.nbytes,
+                       zlib.crc32(view) & 0xFFFFFFFF)
+
+
+def send_frame(sock, codec_id, raw_length, payload, flags=0, digests=None):
+    """
+    Sends a response header followed by its payload.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to send on.
+    - codec_id (int): One of the CODEC_* identifiers.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - payload (bytes-like): The encoded payload.
+    - flags (int): Bit field of FLAG_* values.
+    - digests (BlockDigests): Optional digests of the decoded data, sent after
+      the payload.
+
+    Returns:
+    - FrameHeader: The header that was sent.
+    """
+    if digests is not None:
+        flags |= FLAG_DIGESTS
+    header = build_header(codec_id, raw_length, payload, flags)
+    sock.sendall(header.pack())
+    sock.sendall(payload)
+    if digests is not None:
+        sock.sendall(digests.pack())
+    return header
+
+
+def send_file_frame(sock, codec_id, raw_length, payload, flags=0, digests=None):
+    """
+    Sends a response whose payload is stored in a file, with `socket.sendfile`.
+
+    The kernel copies the file straight from the page cache to the socket, so the
+    payload never passes through user space (platforms without `os.sendfile`
+    fall back to buffered reads).
+
+    Parameters:
+    - sock (socket.socket): The connected socket to send on.
+    - codec_id (int): One of the CODEC_* identifiers.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - payload (payload_store.FilePayload): The file, byte range and checksum to send.
+    - flags (int): Bit field of FLAG_* values.
+    - digests (BlockDigests): Optional digests of the decoded data, sent after
+      the payload.
+
+    Returns:
+    - FrameHeader: The header that was sent.
+    """
+    if digests is not None:
+        flags |= FLAG_DIGESTS
+    header = FrameHeader(codec_id, flags, raw_length, payload.length, payload.checksum)
+    sock.sendall(header.pack())
+    with open(payload.path, 'rb') as source:
+        sent = sock.sendfile(source, payload.offset, payload.length)
+    if sent != payload.length:
+        raise FrameError(f"Sent {sent} of {payload.length} bytes from {payload.path}")
+    if digests is not None:
+        sock.sendall(digests.pack())
+    return header
+
+
+def send_frame_parts(sock, codec_id, raw_length, parts, flags=0):
+    """
+    Sends a response whose payload is split across several buffers, e.g. a header
+    followed by NumPy arrays, without joining them into one bytes object first.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to send on.
+    - codec_id (int): One of the CODEC_* identifiers.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - parts (list): Bytes-like buffers that make up the payload, in order.
+    - flags (int): Bit field of FLAG_* values.
+
+    Returns:
+    - FrameHeader: The header that was sent.
+    """
+    checksum = 0
+    compressed_length = 0
+    for part in parts:
+        view = memoryview(part).cast('B')
+        checksum = zlib.crc32(view, checksum)
+        compressed_length += view.nbytes
+    header = FrameHeader(codec_id, flags, raw_length, compressed_length,
+                         checksum & 0xFFFFFFFF)
+    sendall_parts(sock, [header.pack()] + list(parts))
+    return header
+
+
+def sendall_parts(sock, parts):
+    """
+    Sends several buffers back to back, using scatter-gather `sendmsg` where the
+    platform supports it so small prefixes do not go out as separate segments.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to send on.
+    - parts (list): Bytes-like buffers to send in order.
+    """
+    if not hasattr(sock, 'sendmsg'):
+        for part in parts:
+            sock.sendall(part)
+        return
+    views = [memoryview(part).cast('B') for part in parts]
+    views = [view for view in views if view.nbytes]
+    while views:
+        sent = sock.sendmsg(views)
+        while sent:
+            if sent >= views[0].nbytes:
+                sent -= views[0].nbytes
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def send_stream(sock, codec_id, raw_length, chunks, flags=0, digests=None):
+    """
+    Sends a streamed response: the header goes out immediately and each chunk is
+    sent as soon as it is produced, so encoding and transmission overlap.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to send on.
+    - codec_id (int): One of the CODEC_* identifiers.
+    - raw_length (int): Size of the payload once decoded, in bytes.
+    - chunks (iterable): Bytes-like chunks of the encoded payload.
+    - flags (int): FLAG_* values to set besides FLAG_STREAM.
+    - digests (BlockDigests): Optional digests of the decoded data, filled in
+      while `chunks` is produced and sent after the stream trailer.
+
+    Returns:
+    - FrameHeader: The header describing what was sent, with the final
+      compressed length and checksum filled in.
+    """
+    if digests is not None:
+        flags |= FLAG_DIGESTS
+    header = FrameHeader(codec_id, FLAG_STREAM | flags, raw_length, 0, 0)
+    sock.sendall(header.pack())
+    checksum = 0
+    for chunk in chunks:
+        view = memoryview(chunk).cast('B')
+        if not view.nbytes:
+            continue  # An empty chunk would end the stream
+        checksum = zlib.crc32(view, checksum)
+        header.compressed_length += view.nbytes
+        sendall_parts(sock, [CHUNK_STRUCT.pack(view.nbytes), view])
+    header.checksum = checksum & 0xFFFFFFFF
+    trailer = CHUNK_STRUCT.pack(0) + STREAM_TRAILER_STRUCT.pack(header.checksum)
+    if digests is not None:
+        trailer += digests.pack()
+    sock.sendall(trailer)
+    return header
+
+
+def iter_stream(sock, header, read_size=RECV_CHUNK_SIZE, reuse_buffer=False):
+    """
+    Yields the chunks of a streamed response as they arrive.
+
+    Once the stream ends, `header.compressed_length` and `header.checksum` hold the
+    totals for the whole stream and the checksum has been verified. Block digests
+    sent after the stream are stored in `header.digests`.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to read from.
+    - header (FrameHeader): The header of the response, with FLAG_STREAM set.
+    - read_size (int): Largest number of bytes requested from the kernel per call.
+    - reuse_buffer (bool): Receive every chunk into the same buffer, grown as
+      needed, instead of allocating one per chunk. Each yielded chunk is then
+      only valid until the next one is requested.
+
+    Yields:
+    - bytearray or memoryview: Each chunk of the encoded payload.
+
+    Raises:
+    - FrameError: If the connection closes early or the checksum does not match.
+    """
+    checksum = 0
+    buffer = ReceiveBuffer() if reuse_buffer else None
+    prefix = bytearray(CHUNK_STRUCT.size)
+    while True:
+        recv_exact_into(sock, prefix, read_size)
+        (length,) = CHUNK_STRUCT.unpack(prefix)
+        if length == 0:
+            break
+        chunk = bytearray(length) if buffer is None else buffer.view(length)
+        recv_exact_into(sock, chunk, read_size)
+        checksum = zlib.crc32(chunk, checksum)
+        header.compressed_length += length
+        yield chunk
+    trailer = bytearray(STREAM_TRAILER_STRUCT.size)
+    recv_exact_into(sock, trailer, read_size)
+    (header.checksum,) = STREAM_TRAILER_STRUCT.unpack(trailer)
+    if checksum & 0xFFFFFFFF != header.checksum:
+        raise FrameError(
+            f"Stream checksum mismatch: expected {header.checksum:#010x}, "
+            f"got {checksum & 0xFFFFFFFF:#010x}")
+    recv_digests(sock, header, read_size)
+
+
+def parse_digest_prefix(prefix):
+    """
+    Validates the DIGEST_STRUCT sized prefix of block digests.
+
+    Returns:
+    - tuple: (block size, block count).
+    """
+    block_size, count = DIGEST_STRUCT.unpack(prefix)
+    if not block_size or count > MAX_DIGEST_BLOCKS:
+        raise FrameError(f"Malformed block digests: {count} blocks of {block_size} bytes")
+    return block_size, count
+
+
+def unpack_digests(block_size, body):
+    """Builds BlockDigests from a parsed prefix and the CRC32s that follow it."""
+    return BlockDigests(block_size, list(struct.unpack(f'!{len(body) // 4}I', body)))
+
+
+def recv_digests(sock, header, read_size=RECV_CHUNK_SIZE):
+    """
+    Receives the block digests that follow a payload with FLAG_DIGESTS into
+    `header.digests`; does nothing for other responses.
+
+    Raises:
+    - FrameError: If the connection closes early or the digests are malformed.
+    """
+    if not header.has_digests:
+        return
+    prefix = bytearray(DIGEST_STRUCT.size)
+    recv_exact_into(sock, prefix, read_size)
+    block_size, count = parse_digest_prefix(prefix)
+    body = bytearray(4 * count)
+    recv_exact_into(sock, body, read_size)
+    header.digests = unpack_digests(block_size, body)
+
+
+def send_error(sock, message):
+    """
+    Reports a failed request to the client without closing the connection.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to send on.
+    - message (str): Human readable description of the failure.
+    """
+    payload = str(message).encode('utf-8')
+    send_frame(sock, CODEC_RAW, len(payload), payload, flags=FLAG_ERROR)
+
+
+def recv_header(sock):
+    """
+    Receives a response header.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to read from.
+
+    Returns:
+    - FrameHeader: The decoded header.
+
+    Raises:
+    - FrameError: If the connection closes or the header is malformed.
+    """
+    data = recv_exact(sock, HEADER_SIZE)
+    if data is None:
+        raise FrameError("Connection closed while waiting for a response")
+    return FrameHeader.unpack(data)
+
+
+def recv_frame(sock, read_size=RECV_CHUNK_SIZE, buffer=None, on_header=None, on_data=None):
+    """
+    Receives one complete response. Streamed responses are collected into one buffer.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to read from.
+    - read_size (int): Largest number of bytes requested from the kernel per call.
+    - buffer (ReceiveBuffer): Optional buffer reused across transfers, see
+      `recv_payload`. Streamed responses are always collected into a new bytearray.
+    - on_header (callable): Optional function called with the header as soon as
+      it has arrived, e.g. to time the first byte of the response.
+    - on_data (callable): Optional, see `recv_payload`. Not called for streams.
+
+    Returns:
+    - tuple: A tuple containing:
+        - FrameHeader: The decoded header; `digests` holds any block digests.
+        - bytearray or memoryview: The payload bytes, received straight into a
+          buffer of the size announced by the header.
+
+    Raises:
+    - FrameError: If the connection closes early or the frame is malformed.
+    - ServerError: If the server reported an error.
+    """
+    header = recv_header(sock)
+    if on_header is not None:
+        on_header(header)
+    if header.is_stream:
+        payload = bytearray()
+        for chunk in iter_stream(sock, header, read_size, reuse_buffer=True):
+            payload += chunk
+        return header, payload
+    payload = recv_payload(sock, header, read_size, buffer, on_data)
+    if header.is_error:
+        raise ServerError(
+            f"Server error: {bytes(payload).decode('utf-8', 'replace')}")
+    return header, payload
+
+
+def recv_payload(sock, header, read_size=RECV_CHUNK_SIZE, buffer=None, on_data=None):
+    """
+    Receives the non-streamed payload announced by `header`, and the block
+    digests after it into `header.digests`.
+
+    Parameters:
+    - sock (socket.socket): The connected socket to read from.
+    - header (FrameHeader): The header of the response.
+    - read_size (int): Largest number of bytes requested from the kernel per call.
+    - buffer (ReceiveBuffer): Optional buffer reused across transfers; a new
+      bytearray is allocated when it is None.
+    - on_data (callable): Optional function called with every piece of the
+      payload as it arrives, see `recv_exact_into`.
+
+    Returns:
+    - bytearray or memoryview: Exactly `header.compressed_length` payload bytes.
+      A view on `buffer` is only valid until the buffer is used again.
+
+    Raises:
+    - FrameError: If the connection closes before the payload arrived.
+    """
+    if buffer is None:
+        payload = bytearray(header.compressed_length)
+    else:
+        payload = buffer.view(header.compressed_length)
+    recv_exact_into(sock, payload, read_size, on_data=on_data)
+    recv_digests(sock, header, read_size)
+    return payload
+
+
+def verify_checksum(header, payload):
+    """
+    Checks a received payload against the CRC32 in its header.
+
+    Parameters:
+    - header (FrameHeader): The header that described the payload.
+    - payload (bytes-like): The received payload.
+
+    Raises:
+    - FrameError: If the checksum does not match.
+    """
+    checksum = zlib.crc32(memoryview(payload)) & 0xFFFFFFFF
+    if checksum != header.checksum:
+        raise FrameError(
+            f"Checksum mismatch: expected {header.checksum:#010x}, got {checksum:#010x}")
+
+
+def enable_nodelay(sock):
+    """
+    Disables Nagle's algorithm so small headers and requests are not delayed.
+
+    Parameters:
+    - sock (socket.socket): A connected TCP socket.
+    """
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
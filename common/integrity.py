@@ -0,0 +1,294 @@
+import time
+import zlib
+
+import numpy as np
+
+from common import codec_registry, framing, timing
+
+# End-to-end verification. The CRC32 in the frame header shows that the payload
+# crossed the wire intact, not that the codec gave back the data the server
+# started from. A request with `"verify": true` also gets block digests
+# (framing.BlockDigests): the CRC32 of every block of the raw data, computed by
+# the server while it encodes and sent after the payload. Whole frames use
+# DIGEST_BLOCK_SIZE blocks, streams their `block_size`, so every streamed block is
+# digested on its own as it is produced.
+#
+# The client hashes its decoded output as it appears, while it is still in the
+# CPU cache: raw payloads piece by piece as they are received, streams block by
+# block as they are decoded, other whole frames right after decoding. Nothing is
+# read again just to check it, and BlockVerifier times its own work, so the cost
+# of verification is reported apart from receiving and decoding.
+#
+# The float Haar transform is lossless only up to rounding. Its reconstruction
+# passes when every sample lies within LOSSLESS_TOLERANCE of an integer and the
+# rounded bytes match the digests. Lossy codecs are not checked.
+LOSSLESS_TOLERANCE = 1e-6
+# Float samples rounded per step; 512KB of float64 stays in the CPU cache
+ROUNDING_SAMPLES = 64 * 1024
+FILE_READ_SIZE = 4 * 1024 * 1024
+
+
+class IntegrityError(framing.FrameError):
+    """Raised when decoded data does not match the server's block digests."""
+
+
+def as_bytes(data):
+    """
+    The uint8 samples of decoded data. The wavelet codecs decode to arrays; float
+    reconstructions are rounded back to the byte samples they came from.
+
+    Returns:
+    - bytes-like: A memoryview or uint8 array.
+    """
+    if not isinstance(data, np.ndarray):
+        return memoryview(data).cast('B')
+    if data.dtype.kind == 'f':
+        data = np.clip(np.rint(data), 0, 255)
+    return data.astype(np.uint8, copy=False)
+
+
+class BlockVerifier:
+    """
+    Hashes the decoded data of one response in pieces of any size and checks the
+    block CRC32s against the digests the server sent.
+
+    Parameters:
+    - block_size (int): Bytes per digest block: framing.DIGEST_BLOCK_SIZE for
+      whole frames, the request's `block_size` for streams.
+
+    Attributes:
+    - seconds (float): Time spent hashing and checking.
+    - length (int): Bytes hashed so far.
+    - max_error (float): Largest rounding error of float reconstructions.
+    - skipped (str): Why the response was not checked, e.g. a lossy codec.
+    """
+
+    def __init__(self, block_size=framing.DIGEST_BLOCK_SIZE):
+        self.block_size = block_size
+        self.checksums = []
+        self.seconds = 0.0
+        self.length = 0
+        self.max_error = 0.0
+        self.skipped = None
+        self._crc = 0
+        self._filled = 0
+        self._wire = False
+        self._scratch = None
+
+    def expect(self, header):
+        """
+        Called with the response header as soon as it arrives. An uncompressed
+        payload is then hashed while it is received, see `wire`.
+        """
+        self._wire = (header.codec_id == framing.CODEC_RAW and not header.is_error
+                      and not header.is_stream)
+
+    def wire(self, piece):
+        """`on_data` hook for framing.recv_frame and framing.recv_payload."""
+        if self._wire:
+            self.update(piece)
+
+    def update(self, data):
+        """
+        Hashes the next piece of decoded data.
+
+        Parameters:
+        - data (bytes-like or np.ndarray): Decoded bytes or a reconstructed signal.
+        """
+        start_time = time.perf_counter()
+        if not isinstance(data, np.ndarray):
+            data = memoryview(data).cast('B')
+        rounding = isinstance(data, np.ndarray) and data.dtype.kind == 'f'
+        # In steps, so rounding a reconstruction needs no full-size temporaries
+        step = ROUNDING_SAMPLES if rounding else self.block_size
+        for start in range(0, len(data), step):
+            piece = data[start:start + step]
+            if rounding:
+                piece = self._round(piece)
+            self._hash(memoryview(as_bytes(piece)).cast('B'))
+        self.seconds += time.perf_counter() - start_time
+
+    def _round(self, piece):
+        # Into two reused scratch arrays; fresh temporaries would cost more than the rounding
+        if self._scratch is None:
+            self._scratch = np.empty((2, ROUNDING_SAMPLES))
+        rounded = np.rint(piece, out=self._scratch[0, :len(piece)])
+        error = np.subtract(piece, rounded, out=self._scratch[1, :len(piece)])
+        self.max_error = max(self.max_error, float(np.abs(error, out=error).max(initial=0.0)))
+        return np.clip(rounded, 0, 255, out=rounded).astype(np.uint8)
+
+    def _hash(self, view):
+        position = 0
+        while position < view.nbytes:
+            count = min(self.block_size - self._filled, view.nbytes - position)
+            self._crc = zlib.crc32(view[position:position + count], self._crc)
+            self._filled += count
+            position += count
+            if self._filled == self.block_size:
+                self.checksums.append(self._crc & 0xFFFFFFFF)
+                self._crc = 0
+                self._filled = 0
+        self.length += view.nbytes
+
+    def check(self, header, decoded=None):
+        """
+        Checks the hashed data against `header.digests`.
+
+        Parameters:
+        - header (framing.FrameHeader): The response header, digests received.
+        - decoded (bytes-like or np.ndarray): The whole decoded data of a frame
+          that was not hashed while it arrived; hashed here first, in the block
+          size of the digests.
+
+        Returns:
+        - int: The number of blocks checked; 0 if the codec is lossy.
+
+        Raises:
+        - IntegrityError: If the server sent no digests, the block size or length
+          differs, a block does not match, or a float reconstruction is not
+          lossless.
+        """
+        if not codec_registry.by_id(header.codec_id).lossless:
+            self.skipped = f"{header.codec_name} is lossy"
+            return 0
+        if decoded is not None and not self.length:
+            if header.digests is not None:
+                self.block_size = header.digests.block_size
+            self.update(decoded)
+        start_time = time.perf_counter()
+        try:
+            digests = header.digests
+            if digests is None:
+                raise IntegrityError("The server sent no block digests")
+            if digests.block_size != self.block_size:
+                raise IntegrityError(
+                    f"Digests cover {digests.block_size} byte blocks, expected {self.block_size}")
+            if self.length != header.raw_length:
+                raise IntegrityError(
+                    f"Decoded {self.length} bytes, expected {header.raw_length}")
+            if self.max_error > LOSSLESS_TOLERANCE:
+                raise IntegrityError(
+                    f"Reconstruction is off by up to {self.max_error:.3g}, "
+                    f"more than {LOSSLESS_TOLERANCE:g}")
+            checksums = self.checksums + ([self._crc & 0xFFFFFFFF] if self._filled else [])
+            if len(checksums) != len(digests):
+                raise IntegrityError(
+                    f"Decoded {len(checksums)} blocks, the server digested {len(digests)}")
+            for index, (expected, actual) in enumerate(zip(digests.checksums, checksums)):
+                if expected != actual:
+                    offset = index * self.block_size
+                    raise IntegrityError(
+                        f"Block {index} (bytes {offset}+{self.block_size}) does not match: "
+                        f"expected {expected:#010x}, got {actual:#010x}")
+            return len(checksums)
+        finally:
+            self.seconds += time.perf_counter() - start_time
+
+    def describe(self):
+        """One line summarizing the verification, for the clients' output."""
+        if self.skipped:
+            return f"not verified, {self.skipped}"
+        summary = (f"verified {-(-self.length // self.block_size)} blocks "
+                   f"in {self.seconds * 1000:.1f}ms")
+        if self.max_error:
+            summary += f", max rounding error {self.max_error:.2g}"
+        return summary
+
+
+def request_verify(request):
+    """
+    Whether a request asks for block digests (`"verify": true`).
+
+    Raises:
+    - ValueError: If `verify` is not a boolean.
+    """
+    verify = request.get('verify', False)
+    if not isinstance(verify, bool):
+        raise ValueError(f"verify must be true or false, got {verify!r}")
+    return verify
+
+
+def digest(request, data, block_size=framing.DIGEST_BLOCK_SIZE):
+    """
+    Digests the raw data of a response if the request asks for it, timed as the
+    'digest' stage.
+
+    Parameters:
+    - request (dict): The decoded request.
+    - data (bytes-like): The raw data before encoding.
+    - block_size (int): Bytes per block.
+
+    Returns:
+    - framing.BlockDigests: The digests, or None if the request does not verify.
+    """
+    if not request_verify(request):
+        return None
+    with timing.stage('digest'):
+        return framing.BlockDigests.compute(data, block_size)
+
+
+def digest_file(request, path, offset, length, block_size=framing.DIGEST_BLOCK_SIZE):
+    """
+    Like `digest` for raw data stored in a payload file, e.g. when a
+    pre-encoded copy is sent with sendfile and the raw data is not in memory.
+    """
+    if not request_verify(request):
+        return None
+    with timing.stage('digest'):
+        checksums = []
+        buffer = bytearray(max(FILE_READ_SIZE // block_size, 1) * block_size)
+        with open(path, 'rb') as source:
+            source.seek(offset)
+            remaining = length
+            while remaining:
+                view = memoryview(buffer)[:min(len(buffer), remaining)]
+                count = source.readinto(view)
+                if not count:
+                    raise ValueError(f"{path} ends before byte {offset + length}")
+                checksums.extend(framing.BlockDigests.compute(view[:count], block_size).checksums)
+                remaining -= count
+        return framing.BlockDigests(block_size, checksums)
+
+
+def stream_digests(request, raw_length, block_size):
+    """
+    Blank digests of a streamed response, filled in by `digesting` or
+    `digest_blocks` as the blocks are produced; None if the request does not verify.
+    """
+    if not request_verify(request):
+        return None
+    return framing.BlockDigests.blank(raw_length, block_size)
+
+
+def digesting(produce, digests):
+    """
+    Wraps a pipeline `produce(index, size)` function so every produced block is
+    digested on the worker that produced it.
+    """
+    if digests is None:
+        return produce
+
+    def produce_and_digest(index, size):
+        block = produce(index, size)
+        digests.set(index, block)
+        return block
+
+    return produce_and_digest
+
+
+def digest_blocks(blocks, digests):
+    """
+    Passes raw blocks through, digesting each one; for sequential streams.
+    """
+    for index, block in enumerate(blocks):
+        if digests is not None:
+            digests.set(index, block)
+        yield block
+
+
+def add_client_arguments(parser):
+    """
+    Adds the --verify option to a client's argparse parser.
+    """
+    parser.add_argument('--verify', action='store_true',
+                        help='Ask for block digests and check the decoded data against them')
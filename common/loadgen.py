@@ -0,0 +1,852 @@
+import argparse
+import csv
+import json
+import logging
+import math
+import queue
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+from common import (adaptive, benchmark, codec_registry, datasets, framing, integrity,
+                    server_core, socket_tuning)
+
+# Open-loop load generation. The clients and the benchmark are closed loops: a
+# connection sends its next request only once the previous one has completed.
+# When the server stalls, the client stops sending, so the stall shows up as
+# one slow request instead of every request that should have been sent during
+# it ("coordinated omission"). Here the arrival times are fixed in advance at a
+# target rate, constant or Poisson, and do not depend on how fast the server
+# answers. A dispatcher hands each request to a pool of persistent connections
+# at its intended time. If every connection is busy, the request waits in a
+# queue.
+#
+# A request's latency runs from its intended send time until its response has
+# been received and checksummed (and decoded with `decode`). Time spent waiting
+# for a free connection therefore counts, and an overloaded server shows up as
+# a growing tail. The service time, from the actual send, is recorded apart for
+# comparison. Latencies go into LatencyHistogram, an HDR-style histogram:
+# log-linear buckets with a fixed number of significant figures. Its size does
+# not depend on the number of requests, and histograms of different intervals
+# or threads can be merged.
+#
+# A run is a ladder of rates. Every step offers one rate for a fixed duration,
+# then waits for the requests still outstanding. It reports its latency
+# percentiles and throughput for every interval of completion time as it goes,
+# and its totals at the end, per codec as well. A step is saturated when it
+# completed fewer than SATURATION_RATIO of the requests per second it issued
+# (the backlog stretched the step past its duration), left requests unfinished,
+# or broke the p99 target. The ladder stops at the
+# first saturated step, so each rung up to there is a rate the server sustains.
+ARRIVALS = ('poisson', 'constant')
+SIGNIFICANT_FIGURES = 3
+# Latencies are recorded in microseconds, up to an hour
+HIGHEST_TRACKABLE = 3600.0
+REPORT_PERCENTILES = (50, 90, 99, 99.9)
+SATURATION_RATIO = 0.95
+DEFAULT_INTERVAL = 1.0
+DEFAULT_DRAIN_TIMEOUT = 30.0
+MB = 1024 * 1024
+
+# Columns of the CSV output, in order
+FIELDS = ('mix', 'arrival', 'connections', 'offered_rps', 'duration_s', 'issued',
+          'completed', 'errors', 'unfinished', 'achieved_rps', 'throughput_mb_s',
+          'wire_mb_s', 'latency_mean_ms', 'latency_p50_ms', 'latency_p90_ms',
+          'latency_p99_ms', 'latency_p99.9_ms', 'latency_max_ms', 'service_p50_ms',
+          'service_p99_ms', 'dispatch_lag_ms', 'client_cpu_s', 'server_cpu_s', 'saturated')
+
+
+class LatencyHistogram:
+    """
+    A histogram of latencies with a fixed relative precision, after
+    HdrHistogram. Values are recorded in whole microseconds. Every power of two
+    is split into enough linear sub-buckets to keep `significant_figures`
+    digits, so 3 figures put 1.234ms and 1.235ms apart but 1.2345s and 1.2346s
+    together.
+
+    Parameters:
+    - significant_figures (int): Decimal digits kept, 1 to 5.
+    - highest (float): Largest latency in seconds that is told apart; larger
+      ones are recorded as this value and counted in `saturated`.
+
+    Attributes:
+    - count (int): Values recorded.
+    - saturated (int): Values above `highest`.
+    """
+
+    def __init__(self, significant_figures=SIGNIFICANT_FIGURES, highest=HIGHEST_TRACKABLE):
+        if not 1 <= significant_figures <= 5:
+            raise ValueError(f"Significant figures must be between 1 and 5, "
+                             f"got {significant_figures}")
+        self.significant_figures = significant_figures
+        self.highest = int(highest * 1e6)
+        # Values below 2 * half_count get a bucket each; every further power of
+        # two gets half_count buckets
+        self._half_magnitude = max(math.ceil(math.log2(2 * 10 ** significant_figures)) - 1, 0)
+        self._half_count = 1 << self._half_magnitude
+        self._mask = (self._half_count << 1) - 1
+        buckets = 1
+        smallest_untrackable = self._half_count << 1
+        while smallest_untrackable <= self.highest:
+            smallest_untrackable <<= 1
+            buckets += 1
+        self.counts = np.zeros((buckets + 1) * self._half_count, dtype=np.int64)
+        self.count = 0
+        self.saturated = 0
+        self._total = 0
+        self._max = 0
+
+    def _index(self, value):
+        bucket = (value | self._mask).bit_length() - (self._half_magnitude + 1)
+        return ((bucket + 1) << self._half_magnitude) + (value >> bucket) - self._half_count
+
+    def _highest_equivalent(self, index):
+        bucket = (index >> self._half_magnitude) - 1
+        sub_bucket = (index & (self._half_count - 1)) + self._half_count
+        if bucket < 0:
+            sub_bucket -= self._half_count
+            bucket = 0
+        return ((sub_bucket + 1) << bucket) - 1
+
+    def record(self, seconds):
+        """
+        Records one latency.
+
+        Parameters:
+        - seconds (float): The latency; negative values count as 0.
+        """
+        value = max(int(round(seconds * 1e6)), 0)
+        if value > self.highest:
+            self.saturated += 1
+            value = self.highest
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self._total += value
+        self._max = max(self._max, value)
+
+    def merge(self, other):
+        """
+        Adds the values of another histogram with the same precision and range.
+
+        Raises:
+        - ValueError: If the histograms are laid out differently.
+        """
+        if len(other.counts) != len(self.counts) or other._half_count != self._half_count:
+            raise ValueError("Only histograms with the same precision and range can be merged")
+        self.counts += other.counts
+        self.count += other.count
+        self.saturated += other.saturated
+        self._total += other._total
+        self._max = max(self._max, other._max)
+        return self
+
+    @property
+    def mean(self):
+        """Mean latency in seconds, or None if nothing was recorded."""
+        return self._total / self.count / 1e6 if self.count else None
+
+    @property
+    def max(self):
+        """Largest latency in seconds, or None if nothing was recorded."""
+        return self._max / 1e6 if self.count else None
+
+    def percentile(self, percent):
+        """
+        The latency that `percent` percent of the values do not exceed, to the
+        histogram's precision.
+
+        Parameters:
+        - percent (float): Percentile between 0 and 100.
+
+        Returns:
+        - float: Seconds, or None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        target = max(math.ceil(percent / 100 * self.count), 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), target))
+        return min(self._highest_equivalent(index), self._max) / 1e6
+
+    def __repr__(self):
+        if not self.count:
+            return "LatencyHistogram(count=0)"
+        return (f"LatencyHistogram(count={self.count}, p50={self.percentile(50) * 1000:.3f}ms, "
+                f"p99={self.percentile(99) * 1000:.3f}ms, max={self.max * 1000:.3f}ms)")
+
+
+class MixEntry:
+    """
+    One kind of request in a load mix.
+
+    Parameters:
+    - codec (str): Codec name (see codec_registry).
+    - size_mb (int): Requested size in megabytes.
+    - weight (float): Relative share of the requests.
+    """
+
+    def __init__(self, codec, size_mb, weight=1.0):
+        if size_mb <= 0:
+            raise ValueError(f"Size must be positive, got {size_mb}")
+        if weight <= 0:
+            raise ValueError(f"Weight must be positive, got {weight}")
+        self.codec = codec
+        self.size_mb = size_mb
+        self.weight = weight
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Parses 'codec:size_mb[:weight]', e.g. 'lz4:10:3'.
+
+        Raises:
+        - ValueError: If the specification or the codec is invalid.
+        """
+        parts = spec.split(':')
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Expected codec:size_mb[:weight], got {spec!r}")
+        if parts[0] != adaptive.AUTO_CODEC:
+            codec_registry.get(parts[0])
+        try:
+            return cls(parts[0], int(parts[1]), float(parts[2]) if len(parts) == 3 else 1.0)
+        except ValueError as e:
+            raise ValueError(f"Invalid mix entry {spec!r}: {e}")
+
+    @property
+    def label(self):
+        return f"{self.codec}:{self.size_mb}MB"
+
+    def __repr__(self):
+        return f"MixEntry({self.codec!r}, {self.size_mb}, weight={self.weight:g})"
+
+
+def mix_argument(spec):
+    """argparse type for mix entries."""
+    try:
+        return MixEntry.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def describe_mix(mix):
+    """The mix as the specifications it was parsed from, e.g. 'lz4:1:3 raw:10:1'."""
+    return ' '.join(f"{entry.codec}:{entry.size_mb}:{entry.weight:g}" for entry in mix)
+
+
+class LoadStep:
+    """
+    The results of one rate of the ladder. Workers record into it concurrently.
+
+    Parameters:
+    - rate (float): Offered requests per second.
+    - duration (float): Seconds requests are offered for.
+    - interval (float): Seconds of completion time per interval report.
+
+    Attributes:
+    - latency (LatencyHistogram): From the intended send time to completion.
+    - service (LatencyHistogram): From the actual send time to completion.
+    - by_codec (dict): A latency histogram per codec.
+    - intervals (list): Per interval of completion time, a dict with its latency
+      histogram and its completed requests, raw and wire bytes, and errors.
+    """
+
+    def __init__(self, rate, duration, interval=DEFAULT_INTERVAL):
+        self.rate = rate
+        self.duration = duration
+        self.interval = interval
+        self.start = None
+        self.elapsed = None
+        self.latency = LatencyHistogram()
+        self.service = LatencyHistogram()
+        self.by_codec = {}
+        self.intervals = []
+        self.issued = 0
+        self.completed = 0
+        self.errors = 0
+        self.unfinished = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.dispatch_lag = 0.0
+        self.closed = False
+        self._in_flight = {}
+        self._condition = threading.Condition()
+
+    def _interval(self, moment):
+        index = max(int((moment - self.start) / self.interval), 0)
+        while len(self.intervals) <= index:
+            self.intervals.append({'latency': LatencyHistogram(), 'completed': 0,
+                                   'raw_bytes': 0, 'wire_bytes': 0, 'errors': 0})
+        return self.intervals[index]
+
+    def reach(self, moment):
+        """Creates the interval holding `moment`, so idle intervals are reported too."""
+        with self._condition:
+            self._interval(moment)
+
+    def begin(self, worker, entry, intended):
+        """Notes that `worker` (any hashable key) has started a request."""
+        with self._condition:
+            if not self.closed:
+                self._in_flight[worker] = (entry, intended)
+
+    def record(self, worker, entry, intended, sent, finished, raw_length, compressed_length):
+        """Records a completed request; times are time.perf_counter() values."""
+        with self._condition:
+            if self.closed:
+                return
+            self._in_flight.pop(worker, None)
+            latency = finished - intended
+            self.latency.record(latency)
+            self.service.record(finished - sent)
+            self.by_codec.setdefault(entry.codec, LatencyHistogram()).record(latency)
+            interval = self._interval(finished)
+            interval['latency'].record(latency)
+            interval['completed'] += 1
+            interval['raw_bytes'] += raw_length
+            interval['wire_bytes'] += compressed_length
+            self.completed += 1
+            self.raw_bytes += raw_length
+            self.wire_bytes += compressed_length
+            self._condition.notify_all()
+
+    def fail(self, worker, finished):
+        """Records a failed request."""
+        with self._condition:
+            if self.closed:
+                return
+            self._in_flight.pop(worker, None)
+            self._interval(finished)['errors'] += 1
+            self.errors += 1
+            self._condition.notify_all()
+
+    def abandon(self, entry, intended, now):
+        """
+        Records a request that was still queued or in flight when the drain timed
+        out. Its latency so far is a lower bound; leaving it out would hide
+        exactly the slowest requests.
+        """
+        with self._condition:
+            self._abandon(entry, intended, now)
+
+    def _abandon(self, entry, intended, now):
+        self.latency.record(now - intended)
+        self.by_codec.setdefault(entry.codec, LatencyHistogram()).record(now - intended)
+        self.unfinished += 1
+
+    @property
+    def outstanding(self):
+        return self.issued - self.completed - self.errors - self.unfinished
+
+    def wait(self, timeout):
+        """
+        Waits until no request is outstanding.
+
+        Returns:
+        - bool: False if requests were still outstanding after `timeout` seconds.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self.outstanding, timeout)
+
+    def close(self, now):
+        """
+        Stops recording. Requests still in flight are abandoned at `now` and
+        ignored when they complete.
+        """
+        with self._condition:
+            for entry, intended in self._in_flight.values():
+                self._abandon(entry, intended, now)
+            self._in_flight.clear()
+            # A request a worker has dequeued but not yet begun
+            self.unfinished += self.outstanding
+            self.closed = True
+
+
+class _Connection:
+    """
+    One persistent connection of the pool with its own reused receive buffer.
+    """
+
+    def __init__(self, host, port, options, decode):
+        self.host = host
+        self.port = port
+        self.options = options
+        self.decode = decode or bool(options.get('verify'))
+        self.buffer = framing.ReceiveBuffer()
+        self.client_socket = socket_tuning.connect(host, port)
+
+    def fetch(self, entry):
+        """
+        Sends one request and receives its response.
+
+        Returns:
+        - tuple: (raw length, compressed length).
+
+        Raises:
+        - framing.FrameError: If the server sent an error or a bad response. A
+          truncated or malformed response is handled like a failed connection.
+        - OSError: If the connection failed; it is reopened for the next request.
+        """
+        if self.client_socket is None:
+            self.client_socket = socket_tuning.connect(self.host, self.port)
+        verifier = integrity.BlockVerifier() if self.options.get('verify') else None
+        try:
+            framing.send_request(self.client_socket, entry.size_mb, codec=entry.codec,
+                                 **self.options)
+            socket_tuning.rearm(self.client_socket)
+            header, payload = framing.recv_frame(
+                self.client_socket, buffer=self.buffer,
+                on_header=verifier.expect if verifier is not None else None,
+                on_data=verifier.wire if verifier is not None else None)
+        except framing.ServerError:
+            raise
+        except (framing.FrameError, OSError):
+            # A broken or malformed response leaves the connection out of sync
+            self.close()
+            raise
+        framing.verify_checksum(header, payload)
+        if self.decode:
+            data = codec_registry.decode(header, payload)
+            if len(data) != header.raw_length:
+                raise framing.FrameError(
+                    f"Decoded {len(data)} bytes, expected {header.raw_length}")
+            if verifier is not None:
+                verifier.check(header, data)
+        return header.raw_length, header.compressed_length
+
+    def close(self):
+        if self.client_socket is not None:
+            self.client_socket.close()
+            self.client_socket = None
+
+
+class LoadGenerator:
+    """
+    Offers requests from a mix at fixed rates over a pool of persistent
+    connections, one worker thread per connection.
+
+    Parameters:
+    - host (str): Server address.
+    - port (int): Server port.
+    - mix (list): MixEntry objects to draw the requests from.
+    - connections (int): Size of the connection pool; at most this many
+      requests are in flight.
+    - arrival (str): One of ARRIVALS.
+    - seed (int): Seed for the arrival times and the request mix.
+    - options (dict): Extra request fields, e.g. `dataset`, `source` or `verify`.
+    - decode (bool): Also decode every response, so the client's decoding is
+      part of the latency.
+    """
+
+    def __init__(self, host, port, mix, connections=16, arrival='poisson', seed=0,
+                 options=None, decode=False):
+        if not mix:
+            raise ValueError("The mix needs at least one entry")
+        if connections < 1:
+            raise ValueError(f"Connections must be positive, got {connections}")
+        if arrival not in ARRIVALS:
+            raise ValueError(f"Unknown arrival process {arrival!r}, expected one of {ARRIVALS}")
+        self.mix = list(mix)
+        self.arrival = arrival
+        self.random = random.Random(seed)
+        self._weights = [entry.weight for entry in self.mix]
+        self._jobs = queue.Queue()
+        self.connections = []
+        try:
+            for _ in range(connections):
+                self.connections.append(_Connection(host, port, dict(options or {}), decode))
+        except OSError:
+            self.close()
+            raise
+        self._threads = [threading.Thread(target=self._work, args=(connection,),
+                                          name='loadgen', daemon=True)
+                         for connection in self.connections]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self, connection):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            intended, entry, step = job
+            step.begin(connection, entry, intended)
+            sent = time.perf_counter()
+            try:
+                raw_length, compressed_length = connection.fetch(entry)
+            except (framing.FrameError, ValueError, RuntimeError, EOFError, OSError) as e:
+                logging.error(f"Request for {entry.label} failed: {e}")
+                step.fail(connection, time.perf_counter())
+                continue
+            step.record(connection, entry, intended, sent, time.perf_counter(), raw_length,
+                        compressed_length)
+
+    def _gap(self, rate):
+        if self.arrival == 'poisson':
+            return self.random.expovariate(rate)
+        return 1.0 / rate
+
+    def run_step(self, rate, duration, interval=DEFAULT_INTERVAL,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, report=None):
+        """
+        Offers `rate` requests per second for `duration` seconds and waits for
+        them to complete.
+
+        Parameters:
+        - rate (float): Requests per second.
+        - duration (float): Seconds to offer requests for.
+        - interval (float): Seconds of completion time per interval report.
+        - drain_timeout (float): Seconds to wait for outstanding requests after
+          the last one was offered. Requests still queued then are abandoned.
+        - report (callable): Optional function called with the step and the index
+          of every interval once it has ended.
+
+        Returns:
+        - LoadStep: The results.
+        """
+        if rate <= 0 or duration <= 0:
+            raise ValueError(f"Rate and duration must be positive, got {rate} and {duration}")
+        step = LoadStep(rate, duration, interval)
+        reported = 0
+
+        def report_until(now):
+            nonlocal reported
+            while step.start + (reported + 1) * interval <= now:
+                step.reach(step.start + reported * interval)
+                if report is not None:
+                    report(step, reported)
+                reported += 1
+
+        step.start = time.perf_counter()
+        end = step.start + duration
+        intended = step.start + self._gap(rate)
+        while intended < end:
+            entry = self.random.choices(self.mix, self._weights)[0]
+            while True:
+                now = time.perf_counter()
+                report_until(now)
+                if now >= intended:
+                    break
+                time.sleep(min(intended, step.start + (reported + 1) * interval) - now)
+            # Late dispatch means this process cannot keep up with the rate
+            step.dispatch_lag = max(step.dispatch_lag, now - intended)
+            step.issued += 1
+            self._jobs.put((intended, entry, step))
+            intended += self._gap(rate)
+        deadline = time.perf_counter() + drain_timeout
+        while not step.wait(min(interval, max(deadline - time.perf_counter(), 0))):
+            report_until(time.perf_counter())
+            if time.perf_counter() >= deadline:
+                break
+        now = time.perf_counter()
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            step.abandon(job[1], job[0], now)
+        step.close(now)
+        # The last arrival may fall well before the end of the window
+        step.elapsed = max(now - step.start, duration)
+        # The last interval is cut short by the end of the step
+        report_until(step.start + len(step.intervals) * interval)
+        return step
+
+    def close(self):
+        for _ in getattr(self, '_threads', ()):
+            self._jobs.put(None)
+        for thread in getattr(self, '_threads', ()):
+            thread.join(timeout=5)
+        for connection in self.connections:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return (f"LoadGenerator(mix={describe_mix(self.mix)!r}, "
+                f"connections={len(self.connections)}, arrival={self.arrival!r})")
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+def step_row(step, mix, arrival, connections, slo=None):
+    """
+    One result row with the keys of FIELDS for a finished step, plus its
+    per-codec percentiles and interval reports for the JSON output.
+
+    Parameters:
+    - slo (float): p99 latency target in seconds; a step above it is saturated.
+    """
+    achieved = step.completed / step.elapsed
+    # Poisson arrivals offer more or less than the rate; compare with what was issued
+    issued = step.issued / step.duration
+    row = dict.fromkeys(FIELDS)
+    row.update({
+        'mix': describe_mix(mix), 'arrival': arrival, 'connections': connections,
+        'offered_rps': step.rate, 'duration_s': step.elapsed, 'issued': step.issued,
+        'completed': step.completed, 'errors': step.errors, 'unfinished': step.unfinished,
+        'achieved_rps': achieved,
+        'throughput_mb_s': step.raw_bytes / MB / step.elapsed,
+        'wire_mb_s': step.wire_bytes / MB / step.elapsed,
+        'latency_mean_ms': _ms(step.latency.mean),
+        'latency_max_ms': _ms(step.latency.max),
+        'service_p50_ms': _ms(step.service.percentile(50)),
+        'service_p99_ms': _ms(step.service.percentile(99)),
+        'dispatch_lag_ms': step.dispatch_lag * 1000,
+    })
+    for percent in REPORT_PERCENTILES:
+        row[f'latency_p{percent:g}_ms'] = _ms(step.latency.percentile(percent))
+    p99 = step.latency.percentile(99)
+    row['saturated'] = (achieved < SATURATION_RATIO * issued or step.unfinished > 0
+                        or (slo is not None and p99 is not None and p99 > slo))
+    row['by_codec'] = {codec: {'requests': histogram.count,
+                               **{f'p{percent:g}_ms': _ms(histogram.percentile(percent))
+                                  for percent in REPORT_PERCENTILES}}
+                       for codec, histogram in step.by_codec.items()}
+    row['intervals'] = [interval_summary(step, index) for index in range(len(step.intervals))]
+    return row
+
+
+def interval_summary(step, index):
+    """Throughput and latency percentiles of one interval of a step, as a dict."""
+    interval = step.intervals[index]
+    start = index * step.interval
+    length = min(step.interval, step.elapsed - start) if step.elapsed else step.interval
+    length = max(length, 1e-9)
+    histogram = interval['latency']
+    summary = {'t_s': start + length, 'completed': interval['completed'],
+               'rps': interval['completed'] / length,
+               'mb_s': interval['raw_bytes'] / MB / length, 'errors': interval['errors']}
+    for percent in REPORT_PERCENTILES:
+        summary[f'p{percent:g}_ms'] = _ms(histogram.percentile(percent))
+    summary['max_ms'] = _ms(histogram.max)
+    return summary
+
+
+def format_interval(summary):
+    """One line of human readable output for an interval report."""
+    line = f"  {summary['t_s']:6.1f}s {summary['rps']:8.1f} req/s {summary['mb_s']:8.1f}MB/s"
+    if summary['completed']:
+        line += (f"  p50 {summary['p50_ms']:.1f}ms p99 {summary['p99_ms']:.1f}ms"
+                 f" max {summary['max_ms']:.1f}ms")
+    if summary['errors']:
+        line += f", {summary['errors']} errors"
+    return line
+
+
+def format_row(row):
+    """One line of human readable output for a step's result row."""
+    summary = (f"{row['offered_rps']:>8g} req/s offered: {row['achieved_rps']:.1f} req/s, "
+               f"{row['throughput_mb_s']:.1f}MB/s, n={row['completed']}")
+    if row['completed']:
+        summary += ' ' + ' '.join(f"p{percent:g} {row[f'latency_p{percent:g}_ms']:.1f}ms"
+                                  for percent in REPORT_PERCENTILES)
+        summary += (f" max {row['latency_max_ms']:.1f}ms"
+                    f" (service p99 {row['service_p99_ms']:.1f}ms)")
+    if row['errors']:
+        summary += f", {row['errors']} errors"
+    if row['unfinished']:
+        summary += f", {row['unfinished']} unfinished"
+    if row['server_cpu_s'] is not None:
+        summary += f", server cpu {row['server_cpu_s']:.2f}s"
+    if row['saturated']:
+        summary += "  SATURATED"
+    if len(row['by_codec']) > 1:
+        summary += ''.join(f"\n    {codec:>10}: n={stats['requests']} p50 {stats['p50_ms']:.1f}ms "
+                           f"p99 {stats['p99_ms']:.1f}ms"
+                           for codec, stats in row['by_codec'].items())
+    return summary
+
+
+def run_ladder(generator, rates, duration, interval=DEFAULT_INTERVAL,
+               drain_timeout=DEFAULT_DRAIN_TIMEOUT, slo=None, stop_at_saturation=True,
+               server=None, output=sys.stdout):
+    """
+    Runs one step per rate in order, printing interval reports and step rows.
+
+    Parameters:
+    - generator (LoadGenerator): The connected generator.
+    - rates (list): Requests per second of every step.
+    - stop_at_saturation (bool): Skip the remaining rates after a saturated step.
+    - server (benchmark.BenchmarkServer): A started server, for its CPU time.
+    - The remaining parameters are passed to `LoadGenerator.run_step` and `step_row`.
+
+    Returns:
+    - list: The result rows.
+    """
+    rows = []
+
+    def report(step, index):
+        print(format_interval(interval_summary(step, index)), file=output, flush=True)
+
+    for rate in rates:
+        print(f"{rate:g} req/s for {duration:g}s ({describe_mix(generator.mix)}, "
+              f"{generator.arrival}, {len(generator.connections)} connections)",
+              file=output, flush=True)
+        server_cpu = server.cpu_seconds() if server is not None else None
+        cpu = time.process_time()
+        step = generator.run_step(rate, duration, interval, drain_timeout, report)
+        row = step_row(step, generator.mix, generator.arrival, len(generator.connections), slo)
+        row['client_cpu_s'] = time.process_time() - cpu
+        if server_cpu is not None:
+            row['server_cpu_s'] = server.cpu_seconds() - server_cpu
+        if step.dispatch_lag > interval:
+            logging.warning(f"Requests were dispatched up to {step.dispatch_lag:.2f}s late; "
+                            f"the load generator cannot keep up with {rate:g} req/s")
+        rows.append(row)
+        print(format_row(row), file=output, flush=True)
+        if row['saturated'] and stop_at_saturation:
+            break
+    return rows
+
+
+def saturation_summary(rows):
+    """
+    The highest rate sustained and the first saturated rate of a ladder, as one
+    line.
+    """
+    sustained = [row for row in rows if not row['saturated']]
+    saturated = [row for row in rows if row['saturated']]
+    summary = f"{rows[0]['mix']}: " if rows else ''
+    if sustained:
+        best = max(sustained, key=lambda row: row['offered_rps'])
+        summary += (f"sustained {best['offered_rps']:g} req/s ({best['throughput_mb_s']:.1f}MB/s, "
+                    f"p99 {best['latency_p99_ms']:.1f}ms)")
+    else:
+        summary += "no rate sustained"
+    if saturated:
+        summary += f", saturated at {saturated[0]['offered_rps']:g} req/s"
+    else:
+        summary += ", not saturated"
+    return summary
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: (f"{value:.6g}" if isinstance(value, float) else value)
+                             for key, value in row.items()})
+
+
+def write_json(path, rows, args=None):
+    with open(path, 'w') as output:
+        json.dump({'environment': benchmark.environment(args), 'results': rows}, output,
+                  indent=2, default=str)
+        output.write('\n')
+
+
+def add_arguments(parser):
+    """
+    Adds the load generator options to an argparse parser.
+    """
+    parser.add_argument('--host', default='127.0.0.1', help='Server address')
+    parser.add_argument('--port', type=int, default=0,
+                        help='Server port (0 picks a free one for a started server)')
+    parser.add_argument('--server', choices=tuple(benchmark.SERVER_SCRIPTS), default=None,
+                        help='Start this phase server on localhost; by default the server '
+                             'at --host/--port is used')
+    parser.add_argument('--server-mode', choices=server_core.EXECUTION_MODES, default='thread',
+                        help='Execution mode of the started server')
+    parser.add_argument('--server-workers', type=int, default=None,
+                        help='Workers of the started server (thread mode: one per connection)')
+    parser.add_argument('--mix', type=mix_argument, nargs='+',
+                        default=[MixEntry('lz4', 1)],
+                        help='Requests to draw from, as codec:size_mb[:weight], e.g. '
+                             'lz4:1:3 raw:10:1')
+    parser.add_argument('--each-codec', action='store_true',
+                        help='Run the rate ladder once per codec of the mix')
+    parser.add_argument('--rates', type=float, nargs='+', default=[10, 20, 50, 100],
+                        help='Offered requests per second, one step each')
+    parser.add_argument('--all-rates', action='store_true',
+                        help='Keep going after the first saturated step')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Seconds every rate is offered for')
+    parser.add_argument('--arrival', choices=ARRIVALS, default='poisson',
+                        help='Exponential or constant gaps between requests')
+    parser.add_argument('--connections', type=int, default=16,
+                        help='Persistent connections; at most this many requests in flight')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help='Seconds per interval report')
+    parser.add_argument('--drain-timeout', type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                        help='Seconds to wait for outstanding requests after each step')
+    parser.add_argument('--slo-ms', type=float, default=None,
+                        help='p99 latency target; a step above it counts as saturated')
+    parser.add_argument('--decode', action='store_true',
+                        help='Decode every response, so the latency includes client decoding')
+    parser.add_argument('--dataset', choices=datasets.DATASETS,
+                        default=datasets.DEFAULT_DATASET, help='Dataset to request')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the arrivals, the mix and the dataset')
+    parser.add_argument('--source', choices=('memory', 'file'), default='memory',
+                        help='Generate each payload or serve it from a payload file')
+    integrity.add_client_arguments(parser)
+    socket_tuning.add_arguments(parser)
+    parser.add_argument('--csv', default=None, help='Write the step results to this CSV file')
+    parser.add_argument('--json', default=None,
+                        help='Write the step results with per-codec and interval reports '
+                             'and the environment to this JSON file')
+
+
+def run_from_arguments(args):
+    """
+    Runs the ladder described by parsed `add_arguments` options, once for the
+    whole mix or, with `--each-codec`, once per codec, and writes the requested
+    output files.
+
+    Returns:
+    - list: The result rows.
+    """
+    socket_tuning.configure_from_arguments(args)
+    options = {'dataset': args.dataset, 'seed': args.seed, 'source': args.source}
+    if args.verify:
+        options['verify'] = True
+    mixes = [args.mix]
+    if args.each_codec:
+        codecs = list(dict.fromkeys(entry.codec for entry in args.mix))
+        mixes = [[entry for entry in args.mix if entry.codec == codec] for codec in codecs]
+    server = None
+    if args.server is not None:
+        workers = args.server_workers
+        if workers is None and args.server_mode == 'thread':
+            # A thread serves one connection at a time; the others would wait
+            workers = max(args.connections, server_core.default_workers('thread'))
+        extra_args = ['--socket', args.socket.spec]
+        if any(entry.codec == adaptive.AUTO_CODEC for entry in args.mix):
+            extra_args.append('--adaptive')
+        server = benchmark.BenchmarkServer(args.server, 'subprocess', args.server_mode,
+                                           workers, args.host, args.port,
+                                           extra_args=extra_args).start()
+    rows = []
+    summaries = []
+    try:
+        host, port = (server.host, server.port) if server is not None else (args.host, args.port)
+        for mix in mixes:
+            with LoadGenerator(host, port, mix, args.connections, args.arrival, args.seed,
+                               options, args.decode) as generator:
+                ladder = run_ladder(generator, args.rates, args.duration, args.interval,
+                                    args.drain_timeout,
+                                    args.slo_ms / 1000 if args.slo_ms is not None else None,
+                                    not args.all_rates, server)
+            rows += ladder
+            if ladder:
+                summaries.append(saturation_summary(ladder))
+    finally:
+        if server is not None:
+            server.stop()
+    print("Saturation:")
+    for summary in summaries:
+        print(f"  {summary}")
+    if args.csv:
+        write_csv(args.csv, rows)
+    if args.json:
+        write_json(args.json, rows, args)
+    return rows
@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import math
+import random
+import time
+
+from common import framing, units
+
+# Userspace link emulation. Loopback has practically unlimited bandwidth and
+# no latency, so it cannot show whether compression pays off on a real link.
+# LinkProxy is a TCP proxy that sits between a client and a server and shapes
+# each direction separately, without root or tc:
+# - rate: a token bucket releases the bytes at the link rate. `burst` is the
+#   bucket depth, i.e. how much may go out back to back after an idle period.
+# - delay and jitter: each chunk is delivered `delay` plus a uniform random
+#   0..`jitter` after it leaves the bucket. Chunks never overtake each other,
+#   because TCP delivers in order.
+# - loss: TCP never loses data, but a lost segment stalls the stream until it is
+#   retransmitted. Each MSS-sized segment is lost with probability `loss`. A
+#   loss holds back its chunk and everything behind it for one retransmission
+#   timeout (at least MIN_RTO). Congestion window reductions are not modelled,
+#   so this is a lower bound on the cost of loss.
+#
+# Links are written like tc parameters: 'rate=100mbit,delay=5ms,jitter=1ms,loss=0.1%'.
+# A preset name may replace or start the list ('10mbit,delay=20ms'). 'DOWN/UP'
+# gives the server-to-client and client-to-server directions separate
+# parameters; otherwise both directions get the same ones. Delays are one-way,
+# so 'delay=20ms' means a 40ms round trip.
+LINK_PRESETS = {
+    '10mbit': 'rate=10mbit,delay=1ms',
+    '100mbit': 'rate=100mbit,delay=1ms',
+    '1gbit': 'rate=1gbit,delay=0.5ms',
+    'wan': 'rate=50mbit,delay=20ms,jitter=5ms,loss=0.1%',
+    'mobile': ('rate=10mbit,delay=40ms,jitter=20ms,loss=1%'
+               '/rate=2mbit,delay=40ms,jitter=20ms,loss=1%'),
+}
+MSS = 1448
+MIN_RTO = 0.2
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MIN_BURST = 16 * 1024
+BURST_SECONDS = 0.005  # Default bucket depth: 5ms worth of the link rate
+QUEUE_CHUNKS = 64  # Chunks in flight per direction before the sender is held back
+
+def parse_loss(text):
+    """Parses a loss probability, either '0.5%' or a fraction like '0.005'."""
+    text = text.strip()
+    value = float(text[:-1]) / 100 if text.endswith('%') else float(text)
+    if not 0 <= value < 1:
+        raise ValueError(f"Loss must be at least 0 and below 100%, got {text!r}")
+    return value
+
+
+class LinkProfile:
+    """
+    How one direction of an emulated link behaves.
+
+    Parameters:
+    - rate (float): Bandwidth in bytes per second; None is unlimited.
+    - delay (float): One-way delay in seconds.
+    - jitter (float): Extra uniformly distributed delay of up to this many seconds.
+    - loss (float): Probability that an MSS-sized segment is lost.
+    - burst (int): Token bucket depth in bytes; defaults to BURST_SECONDS of the rate.
+    """
+
+    def __init__(self, rate=None, delay=0.0, jitter=0.0, loss=0.0, burst=None):
+        if rate is not None and rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        if delay < 0 or jitter < 0:
+            raise ValueError("Delay and jitter must not be negative")
+        self.rate = rate
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        if burst is None and rate is not None:
+            burst = max(MIN_BURST, int(rate * BURST_SECONDS))
+        self.burst = burst
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Builds a profile from 'key=value' pairs (rate, delay, jitter, loss, burst),
+        optionally starting with a symmetric preset name.
+
+        Raises:
+        - ValueError: If the specification is invalid.
+        """
+        values = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            if '=' not in item:
+                preset = LINK_PRESETS.get(item.lower())
+                if preset is None or '/' in preset:
+                    raise ValueError(f"Unknown link preset {item!r}, expected one of "
+                                     f"{sorted(LINK_PRESETS)} or key=value pairs")
+                # The burst follows the rate unless it is given explicitly
+                values.update((key, value) for key, value in cls.parse(preset).as_dict().items()
+                              if key != 'burst')
+                continue
+            key, value = (text.strip() for text in item.split('=', 1))
+            parsers = {'rate': units.parse_rate, 'delay': units.parse_time,
+                       'jitter': units.parse_time, 'loss': parse_loss,
+                       'burst': units.parse_size}
+            if key not in parsers:
+                raise ValueError(f"Unknown link parameter {key!r}, expected one of {sorted(parsers)}")
+            values[key] = parsers[key](value)
+        return cls(**values)
+
+    def retransmit_timeout(self):
+        return max(MIN_RTO, 2 * (self.delay + self.jitter))
+
+    def as_dict(self):
+        return {'rate': self.rate, 'delay': self.delay, 'jitter': self.jitter,
+                'loss': self.loss, 'burst': self.burst}
+
+    def __repr__(self):
+        rate = f"{self.rate * 8 / 1e6:g}mbit" if self.rate else 'unlimited'
+        return (f"LinkProfile(rate={rate}, delay={self.delay * 1000:g}ms, "
+                f"jitter={self.jitter * 1000:g}ms, loss={self.loss:.3%})")
+
+
+def parse_link(spec):
+    """
+    Parses a link specification into (downlink, uplink) profiles; see the
+    module comment for the syntax.
+
+    Returns:
+    - tuple: (LinkProfile server to client, LinkProfile client to server).
+    """
+    spec = LINK_PRESETS.get(spec.strip().lower(), spec)
+    if '/' in spec:
+        down, up = spec.split('/', 1)
+        return LinkProfile.parse(down), LinkProfile.parse(up)
+    profile = LinkProfile.parse(spec)
+    return profile, profile
+
+
+class TokenBucket:
+    """
+    Token bucket that holds a sender to `rate` bytes per second, allowing bursts
+    of up to `burst` bytes. Tokens may go negative; the deficit is the wait.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, size):
+        """
+        Takes `size` bytes worth of tokens.
+
+        Returns:
+        - float: Seconds to wait before the bytes may be sent.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        return max(0.0, -self.tokens / self.rate)
+
+
+class DirectionStats:
+    """
+    Byte and impairment counters of one direction of a LinkProxy.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.chunks = 0
+        self.losses = 0
+        self.shaping_wait = 0.0
+
+    def __repr__(self):
+        return (f"DirectionStats(bytes={self.bytes}, chunks={self.chunks}, "
+                f"losses={self.losses}, shaping_wait={self.shaping_wait:.3f}s)")
+
+
+class LinkProxy:
+    """
+    asyncio TCP proxy that forwards every accepted connection to `target`
+    through an emulated link.
+
+    Parameters:
+    - target (tuple): (host, port) of the server.
+    - downlink (LinkProfile): Server-to-client direction.
+    - uplink (LinkProfile): Client-to-server direction.
+    - chunk_size (int): Largest read forwarded as one unit.
+    - seed (int): Seed of the jitter and loss random numbers, for repeatable runs.
+    """
+
+    def __init__(self, target, downlink, uplink, chunk_size=DEFAULT_CHUNK_SIZE, seed=None):
+        self.target = target
+        self.downlink = downlink
+        self.uplink = uplink
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.down_stats = DirectionStats()
+        self.up_stats = DirectionStats()
+        self.connections = 0
+
+    async def handle_connection(self, client_reader, client_writer):
+        self.connections += 1
+        peer = client_writer.get_extra_info('peername')
+        try:
+            server_reader, server_writer = await asyncio.open_connection(*self.target)
+        except OSError as e:
+            logging.error(f"Cannot reach {self.target} for {peer}: {e}")
+            client_writer.close()
+            return
+        for writer in (client_writer, server_writer):
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                # The proxy does its own shaping; Nagle would only add delay
+                framing.enable_nodelay(sock)
+        try:
+            await asyncio.gather(
+                self._pipe(client_reader, server_writer, self.uplink, self.up_stats),
+                self._pipe(server_reader, client_writer, self.downlink, self.down_stats))
+        except (ConnectionError, OSError) as e:
+            logging.info(f"Proxied connection from {peer} ended: {e}")
+        finally:
+            for writer in (client_writer, server_writer):
+                writer.close()
+
+    async def _pipe(self, reader, writer, profile, stats):
+        # Reading, shaping and delaying run here; writing runs in `deliver`, so a
+        # delayed chunk does not stop the next one from entering the link
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=QUEUE_CHUNKS)
+        bucket = TokenBucket(profile.rate, profile.burst) if profile.rate else None
+        read_size = min(self.chunk_size, profile.burst) if bucket else self.chunk_size
+
+        async def deliver():
+            error = None
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if error is not None:
+                    continue  # Keep draining so the reading side never blocks
+                due, chunk = item
+                wait = due - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    writer.write(chunk)
+                    await writer.drain()
+                except (ConnectionError, OSError) as e:
+                    error = e
+            if error is not None:
+                raise error
+            if writer.can_write_eof():
+                writer.write_eof()
+
+        delivery = asyncio.ensure_future(deliver())
+        last_due = 0.0
+        try:
+            while not delivery.done():
+                chunk = await reader.read(read_size)
+                if not chunk:
+                    break
+                if bucket is not None:
+                    wait = bucket.reserve(len(chunk))
+                    if wait:
+                        stats.shaping_wait += wait
+                        await asyncio.sleep(wait)
+                due = loop.time() + profile.delay
+                if profile.jitter:
+                    due += self.random.uniform(0, profile.jitter)
+                if profile.loss:
+                    segments = math.ceil(len(chunk) / MSS)
+                    if self.random.random() < 1 - (1 - profile.loss) ** segments:
+                        stats.losses += 1
+                        due += profile.retransmit_timeout()
+                last_due = max(due, last_due)
+                stats.bytes += len(chunk)
+                stats.chunks += 1
+                await queue.put((last_due, chunk))
+            if not delivery.done():
+                await queue.put(None)
+            await delivery
+        finally:
+            delivery.cancel()
+
+    async def start(self, host, port):
+        """
+        Starts listening.
+
+        Returns:
+        - asyncio.base_events.Server: The listening server.
+        """
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def serve_forever(self, host, port):
+        server = await self.start(host, port)
+        addresses = ', '.join(str(s.getsockname()) for s in server.sockets)
+        logging.info(f"Link proxy on {addresses} -> {self.target}: "
+                     f"down {self.downlink}, up {self.uplink}")
+        async with server:
+            await server.serve_forever()
+
+    def __repr__(self):
+        return (f"LinkProxy(target={self.target}, connections={self.connections}, "
+                f"down={self.down_stats}, up={self.up_stats})")
+
+
+def add_arguments(parser):
+    """
+    Adds the link emulation options to an argparse parser.
+    """
+    parser.add_argument('--link', default='100mbit',
+                        help=f'Link to emulate: a preset ({", ".join(LINK_PRESETS)}) or '
+                             'tc-style "rate=10mbit,delay=20ms,jitter=5ms,loss=0.1%%,burst=64k"; '
+                             '"DOWN/UP" shapes the two directions differently')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Largest number of bytes forwarded as one unit')
+    parser.add_argument('--link-seed', type=int, default=None,
+                        help='Seed for jitter and loss, for repeatable runs')
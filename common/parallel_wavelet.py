@@ -0,0 +1,264 @@
+import concurrent.futures
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pywt
+
+# Block-parallel `pywt.wavedec`/`waverec` for the fwt-haar codec. The signal is
+# split into blocks that a process pool transforms side by side. Input and output
+# live in shared memory: the workers attach to the segments by name and read and
+# write their slices in place, so no array is pickled.
+#
+# The Haar filters are two taps long. At every level a coefficient depends on one
+# pair of the level below, so a block that starts at a multiple of 2**level
+# decomposes exactly like that stretch of the whole signal. Its piece of band k
+# lands at `block start / 2**k` inside band k of the concatenated output. Only the
+# last block reaches the end of the signal, where 'symmetric' extension pads an
+# odd length; it gets the same padding the serial transform applies there. The
+# per-block arithmetic is the same as the serial path's, so the results are bit
+# for bit identical. Longer filters would need overlapping blocks and fall back
+# to the serial transform.
+MODE = 'symmetric'
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+# Below this many samples the pool's overhead outweighs the parallel speed-up
+MIN_PARALLEL_SIZE = 8 * 1024 * 1024
+
+_workers = 1
+_block_size = DEFAULT_BLOCK_SIZE
+_executor = None
+_lock = threading.Lock()
+
+
+def configure(workers=None, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Sets how many processes transform large signals in this process.
+
+    Parameters:
+    - workers (int): Pool size; None uses every CPU and 1 keeps the serial path.
+    - block_size (int): Samples per block; rounded down to whole decompositions.
+
+    Raises:
+    - ValueError: If `workers` or `block_size` is not positive.
+    """
+    global _workers, _block_size, _executor
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1 or block_size < 1:
+        raise ValueError(f"Workers and block size must be positive, got {workers}, {block_size}")
+    with _lock:
+        if _executor is not None and workers != _workers:
+            _executor.shutdown()
+            _executor = None
+        _workers = workers
+        _block_size = block_size
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ProcessPoolExecutor(max_workers=_workers)
+        return _executor
+
+
+def band_lengths(length, wavelet, level):
+    """
+    Band lengths of `pywt.wavedec(signal, wavelet, MODE, level)` for `length`
+    samples, approximation first.
+    """
+    filter_length = pywt.Wavelet(wavelet).dec_len
+    lengths = []
+    for _ in range(level):
+        length = pywt.dwt_coeff_len(length, filter_length, mode=MODE)
+        lengths.append(length)
+    return [lengths[-1]] + lengths[::-1]
+
+
+def _band_layout(length, wavelet, level):
+    # Offset of every band in the concatenated output, and the factor by which
+    # it is decimated relative to the signal
+    lengths = band_lengths(length, wavelet, level)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).tolist()
+    factors = [2 ** level] + [2 ** k for k in range(level, 0, -1)]
+    return offsets, factors, sum(lengths)
+
+
+def _blocks(length, level):
+    step = max(_block_size // 2 ** level, 1) * 2 ** level
+    blocks = [(start, min(start + step, length)) for start in range(0, length, step)]
+    if len(blocks) > 1 and blocks[-1][1] - blocks[-1][0] < step // 2:
+        # A short tail joins the block before it, so no block is too short for the level
+        blocks[-2:] = [(blocks[-2][0], length)]
+    return blocks
+
+
+def _parallel(length, wavelet, level):
+    return (_workers > 1 and length >= MIN_PARALLEL_SIZE and level > 0
+            and pywt.Wavelet(wavelet).dec_len == 2)
+
+
+def _forward_block(names, length, wavelet, level, start, stop):
+    source = shared_memory.SharedMemory(name=names[0])
+    target = shared_memory.SharedMemory(name=names[1])
+    try:
+        offsets, factors, total = _band_layout(length, wavelet, level)
+        signal = np.ndarray((length,), dtype=np.uint8, buffer=source.buf)
+        flat = np.ndarray((total,), dtype=np.float64, buffer=target.buf)
+        coeffs = pywt.wavedec(signal[start:stop], wavelet, mode=MODE, level=level)
+        for band, offset, factor in zip(coeffs, offsets, factors):
+            position = offset + start // factor
+            flat[position:position + band.size] = band
+        # The views must go before the segments can be closed
+        del signal, flat
+    finally:
+        source.close()
+        target.close()
+
+
+def _inverse_block(names, length, wavelet, level, start, stop):
+    source = shared_memory.SharedMemory(name=names[0])
+    target = shared_memory.SharedMemory(name=names[1])
+    try:
+        offsets, factors, total = _band_layout(length, wavelet, level)
+        flat = np.ndarray((total,), dtype=np.float64, buffer=source.buf)
+        signal = np.ndarray((length,), dtype=np.float64, buffer=target.buf)
+        coeffs = []
+        for band_length, offset, factor in zip(band_lengths(stop - start, wavelet, level),
+                                               offsets, factors):
+            position = offset + start // factor
+            coeffs.append(flat[position:position + band_length])
+        signal[start:stop] = pywt.waverec(coeffs, wavelet, mode=MODE)[:stop - start]
+        del flat, signal, coeffs
+    finally:
+        source.close()
+        target.close()
+
+
+def _run(function, source_array, output_dtype, output_size, length, wavelet, level):
+    source = shared_memory.SharedMemory(create=True, size=max(source_array.nbytes, 1))
+    target = shared_memory.SharedMemory(
+        create=True, size=max(output_size * np.dtype(output_dtype).itemsize, 1))
+    try:
+        np.ndarray(source_array.shape, source_array.dtype, buffer=source.buf)[...] = source_array
+        names = (source.name, target.name)
+        futures = [_get_executor().submit(function, names, length, wavelet, level, start, stop)
+                   for start, stop in _blocks(length, level)]
+        for future in futures:
+            future.result()
+        return np.ndarray((output_size,), output_dtype, buffer=target.buf).copy()
+    finally:
+        for segment in (source, target):
+            segment.close()
+            segment.unlink()
+
+
+def wavedec(data, wavelet, level):
+    """
+    `np.concatenate(pywt.wavedec(data, wavelet, level=level))` for uint8 samples,
+    block-parallel when the pool is configured and the signal is large enough.
+
+    Parameters:
+    - data (bytes-like): The uint8 samples.
+    - wavelet (str): Wavelet name; only two-tap wavelets run in parallel.
+    - level (int): Decomposition level.
+
+    Returns:
+    - np.ndarray: The float64 bands concatenated, approximation first.
+    """
+    signal = np.frombuffer(data, dtype=np.uint8)
+    if not _parallel(signal.size, wavelet, level):
+        return np.concatenate(pywt.wavedec(signal, wavelet, mode=MODE, level=level))
+    total = sum(band_lengths(signal.size, wavelet, level))
+    return _run(_forward_block, signal, np.float64, total, signal.size, wavelet, level)
+
+
+def waverec(flat, length, wavelet, level):
+    """
+    Inverse of `wavedec`: reconstructs `length` float64 samples from the
+    concatenated bands, block-parallel under the same conditions.
+
+    Parameters:
+    - flat (np.ndarray): The float64 bands, approximation first.
+    - length (int): Number of samples of the original signal.
+    - wavelet (str): Wavelet name.
+    - level (int): Decomposition level.
+
+    Returns:
+    - np.ndarray: The reconstructed signal.
+    """
+    if not _parallel(length, wavelet, level):
+        boundaries = np.cumsum(band_lengths(length, wavelet, level))[:-1]
+        return pywt.waverec(np.split(flat, boundaries), wavelet, mode=MODE)[:length]
+    return _run(_inverse_block, flat, np.float64, length, length, wavelet, level)
+
+
+def benchmark(size=64 * 1024 * 1024, workers=None, wavelet='haar', level=3, repeat=3, seed=0):
+    """
+    Compares the serial and the block-parallel transform.
+
+    Parameters:
+    - size (int): Number of uint8 samples to transform.
+    - workers (int): Pool size for the parallel runs; None uses every CPU.
+    - wavelet (str): Wavelet name.
+    - level (int): Decomposition level.
+    - repeat (int): Runs per measurement; the best one is reported.
+    - seed (int): Seed of the random test signal.
+
+    Returns:
+    - dict: Best forward/inverse seconds and MB/s of both paths, and whether the
+      parallel results were identical to the serial ones.
+    """
+    data = np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8)
+    previous = (_workers, _block_size)
+    results = {'size': size}
+    outputs = {}
+    try:
+        for name, pool_size in (('serial', 1), ('parallel', workers)):
+            configure(pool_size, previous[1])
+            results[f'{name}_workers'] = _workers
+            forward_times, inverse_times = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                flat = wavedec(data, wavelet, level)
+                transformed = time.perf_counter()
+                signal = waverec(flat, size, wavelet, level)
+                forward_times.append(transformed - start)
+                inverse_times.append(time.perf_counter() - transformed)
+            outputs[name] = (flat, signal)
+            results[f'{name}_forward_s'] = min(forward_times)
+            results[f'{name}_inverse_s'] = min(inverse_times)
+    finally:
+        configure(*previous)
+    results['identical'] = all(np.array_equal(serial, parallel) for serial, parallel
+                               in zip(outputs['serial'], outputs['parallel']))
+    megabytes = size / (1024 * 1024)
+    for key in ('serial_forward', 'serial_inverse', 'parallel_forward', 'parallel_inverse'):
+        results[f'{key}_mb_s'] = megabytes / max(results[f'{key}_s'], 1e-9)
+    return results
+
+
+def configure_from_arguments(args, pooled=False):
+    """
+    Configures the transform from parsed `add_arguments` options.
+
+    Parameters:
+    - args (argparse.Namespace): Parsed options.
+    - pooled (bool): Whether requests already run in a pool of one process per
+      CPU; the transform then stays serial unless --fwt-workers says otherwise.
+    """
+    workers = args.fwt_workers
+    if workers is None and pooled:
+        workers = 1
+    configure(workers)
+
+
+def add_arguments(parser):
+    """
+    Adds the --fwt-workers option to an argparse parser.
+    """
+    parser.add_argument('--fwt-workers', type=int, default=None,
+                        help='Processes for the block-parallel wavelet transform of large '
+                             'signals (default: one per CPU; 1 keeps it serial)')
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from common import datasets, payload_store
+
+# Cache of encoded responses, so repeated requests for the same object are served
+# at wire speed instead of generator/compressor speed. Entries are kept in memory
+# up to a byte budget and evicted least recently used first; with a spill
+# directory, evicted entries move to disk (up to their own budget) and are served
+# from there with sendfile.
+#
+# The key is the request itself minus the fields that only affect how a response
+# is delivered, so the dataset, size, codec and every codec parameter take part.
+TRANSPORT_FIELDS = frozenset(
+    {'stream', 'block_size', 'depth', 'workers', 'cache', 'report_error', 'request_id'})
+
+
+class CacheStats:
+    """
+    Hit/miss counters of a PayloadCache.
+
+    Attributes:
+    - hits (int): Requests served from memory.
+    - spill_hits (int): Requests served from the spill directory.
+    - misses (int): Requests that had to be encoded.
+    - evictions (int): Entries dropped from memory (spilled or discarded).
+    - spills (int): Entries written to the spill directory.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.spill_hits + self.misses
+        return (self.hits + self.spill_hits) / total if total else 0.0
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'spill_hits': self.spill_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'spills': self.spills,
+            'hit_ratio': round(self.hit_ratio, 4),
+        }
+
+    def __repr__(self):
+        return (f"CacheStats(hits={self.hits}, spill_hits={self.spill_hits}, "
+                f"misses={self.misses}, evictions={self.evictions}, "
+                f"spills={self.spills}, hit_ratio={self.hit_ratio:.2%})")
+
+
+class PayloadCache:
+    """
+    Thread-safe LRU cache of encoded responses with a byte budget.
+
+    Parameters:
+    - budget (int): Bytes of payload kept in memory.
+    - spill_dir (str): Optional directory evicted entries are written to.
+    - spill_budget (int): Bytes kept in the spill directory; None is unlimited.
+    """
+
+    def __init__(self, budget, spill_dir=None, spill_budget=None):
+        if budget < 0:
+            raise ValueError(f"Cache budget must not be negative, got {budget}")
+        self.budget = budget
+        self.spill_dir = spill_dir
+        self.spill_budget = spill_budget
+        self.stats = CacheStats()
+        self.size = 0
+        self.spill_size = 0
+        self._entries = OrderedDict()
+        self._spilled = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @staticmethod
+    def key(request):
+        """
+        Builds the cache key of a request.
+
+        Parameters:
+        - request (dict): The decoded request.
+
+        Returns:
+        - str: The key, or None if the request must not be cached (it is streamed
+          or sets `"cache": false`).
+        """
+        if request.get('stream') or request.get('cache') is False:
+            return None
+        fields = {name: value for name, value in request.items()
+                  if name not in TRANSPORT_FIELDS}
+        fields.setdefault('dataset', datasets.DEFAULT_DATASET)
+        fields.setdefault('seed', 0)
+        return json.dumps(fields, sort_keys=True, separators=(',', ':'))
+
+    def get(self, key):
+        """
+        Looks up an encoded response and marks it as recently used.
+
+        Returns:
+        - tuple: (codec id, raw length, payload, digests), or None on a miss. The payload
+          is a payload_store.FilePayload for entries served from the spill directory.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return entry
+            entry = self._spilled.get(key)
+            if entry is not None:
+                self._spilled.move_to_end(key)
+                self.stats.spill_hits += 1
+                return entry
+            self.stats.misses += 1
+            return None
+
+    def put(self, key, codec_id, raw_length, payload, digests=None):
+        """
+        Stores an encoded response and its block digests (framing.BlockDigests
+        or None), evicting least recently used entries as needed.
+
+        File-backed payloads are not cached (they already cost nothing to serve),
+        nor are payloads larger than the whole budget.
+        """
+        if isinstance(payload, payload_store.FilePayload):
+            return
+        size = memoryview(payload).nbytes
+        if size > self.budget:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (codec_id, raw_length, payload, digests)
+            self.size += size
+            while self.size > self.budget:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self.size -= memoryview(old_entry[2]).nbytes
+                self.stats.evictions += 1
+                if self.spill_dir:
+                    self._spill(old_key, old_entry)
+
+    def _spill(self, key, entry):
+        codec_id, raw_length, payload, digests = entry
+        size = memoryview(payload).nbytes
+        if key in self._spilled or (self.spill_budget is not None and size > self.spill_budget):
+            return
+        path = os.path.join(self.spill_dir,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest() + '.bin')
+        try:
+            with open(path, 'wb') as spill_file:
+                spill_file.write(payload)
+        except OSError as e:
+            logging.error(f"Could not spill cache entry to {path}: {e}")
+            return
+        checksum = zlib.crc32(payload) & 0xFFFFFFFF
+        self._spilled[key] = (codec_id, raw_length,
+                              payload_store.FilePayload(path, 0, size, checksum), digests)
+        self.spill_size += size
+        self.stats.spills += 1
+        while self.spill_budget is not None and self.spill_size > self.spill_budget:
+            _, (_, _, old, _) = self._spilled.popitem(last=False)
+            self.spill_size -= old.length
+            try:
+                os.remove(old.path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries) + len(self._spilled)
+
+
+def from_arguments(args):
+    """
+    Builds a PayloadCache from parsed `add_arguments` options.
+
+    Returns:
+    - PayloadCache: The cache, or None if `--cache-mb` is 0.
+    """
+    if not args.cache_mb:
+        return None
+    spill_budget = args.cache_spill_mb * 1024 * 1024 if args.cache_spill_mb else None
+    return PayloadCache(args.cache_mb * 1024 * 1024, args.cache_spill_dir, spill_budget)
+
+
+def add_arguments(parser):
+    """
+    Adds the cache options to a server's argparse parser.
+    """
+    parser.add_argument('--cache-mb', type=int, default=0,
+                        help='Memory budget of the encoded-payload cache in MB (0 disables it)')
+    parser.add_argument('--cache-spill-dir', default=None,
+                        help='Directory evicted cache entries are spilled to')
+    parser.add_argument('--cache-spill-mb', type=int, default=0,
+                        help='Disk budget of the spill directory in MB (0 is unlimited)')
@@ -0,0 +1,263 @@
+import os
+import threading
+import zlib
+
+from common import datasets
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# File-backed payloads. Instead of generating a fresh in-memory payload for every
+# request, a server can keep payloads (raw and pre-compressed) in files that are
+# created once, block by block, and sent with `socket.sendfile`. The kernel then
+# copies straight from the page cache to the socket, so the measurement covers
+# the network rather than the allocator and the data generator, and the server's
+# RSS does not grow with the request size.
+#
+# Files live in one directory, named after the dataset and seed:
+# `text-s7-<size>mb.bin` holds the raw data and `lz4-text-s7-<size>mb.bin` a
+# pre-encoded copy of it. Each file has a `.crc32` sidecar with the checksum that
+# goes into the frame header.
+SOURCES = ('memory', 'file')
+DEFAULT_DIRECTORY = 'payloads'
+# Read by worker processes too, so it works with fork and spawn alike
+PAYLOAD_DIR_ENV = 'NCA_PAYLOAD_DIR'
+WRITE_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class FilePayload:
+    """
+    A payload stored in a file, sent with `framing.send_file_frame`.
+
+    Plain attributes only, so it pickles cheaply back from a worker process.
+
+    Attributes:
+    - path (str): The file holding the payload.
+    - offset (int): Where the payload starts in the file.
+    - length (int): Payload size in bytes.
+    - checksum (int): CRC32 of the payload bytes.
+    """
+
+    __slots__ = ('path', 'offset', 'length', 'checksum')
+
+    def __init__(self, path, offset, length, checksum):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.checksum = checksum
+
+    def __repr__(self):
+        return (f"FilePayload(path={self.path!r}, offset={self.offset}, "
+                f"length={self.length}, checksum={self.checksum:#010x})")
+
+
+def read_range(payload, offset, length):
+    """
+    Reads part of a file-backed payload.
+
+    Parameters:
+    - payload (FilePayload): The payload.
+    - offset (int): First byte, relative to the payload.
+    - length (int): Number of bytes.
+
+    Returns:
+    - bytes: The bytes.
+    """
+    with open(payload.path, 'rb') as source:
+        source.seek(payload.offset + offset)
+        return source.read(length)
+
+
+class PayloadStore:
+    """
+    Creates payload files on first use and hands out FilePayloads for them.
+
+    Files are written to a temporary name and renamed into place, so concurrent
+    threads or processes asking for the same payload never see a partial file.
+
+    Parameters:
+    - directory (str): Where the payload files live; created if missing.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._checksums = {}
+
+    def path(self, name, size_in_mb):
+        return os.path.join(self.directory, f"{name}-{size_in_mb}mb.bin")
+
+    def raw(self, size_in_mb, dataset=datasets.DEFAULT_DATASET, seed=0):
+        """
+        Returns `size_in_mb` megabytes of a dataset, creating the file if needed.
+
+        Parameters:
+        - size_in_mb (int): The payload size in megabytes.
+        - dataset (str): One of datasets.DATASETS; 'random' by default.
+        - seed (int): The dataset seed.
+
+        Returns:
+        - FilePayload: The raw payload.
+        """
+        def write_dataset(destination):
+            size = size_in_mb * 1024 * 1024
+            for offset in range(0, size, WRITE_BLOCK_SIZE):
+                destination.write(datasets.generate_range(
+                    dataset, seed, offset, min(WRITE_BLOCK_SIZE, size - offset)))
+
+        name = datasets.payload_name(dataset, seed)
+        return self._get(self.path(name, size_in_mb), write_dataset)
+
+    def derived(self, name, size_in_mb, transform, dataset=datasets.DEFAULT_DATASET, seed=0):
+        """
+        Returns an encoded copy of a raw payload, creating it if needed.
+
+        Parameters:
+        - name (str): Name of the encoding, e.g. the codec name 'lz4'.
+        - size_in_mb (int): Size of the raw payload in megabytes.
+        - transform (callable): Called with (source file, destination file) opened
+          in binary mode; must stream the encoded raw payload into the destination.
+          It runs only when the file does not exist yet.
+        - dataset (str): Dataset of the raw payload.
+        - seed (int): The dataset seed.
+
+        Returns:
+        - FilePayload: The encoded payload.
+        """
+        source = self.raw(size_in_mb, dataset, seed)
+
+        def write_derived(destination):
+            with open(source.path, 'rb') as source_file:
+                transform(source_file, destination)
+
+        name = f"{name}-{datasets.payload_name(dataset, seed)}"
+        return self._get(self.path(name, size_in_mb), write_derived)
+
+    def _get(self, path, write):
+        with self._lock:
+            checksum = self._checksums.get(path)
+            if checksum is None:
+                checksum = self._read_checksum(path)
+            if checksum is None:
+                checksum = self._create(path, write)
+            self._checksums[path] = checksum
+        return FilePayload(path, 0, os.path.getsize(path), checksum)
+
+    @staticmethod
+    def _read_checksum(path):
+        try:
+            with open(path + '.crc32') as sidecar:
+                return int(sidecar.read(), 16)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _create(path, write):
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, 'wb') as destination:
+                write(destination)
+            checksum = file_checksum(temporary)
+            with open(temporary + '.crc32', 'w') as sidecar:
+                sidecar.write(f"{checksum:08x}")
+            # The sidecar goes into place first, so a payload file that exists
+            # always has its checksum next to it
+            os.replace(temporary + '.crc32', path + '.crc32')
+            os.replace(temporary, path)
+        finally:
+            for leftover in (temporary, temporary + '.crc32'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return checksum
+
+
+def file_checksum(path, block_size=WRITE_BLOCK_SIZE):
+    """
+    Computes the CRC32 of a file, reading it into one reused block buffer.
+
+    Returns:
+    - int: The checksum.
+    """
+    checksum = 0
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(path, 'rb') as source:
+        while True:
+            count = source.readinto(buffer)
+            if not count:
+                break
+            checksum = zlib.crc32(view[:count], checksum)
+    return checksum & 0xFFFFFFFF
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def configure(directory):
+    """
+    Selects the payload directory for this process and the worker processes it starts.
+
+    Parameters:
+    - directory (str): The payload directory.
+    """
+    os.environ[PAYLOAD_DIR_ENV] = os.path.abspath(directory)
+
+
+def get_store():
+    """
+    Returns the PayloadStore for the configured directory, shared by every thread.
+    """
+    directory = os.environ.get(PAYLOAD_DIR_ENV, DEFAULT_DIRECTORY)
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = _stores[directory] = PayloadStore(directory)
+        return store
+
+
+def request_source(request):
+    """
+    Extracts and validates the optional `source` of a request.
+
+    Parameters:
+    - request (dict): The decoded request.
+
+    Returns:
+    - str: 'memory' (generate per request, the default) or 'file'.
+
+    Raises:
+    - ValueError: If the source is unknown.
+    """
+    source = request.get('source', 'memory')
+    if source not in SOURCES:
+        raise ValueError(f"Unknown payload source {source!r}, expected one of {SOURCES}")
+    return source
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in megabytes, or None where unavailable.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def describe_peak_rss():
+    """Peak RSS formatted for log lines, e.g. 'peak RSS 42.0MB'."""
+    rss = peak_rss_mb()
+    return 'peak RSS unavailable' if rss is None else f"peak RSS {rss:.1f}MB"
+
+
+def add_arguments(parser):
+    """
+    Adds the --payload-dir option to a server's argparse parser.
+    """
+    parser.add_argument('--payload-dir', default=None,
+                        help='Directory of file-backed payloads for requests with '
+                             f'"source": "file" (default: ./{DEFAULT_DIRECTORY})')
@@ -0,0 +1,173 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# How many blocks may be in flight (being generated/encoded or waiting to be sent)
+DEFAULT_DEPTH = 4
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+MAX_DEPTH = 64
+MAX_WORKERS = 64
+
+
+class StageTimings:
+    """
+    Accumulated time spent in each pipeline stage for one response.
+
+    `generate` and `encode` are summed across worker threads, so with several
+    workers they can exceed the wall time. `send` is the time the consumer spent
+    between taking a block and asking for the next one, and `stall` is the time
+    it waited for a block that was not ready yet; a large stall means the
+    generate or encode stage bounds throughput, a small one means the network does.
+    """
+
+    def __init__(self):
+        self.generate = 0.0
+        self.encode = 0.0
+        self.send = 0.0
+        self.stall = 0.0
+        self.wall = 0.0
+        self.blocks = 0
+        self.raw_bytes = 0
+        self.encoded_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            setattr(self, stage, getattr(self, stage) + seconds)
+
+    def bottleneck(self):
+        """Name of the stage that bounds throughput: 'generate', 'encode' or 'send'."""
+        if self.stall <= self.send:
+            return 'send'
+        return 'generate' if self.generate > self.encode else 'encode'
+
+    def as_dict(self):
+        return {
+            'blocks': self.blocks,
+            'raw_bytes': self.raw_bytes,
+            'encoded_bytes': self.encoded_bytes,
+            'generate_s': round(self.generate, 6),
+            'encode_s': round(self.encode, 6),
+            'send_s': round(self.send, 6),
+            'stall_s': round(self.stall, 6),
+            'wall_s': round(self.wall, 6),
+            'bottleneck': self.bottleneck(),
+        }
+
+    def __repr__(self):
+        return (f"StageTimings(blocks={self.blocks}, generate={self.generate:.3f}s, "
+                f"encode={self.encode:.3f}s, send={self.send:.3f}s, "
+                f"stall={self.stall:.3f}s, wall={self.wall:.3f}s, "
+                f"bottleneck={self.bottleneck()})")
+
+
+def block_sizes(total_size, block_size):
+    """
+    Splits `total_size` bytes into consecutive blocks of at most `block_size` bytes.
+
+    Returns:
+    - list: The size of every block; the last one may be shorter.
+    """
+    full, rest = divmod(total_size, block_size)
+    return [block_size] * full + ([rest] if rest else [])
+
+
+def log_timings(timings):
+    logging.info(f"Pipeline finished: {timings}")
+
+
+def pipeline(sizes, produce, encode, depth=DEFAULT_DEPTH, workers=DEFAULT_WORKERS,
+             timings=None, report=log_timings):
+    """
+    Generates and encodes blocks on worker threads while the caller sends earlier ones.
+
+    Up to `depth` blocks are in flight at once, so block N+1 is being produced and
+    encoded while block N is on the wire. LZ4 and NumPy release the GIL, so
+    the worker threads run in parallel with the sending thread. Blocks are
+    yielded in order.
+
+    Parameters:
+    - sizes (list): Raw size of every block in bytes, see `block_sizes`.
+    - produce (callable): Called with (index, size) on a worker; returns the raw block.
+    - encode (callable): Called with the raw block on a worker; returns the encoded bytes.
+    - depth (int): Maximum number of blocks in flight.
+    - workers (int): Number of worker threads.
+    - timings (StageTimings): Optional, filled in as the pipeline runs.
+    - report (callable): Called with the final StageTimings once the pipeline ends.
+
+    Yields:
+    - bytes-like: The encoded blocks, in order.
+    """
+    if not 0 < depth <= MAX_DEPTH:
+        raise ValueError(f"Pipeline depth must be between 1 and {MAX_DEPTH}, got {depth}")
+    if not 0 < workers <= MAX_WORKERS:
+        raise ValueError(
+            f"Pipeline workers must be between 1 and {MAX_WORKERS}, got {workers}")
+    timings = timings if timings is not None else StageTimings()
+
+    def job(index, size):
+        start = time.perf_counter()
+        block = produce(index, size)
+        generated = time.perf_counter()
+        encoded = encode(block)
+        timings.add('generate', generated - start)
+        timings.add('encode', time.perf_counter() - generated)
+        return encoded
+
+    wall_start = time.perf_counter()
+    pending = deque()
+    next_index = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline') as pool:
+        try:
+            while pending or next_index < len(sizes):
+                while next_index < len(sizes) and len(pending) < depth:
+                    pending.append(pool.submit(job, next_index, sizes[next_index]))
+                    next_index += 1
+                waited = time.perf_counter()
+                encoded = pending.popleft().result()
+                taken = time.perf_counter()
+                timings.add('stall', taken - waited)
+                timings.blocks += 1
+                timings.raw_bytes += sizes[timings.blocks - 1]
+                timings.encoded_bytes += memoryview(encoded).nbytes
+                yield encoded
+                timings.add('send', time.perf_counter() - taken)
+        finally:
+            for future in pending:
+                future.cancel()
+            timings.wall = time.perf_counter() - wall_start
+            if report is not None:
+                report(timings)
+
+
+def request_pipeline_options(request):
+    """
+    Extracts and validates the optional pipeline settings of a streamed request.
+
+    Parameters:
+    - request (dict): The decoded request; reads `depth` and `workers`.
+
+    Returns:
+    - tuple: (depth, workers), or None if the request does not set `depth`.
+
+    Raises:
+    - ValueError: If either value is out of range.
+    """
+    if 'depth' not in request:
+        return None
+    try:
+        depth = int(request['depth'])
+        workers = int(request.get('workers', DEFAULT_WORKERS))
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"Invalid pipeline options depth={request.get('depth')!r}, "
+            f"workers={request.get('workers')!r}")
+    if not 0 < depth <= MAX_DEPTH:
+        raise ValueError(f"Pipeline depth must be between 1 and {MAX_DEPTH}, got {depth}")
+    if not 0 < workers <= MAX_WORKERS:
+        raise ValueError(
+            f"Pipeline workers must be between 1 and {MAX_WORKERS}, got {workers}")
+    return depth, workers
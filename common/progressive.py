@@ -0,0 +1,219 @@
+import numpy as np
+
+from common import codec_registry, framing, lifting, wavelet_container
+
+# Progressive wavelet streams. The 'fwt-lifting' container already holds its
+# bands coarse to fine: the approximation, then the details from the coarsest
+# level to the finest. A streamed 'fwt-lifting' response sends the container
+# header and then every band in order, in chunks of at most CHUNK_SIZE bytes.
+# The approximation of a level L transform is 1/2**L of the signal and goes out
+# first.
+#
+# ProgressiveDecoder scatters every band into the in-place lifting layout as it
+# completes and undoes one lifting level per detail band. After each band,
+# `signal[::2**level]` holds the approximation at the levels still missing: each
+# sample is the floor average of 2**level original samples. The last band gives
+# back the original bytes. Undoing the levels one at a time costs no more than
+# the one-shot inverse, so a consumer gets a preview after a fraction of the
+# transfer and the full signal at no extra cost.
+CHUNK_SIZE = 1024 * 1024
+WAVELET = 'haar-int'
+
+
+def chunks(parts, chunk_size=CHUNK_SIZE):
+    """
+    Splits the container buffers of FwtLiftingCodec.encode_parts into stream
+    chunks of at most `chunk_size` bytes, so no band waits for a larger one.
+
+    Yields:
+    - memoryview: The next chunk, without copying.
+    """
+    for part in parts:
+        view = memoryview(part).cast('B')
+        for start in range(0, view.nbytes, chunk_size):
+            yield view[start:start + chunk_size]
+
+
+class Refinement:
+    """
+    One reconstruction of a progressive response.
+
+    Attributes:
+    - level (int): Decomposition levels still missing; 0 for the whole signal.
+    - samples (np.ndarray): The signal at 1/2**level of the full resolution,
+      int16 for previews and the original uint8 samples for the final one.
+    - received (int): Payload bytes received so far.
+    - length (int): Number of samples of the whole signal.
+    """
+
+    def __init__(self, level, samples, received, length):
+        self.level = level
+        self.samples = samples
+        self.received = received
+        self.length = length
+
+    def expand(self):
+        """
+        The preview at full length, every sample repeated 2**level times.
+
+        Returns:
+        - np.ndarray: `length` samples.
+        """
+        if not self.level:
+            return self.samples
+        return np.repeat(self.samples, 1 << self.level)[:self.length]
+
+    def __repr__(self):
+        return (f"Refinement(level={self.level}, samples={len(self.samples)}, "
+                f"received={self.received})")
+
+
+class ProgressiveDecoder:
+    """
+    Rebuilds a signal from an 'fwt-lifting' container whose bytes arrive in
+    order, in pieces of any size.
+
+    Parameters:
+    - length (int): Number of samples of the signal, the raw length of the response.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.received = 0
+        self.level = None
+        self._header = bytearray()
+        self._signal = None
+        self._targets = None
+        self._staging = None
+        self._index = 0
+        self._filled = 0
+
+    @property
+    def done(self):
+        """Whether every band has arrived."""
+        return self._targets is not None and self._index == len(self._targets)
+
+    def feed(self, data):
+        """
+        Consumes the next piece of the container.
+
+        Parameters:
+        - data (bytes-like): The next bytes, e.g. one stream chunk.
+
+        Returns:
+        - list: A Refinement for every band this piece completed, coarse to fine.
+
+        Raises:
+        - wavelet_container.ContainerError: If the container is malformed, not
+          an 'fwt-lifting' container of `length` samples or longer than its bands.
+        """
+        view = memoryview(data).cast('B')
+        refinements = []
+        while view.nbytes:
+            if self._targets is None:
+                view = self._read_header(view)
+            elif self.done:
+                raise wavelet_container.ContainerError("Received more data than the bands hold")
+            else:
+                band = self._staging[:self._targets[self._index].size]
+                staging = memoryview(band).cast('B')
+                count = min(staging.nbytes - self._filled, view.nbytes)
+                staging[self._filled:self._filled + count] = view[:count]
+                self._filled += count
+                self.received += count
+                view = view[count:]
+                if self._filled == staging.nbytes:
+                    refinements.append(self._refine(band))
+            # Empty bands, e.g. of an empty signal, are complete without any data
+            while (self._targets is not None and not self.done
+                   and not self._targets[self._index].size):
+                refinements.append(self._refine(self._staging[:0]))
+        return refinements
+
+    def _read_header(self, view):
+        size = wavelet_container.CONTAINER_STRUCT.size
+        if len(self._header) >= size:
+            size = wavelet_container.header_size(wavelet_container.band_count(self._header))
+        count = min(size - len(self._header), view.nbytes)
+        self._header += view[:count]
+        self.received += count
+        if len(self._header) == size > wavelet_container.CONTAINER_STRUCT.size:
+            self._start()
+        return view[count:]
+
+    def _start(self):
+        name, dtype, lengths, _ = wavelet_container.decode_header(self._header)
+        if name != WAVELET or dtype != np.dtype('<i2'):
+            raise wavelet_container.ContainerError(
+                f"Expected int16 {WAVELET} bands, got {dtype} {name} bands")
+        self._signal = np.empty(self.length, dtype=np.int16)
+        targets = lifting.band_views(self._signal, len(lengths) - 1)
+        if [target.size for target in targets] != lengths:
+            raise wavelet_container.ContainerError(
+                f"Bands of {lengths} samples do not fit a signal of {self.length}")
+        self._targets = targets
+        # One staging array for every band; the bands are strided in the signal
+        self._staging = np.empty(max(lengths), dtype=np.int16)
+
+    def _refine(self, band):
+        self._targets[self._index][...] = band
+        if self._index == 0:
+            self.level = len(self._targets) - 1
+        else:
+            lifting.inverse(self._signal, self.level, self.level - 1)
+            self.level -= 1
+        self._index += 1
+        self._filled = 0
+        if self.level:
+            # A copy, since the next level is undone in place; all previews
+            # together hold fewer samples than the signal
+            samples = self._signal[::1 << self.level].copy()
+        else:
+            samples = self._signal.astype(np.uint8)
+        return Refinement(self.level, samples, self.received, self.length)
+
+
+def iter_refinements(sock, header, read_size=framing.RECV_CHUNK_SIZE):
+    """
+    Receives a progressive response and yields a refinement as soon as each band
+    has arrived.
+
+    A response that was not streamed, e.g. another codec or an error, is
+    received whole and yields one final refinement of its decoded data.
+
+    Parameters:
+    - sock (socket.socket): The connected socket, the response header already read.
+    - header (framing.FrameHeader): The response header.
+    - read_size (int): Largest single read from the socket, in bytes.
+
+    Yields:
+    - Refinement: Coarse to fine. The final one (level 0) comes after the
+      stream has ended, so its checksum is verified and `header.digests` is set.
+
+    Raises:
+    - framing.FrameError: If the server sent an error or the stream is incomplete
+      or corrupt.
+    - wavelet_container.ContainerError: If the bands are malformed.
+    """
+    if header.is_error or not header.is_stream:
+        payload = framing.recv_payload(sock, header, read_size)
+        if header.is_error:
+            raise framing.ServerError(
+                f"Server error: {bytes(payload).decode('utf-8', 'replace')}")
+        framing.verify_checksum(header, payload)
+        data = codec_registry.decode(header, payload)
+        yield Refinement(0, data, header.compressed_length, header.raw_length)
+        return
+    if header.codec_id != framing.CODEC_FWT_LIFTING:
+        raise framing.FrameError(f"A {header.codec_name} stream is not progressive")
+    decoder = ProgressiveDecoder(header.raw_length)
+    final = None
+    for chunk in framing.iter_stream(sock, header, read_size, reuse_buffer=True):
+        for refinement in decoder.feed(chunk):
+            if refinement.level:
+                yield refinement
+            else:
+                final = refinement
+    if final is None:
+        raise framing.FrameError("The stream ended before its last band")
+    yield final
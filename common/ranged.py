@@ -0,0 +1,233 @@
+import logging
+import os
+import time
+
+from common import codec_registry, framing, integrity, socket_tuning
+
+# Ranged and resumable transfers. An object is identified by its size in
+# megabytes, dataset and seed, and any request can ask for a slice of it with
+# `offset` and `length` in bytes (see server_core.request_range). The server
+# encodes only that slice with the requested codec.
+#
+# ResumableDownload fetches a whole object into a file as consecutive slices of
+# `piece_size` bytes. A slice is written only once it was received, passed the
+# frame checksum, decoded to the expected length and, with `verify`, matched
+# its block digests. The file therefore always holds a correct prefix of the
+# object. After a failed connection the download reconnects and continues from
+# the end of that prefix. If the client was stopped, running it again continues
+# from the file's size. At most one slice is fetched twice.
+DEFAULT_PIECE_SIZE = 8 * 1024 * 1024
+DEFAULT_RETRIES = 3
+RETRY_DELAY = 0.5
+MB = 1024 * 1024
+
+
+def fetch_range(client_socket, data_size, offset, length, buffer=None,
+                read_size=framing.RECV_CHUNK_SIZE, **options):
+    """
+    Fetches bytes `offset` to `offset + length` of an object.
+
+    Parameters:
+    - client_socket (socket.socket): A connected socket.
+    - data_size (int): The size of the whole object in megabytes.
+    - offset (int): First byte of the slice.
+    - length (int): Number of bytes in the slice.
+    - buffer (framing.ReceiveBuffer): Optional buffer the payload is received
+      into, reused across requests.
+    - read_size (int): Largest single read from the socket, in bytes.
+    - **options: Extra request fields, e.g. `codec`, `dataset` or `verify`.
+
+    Returns:
+    - tuple: A tuple containing:
+        - bytes-like: Exactly `length` decoded bytes. A view on `buffer` for
+          uncompressed slices, only valid until the buffer is used again.
+        - framing.FrameHeader: The response header.
+
+    Raises:
+    - framing.ServerError: If the server rejected the request, e.g. because the
+      slice lies outside the object.
+    - framing.FrameError: If the response is incomplete or corrupt, including a
+      digest mismatch with `verify` (integrity.IntegrityError).
+    - OSError: If the connection fails.
+    """
+    verifier = integrity.BlockVerifier() if options.get('verify') else None
+    framing.send_request(client_socket, data_size, offset=offset, length=length, **options)
+    socket_tuning.rearm(client_socket)
+    header, payload = framing.recv_frame(
+        client_socket, read_size, buffer,
+        on_header=verifier.expect if verifier is not None else None,
+        on_data=verifier.wire if verifier is not None else None)
+    framing.verify_checksum(header, payload)
+    decoded = codec_registry.decode(header, payload)
+    data = integrity.as_bytes(decoded)
+    if len(data) != length:
+        raise framing.FrameError(
+            f"Bytes {offset}+{length} decoded to {len(data)} bytes")
+    if verifier is not None:
+        verifier.check(header, decoded)
+    return data, header
+
+
+class ResumableDownload:
+    """
+    Downloads an object into a file as consecutive byte ranges over one
+    connection, resuming after a failed connection or an earlier interrupted run.
+
+    Parameters:
+    - host (str): Server address.
+    - port (int): Server port.
+    - data_size (int): The size of the object in megabytes.
+    - path (str): The file to download into. Its current contents are taken to
+      be the start of the object.
+    - piece_size (int): Bytes requested at a time; at most this much is fetched
+      again after an interruption.
+    - retries (int): Reconnections in a row before a failed connection is fatal.
+    - read_size (int): Largest single read from the socket, in bytes.
+
+    Attributes:
+    - completed (int): Bytes of the object in the file.
+    - resumed_at (int): Bytes that were already in the file when `run` started.
+    - connections (int): Connections opened by `run`.
+    - elapsed (float): Seconds spent in `run`, also when it failed.
+    """
+
+    def __init__(self, host, port, data_size, path, piece_size=DEFAULT_PIECE_SIZE,
+                 retries=DEFAULT_RETRIES, read_size=framing.RECV_CHUNK_SIZE):
+        if piece_size <= 0:
+            raise ValueError(f"Piece size must be positive, got {piece_size}")
+        self.host = host
+        self.port = port
+        self.data_size = data_size
+        self.total = data_size * MB
+        self.path = path
+        self.piece_size = piece_size
+        self.retries = retries
+        self.read_size = read_size
+        self.completed = 0
+        self.resumed_at = 0
+        self.connections = 0
+        self.elapsed = 0.0
+
+    def run(self, **options):
+        """
+        Fetches the rest of the object.
+
+        Parameters:
+        - **options: Extra request fields sent with every range, e.g. `codec`,
+          `dataset` or `verify`.
+
+        Returns:
+        - float: Seconds spent in this run.
+
+        Raises:
+        - ValueError: If the file is larger than the object.
+        - framing.ServerError: If the server rejected a request.
+        - framing.FrameError or OSError: If `retries` reconnections in a row failed.
+        """
+        start_time = time.perf_counter()
+        self.completed = self.resumed_at = (os.path.getsize(self.path)
+                                            if os.path.exists(self.path) else 0)
+        if self.completed > self.total:
+            raise ValueError(
+                f"{self.path} holds {self.completed} bytes, more than the "
+                f"{self.total} byte object")
+        buffer = framing.ReceiveBuffer()
+        client_socket = None
+        failures = 0
+        try:
+            with open(self.path, 'ab') as output:
+                while self.completed < self.total:
+                    length = min(self.piece_size, self.total - self.completed)
+                    try:
+                        if client_socket is None:
+                            client_socket = socket_tuning.connect(self.host, self.port)
+                            self.connections += 1
+                        data, _ = fetch_range(client_socket, self.data_size, self.completed,
+                                              length, buffer, self.read_size, **options)
+                    except framing.ServerError:
+                        raise
+                    except (framing.FrameError, OSError) as e:
+                        # A broken or corrupt response leaves the connection out of sync
+                        if client_socket is not None:
+                            client_socket.close()
+                            client_socket = None
+                        failures += 1
+                        if failures > self.retries:
+                            raise
+                        logging.warning(f"Range {self.completed}+{length} failed ({e}); "
+                                        f"retrying ({failures}/{self.retries})")
+                        time.sleep(RETRY_DELAY)
+                        continue
+                    failures = 0
+                    output.write(data)
+                    output.flush()
+                    self.completed += length
+        finally:
+            if client_socket is not None:
+                client_socket.close()
+            self.elapsed = time.perf_counter() - start_time
+        return self.elapsed
+
+    def describe(self, elapsed_time=None):
+        """
+        One line summarizing a run, for the clients' output; after a failed run
+        it tells how far the file got.
+        """
+        if elapsed_time is None:
+            elapsed_time = self.elapsed
+        fetched = self.completed - self.resumed_at
+        summary = (f"{self.path}: {self.completed} of {self.total} bytes, fetched "
+                   f"{fetched} in {elapsed_time:.2f}s ({fetched / MB / max(elapsed_time, 1e-9):.2f}MB/s) "
+                   f"over {self.connections} connection{'s' if self.connections != 1 else ''}")
+        if self.resumed_at:
+            summary += f", resumed at byte {self.resumed_at}"
+        return summary
+
+    def __repr__(self):
+        return (f"ResumableDownload(path={self.path!r}, completed={self.completed}, "
+                f"total={self.total})")
+
+
+def add_client_arguments(parser):
+    """
+    Adds the --offset, --length, --output and --piece-size options to a client's
+    argparse parser.
+    """
+    parser.add_argument('--offset', type=int, default=None,
+                        help='Request only the bytes from this offset of every object')
+    parser.add_argument('--length', type=int, default=None,
+                        help='Request only this many bytes of every object')
+    parser.add_argument('--output', default=None,
+                        help='Download the object into this file in byte ranges, '
+                             'resuming from its current size')
+    parser.add_argument('--piece-size', type=int, default=DEFAULT_PIECE_SIZE,
+                        help='Bytes per ranged request with --output')
+
+
+def output_path(path, data_size, sizes):
+    """
+    The --output file for one of several requested sizes: `path` itself for a
+    single size, otherwise the size is added to the file name, e.g.
+    `data-10MB.bin`.
+    """
+    if len(sizes) == 1:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-{data_size}MB{extension}"
+
+
+def is_ranged(args):
+    """Whether --offset, --length or --output was given."""
+    return args.offset is not None or args.length is not None or bool(args.output)
+
+
+def client_options(args):
+    """
+    Request fields for the --offset and --length options.
+    """
+    options = {}
+    if args.offset is not None:
+        options['offset'] = args.offset
+    if args.length is not None:
+        options['length'] = args.length
+    return options
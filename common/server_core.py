@@ -0,0 +1,365 @@
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from common import (adaptive, datasets, framing, payload_cache, payload_store,
+                    socket_tuning, timing)
+
+# How requests are executed:
+# - serial:  one connection at a time, encoding inline (the original behaviour)
+# - thread:  a pool of `workers` threads, each serving one connection; suits the
+#            I/O-bound baseline and codecs that release the GIL
+# - process: connections are served by threads, but encoding is handed to a pool
+#            of `workers` processes; suits CPU-bound LZ4 and wavelet encoding
+EXECUTION_MODES = ('serial', 'thread', 'process')
+
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_BACKLOG = 128
+MAX_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def default_workers(mode):
+    """
+    Picks a worker count for an execution mode based on the number of cores.
+
+    Parameters:
+    - mode (str): One of EXECUTION_MODES.
+
+    Returns:
+    - int: The default worker count.
+    """
+    cpus = os.cpu_count() or 1
+    if mode == 'process':
+        return cpus
+    if mode == 'thread':
+        return min(32, cpus + 4)
+    return 1
+
+
+def request_size_mb(request):
+    """
+    Extracts and validates the requested size from a decoded request.
+
+    Parameters:
+    - request (dict): The decoded request.
+
+    Returns:
+    - int: The requested size in megabytes.
+
+    Raises:
+    - ValueError: If the size is missing, not an integer or negative.
+    """
+    try:
+        data_size = int(request['size_mb'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid data size {request.get('size_mb')!r}")
+    if data_size < 0:
+        raise ValueError(f"Invalid data size {data_size}")
+    return data_size
+
+
+def is_ranged(request):
+    """
+    Whether a request asks for a byte range of its object (`offset`/`length`).
+    """
+    return 'offset' in request or 'length' in request
+
+
+def request_range(request, data_size):
+    """
+    Extracts and validates the optional byte range of a request. A striped
+    transfer requests `length` bytes from `offset` of the `size_mb` object on
+    each of its connections.
+
+    Parameters:
+    - request (dict): The decoded request.
+    - data_size (int): The size of the whole object in megabytes.
+
+    Returns:
+    - tuple: (offset, length) in bytes; the whole object if the request has no range.
+
+    Raises:
+    - ValueError: If the range is not made of integers or reaches past the object.
+    """
+    total = data_size * 1024 * 1024
+    try:
+        offset = int(request.get('offset', 0))
+        length = int(request.get('length', total - offset))
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"Invalid byte range offset={request.get('offset')!r}, length={request.get('length')!r}")
+    if offset < 0 or length < 0 or offset + length > total:
+        raise ValueError(
+            f"Byte range {offset}+{length} lies outside the {total} byte object")
+    return offset, length
+
+
+def request_block_size(request, default):
+    """
+    Extracts and validates the optional `block_size` of a streamed request.
+
+    Parameters:
+    - request (dict): The decoded request.
+    - default (int): Block size to use when the request does not set one.
+
+    Returns:
+    - int: The block size in bytes.
+
+    Raises:
+    - ValueError: If the block size is not a positive integer up to MAX_BLOCK_SIZE.
+    """
+    try:
+        block_size = int(request.get('block_size', default))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid block size {request.get('block_size')!r}")
+    if not 0 < block_size <= MAX_BLOCK_SIZE:
+        raise ValueError(
+            f"Block size must be between 1 and {MAX_BLOCK_SIZE} bytes, got {block_size}")
+    return block_size
+
+
+def handle_connection(connection, encode, stream_encode=None, cache=None, selector=None):
+    """
+    Serves framed requests on one connection until the client disconnects.
+
+    Parameters:
+    - connection (socket.socket): The accepted client socket.
+    - encode (callable): Called with each request dict and returns a tuple of
+      (codec id, raw length, payload, digests). A ValueError is reported to the
+      client as an error frame and the connection stays open. A
+      `payload_store.FilePayload` payload is sent with `sendfile`. `digests` is
+      a framing.BlockDigests sent after the payload, or None.
+    - stream_encode (callable): Optional. Called first with each request; returns
+      (codec id, raw length, iterable of chunks, digests) to stream the response
+      with `framing.send_stream`, or None to fall back to `encode`. It should
+      validate the request eagerly, since errors raised mid-stream drop the
+      connection.
+    - cache (payload_cache.PayloadCache): Optional. Responses from `encode` are
+      looked up here first and stored afterwards; hits carry FLAG_CACHED.
+    - selector (adaptive.AdaptiveSelector): Optional. Requests with
+      `"codec": "auto"` get the codec it picks, and their responses carry
+      FLAG_ADAPTIVE. It is fed the wire throughput of every whole-frame response.
+
+    Every request gets a timing.Span with the stages `encode` times and the
+    'encoded', 'first_byte_sent' and 'last_byte_sent' events.
+    """
+    while True:
+        request = framing.recv_request(connection)
+        if request is None:
+            break
+        span = timing.Span('server', request_id=request.get('request_id'),
+                           size_mb=request.get('size_mb'), codec=request.get('codec'))
+        flags = 0
+        try:
+            if selector is not None:
+                request, decision = selector.resolve(request)
+                if decision is not None:
+                    flags |= framing.FLAG_ADAPTIVE
+            elif adaptive.AdaptiveSelector.is_auto(request):
+                raise ValueError("This server was started without --adaptive")
+            stream = stream_encode(request) if stream_encode is not None else None
+            if stream is None:
+                key = cache.key(request) if cache is not None else None
+                entry = cache.get(key) if key is not None else None
+                if entry is not None:
+                    codec_id, raw_length, payload, digests = entry
+                    flags |= framing.FLAG_CACHED
+                else:
+                    (codec_id, raw_length, payload, digests), stages = \
+                        timing.collect(encode, request)
+                    span.stages.update(stages)
+                    if key is not None:
+                        cache.put(key, codec_id, raw_length, payload, digests)
+                span.mark('encoded')
+        except ValueError as e:
+            framing.send_error(connection, e)
+            span.finish(error=str(e))
+            continue
+        if stream is not None:
+            codec_id, raw_length, chunks, digests = stream
+            span.mark('first_byte_sent')  # The header goes out before the first chunk
+            header = framing.send_stream(connection, codec_id, raw_length,
+                                         _mark_first(chunks, span, 'first_chunk_encoded'),
+                                         flags=flags, digests=digests)
+        elif isinstance(payload, payload_store.FilePayload):
+            start_time = time.perf_counter()
+            span.mark('first_byte_sent')
+            header = framing.send_file_frame(connection, codec_id, raw_length, payload, flags,
+                                             digests)
+        else:
+            if digests is not None:
+                flags |= framing.FLAG_DIGESTS
+            # The checksum is computed before the clock starts, so only the wire is timed
+            header = framing.build_header(codec_id, raw_length, payload, flags)
+            start_time = time.perf_counter()
+            connection.sendall(header.pack())
+            span.mark('first_byte_sent')
+            connection.sendall(payload)
+            if digests is not None:
+                connection.sendall(digests.pack())
+        span.mark('last_byte_sent')
+        if selector is not None and stream is None:
+            selector.record_send(header.compressed_length, time.perf_counter() - start_time)
+        span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                    compressed_length=header.compressed_length, flags=header.flags)
+
+
+def _mark_first(chunks, span, name):
+    # Passes the chunks through, marking `name` on the span when the first arrives
+    for chunk in chunks:
+        span.mark(name)
+        yield chunk
+
+
+class ServerCore:
+    """
+    Accepts connections and serves framed requests with a selectable execution model.
+
+    Parameters:
+    - host (str): Address to bind to.
+    - port (int): Port to bind to; 0 picks a free port (see `address`).
+    - encode (callable): Module-level function taking a request dict and returning
+      (codec id, raw length, payload, digests). In process mode it must be picklable.
+    - mode (str): One of EXECUTION_MODES.
+    - workers (int): Worker threads (thread mode) or processes (process mode);
+      defaults to `default_workers(mode)`.
+    - max_connections (int): Concurrent connections served in process mode.
+    - backlog (int): Listen backlog.
+    - stream_encode (callable): Optional, see `handle_connection`. Streams are
+      produced in the connection's thread in every mode, so the codec should
+      release the GIL (LZ4 and NumPy do).
+    - cache (payload_cache.PayloadCache): Optional encoded-payload cache shared
+      by all connections; it lives in the server process in every mode.
+    - selector (adaptive.AdaptiveSelector): Optional, see `handle_connection`.
+      It also lives in the server process, so it sees every response.
+
+    The active socket_tuning profile is applied to the listening socket before
+    `listen` and to every accepted connection.
+    """
+
+    def __init__(self, host, port, encode, mode='thread', workers=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, backlog=DEFAULT_BACKLOG,
+                 stream_encode=None, cache=None, selector=None):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(
+                f"Unknown execution mode {mode!r}, expected one of {EXECUTION_MODES}")
+        self.encode = encode
+        self.stream_encode = stream_encode
+        self.cache = cache
+        self.selector = selector
+        self.mode = mode
+        self.workers = workers or default_workers(mode)
+        self.max_connections = max_connections
+        self._stopped = threading.Event()
+        self._connection_pool = None
+        self._encode_pool = None
+
+        self.server_socket = socket_tuning.listen(host, port, backlog)
+
+    @property
+    def address(self):
+        """The (host, port) the server is listening on."""
+        return self.server_socket.getsockname()
+
+    def _run_encode(self, request):
+        if self._encode_pool is None:
+            return self.encode(request)
+        # Bring the stages the worker timed back into this thread's span
+        result, stages = self._encode_pool.submit(timing.collect, self.encode, request).result()
+        timing.merge(stages)
+        return result
+
+    def _serve_client(self, connection, client_address):
+        logging.info(f"Connected by {client_address}")
+        try:
+            socket_tuning.tune_accepted(connection)
+            handle_connection(connection, self._run_encode, self.stream_encode,
+                              self.cache, self.selector)
+        except (framing.FrameError, OSError) as e:
+            if not self._stopped.is_set():
+                logging.error(f"Connection from {client_address} failed: {e}")
+        except Exception as e:
+            logging.exception(f"An error occurred with {client_address}: {e}")
+        finally:
+            connection.close()
+            logging.info(f"Connection from {client_address} closed")
+
+    def serve_forever(self):
+        """
+        Accepts and serves connections until `shutdown` is called.
+        """
+        if self.mode == 'thread':
+            self._connection_pool = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='conn')
+        elif self.mode == 'process':
+            self._encode_pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._connection_pool = ThreadPoolExecutor(
+                max_workers=self.max_connections, thread_name_prefix='conn')
+        logging.info(
+            f"Serving on {self.address} in {self.mode} mode with {self.workers} worker(s)")
+        try:
+            while not self._stopped.is_set():
+                try:
+                    connection, client_address = self.server_socket.accept()
+                except OSError:
+                    if self._stopped.is_set():
+                        break
+                    raise
+                if self._connection_pool is None:
+                    self._serve_client(connection, client_address)
+                else:
+                    self._connection_pool.submit(
+                        self._serve_client, connection, client_address)
+        finally:
+            self._shutdown_pools()
+
+    def shutdown(self):
+        """
+        Stops accepting connections. Safe to call from another thread.
+        """
+        self._stopped.set()
+        try:
+            self.server_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server_socket.close()
+
+    def _shutdown_pools(self):
+        if self._connection_pool is not None:
+            self._connection_pool.shutdown(wait=False, cancel_futures=True)
+        if self._encode_pool is not None:
+            self._encode_pool.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def add_server_arguments(parser, host, port, mode='thread'):
+    """
+    Adds the common server command line options to an argparse parser.
+
+    Parameters:
+    - parser (argparse.ArgumentParser): The parser to extend.
+    - host (str): Default bind address.
+    - port (int): Default port.
+    - mode (str): Default execution mode.
+    """
+    parser.add_argument('--host', default=host, help='Address to bind to')
+    parser.add_argument('--port', type=int, default=port,
+                        help='Port to listen on')
+    parser.add_argument('--mode', choices=EXECUTION_MODES, default=mode,
+                        help='Execution model for requests')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker threads/processes (default depends on the mode)')
+    payload_store.add_arguments(parser)
+    payload_cache.add_arguments(parser)
+    datasets.add_arguments(parser)
+    adaptive.add_arguments(parser)
+    socket_tuning.add_arguments(parser)
+    timing.add_arguments(parser)
@@ -0,0 +1,349 @@
+import argparse
+import logging
+import socket
+
+from common import units
+
+# Socket tuning profiles. A profile is a comma-separated list of options,
+# optionally starting with a preset name, e.g. 'bulk' or
+# 'sndbuf=4m,rcvbuf=4m,cc=bbr,notsent_lowat=128k':
+# - sndbuf, rcvbuf: SO_SNDBUF/SO_RCVBUF in bytes, 'buffers' sets both. Unset
+#   buffers are left to the kernel's autotuning, which setting them switches off.
+#   Linux doubles the value for bookkeeping and caps it at net.core.[rw]mem_max.
+# - nodelay / nodelay=0: TCP_NODELAY, on by default.
+# - quickack: TCP_QUICKACK. The kernel leaves quick-ack mode on its own, so the
+#   clients re-arm it before every response (`rearm`).
+# - notsent_lowat: TCP_NOTSENT_LOWAT, the unsent bytes above which a socket stops
+#   being writable.
+# - cc: TCP_CONGESTION, e.g. 'cubic' or 'bbr'.
+# - keepalive: SO_KEEPALIVE with TCP_KEEPIDLE in seconds; keepintvl and keepcnt
+#   set the probe interval and count.
+#
+# Every option takes effect at a particular point. Buffers and the congestion
+# control are set on a listening socket before `listen`, so every accepted socket
+# inherits them and the receive window scale is negotiated for the final buffer.
+# On a client they are set before `connect` for the same reason. The per-connection
+# flags go on connected sockets only: `apply_connected` runs on every accepted and
+# every connected socket.
+#
+# One profile is active per process (`configure`); the servers and clients apply
+# it to all their sockets. Options the platform lacks are skipped with a warning.
+PROFILE_PRESETS = {
+    'default': 'nodelay',
+    'latency': 'nodelay,quickack,notsent_lowat=16k',
+    'bulk': 'buffers=4m,notsent_lowat=1m',
+    'wan': 'buffers=16m,notsent_lowat=1m,cc=bbr',
+}
+# Buffer sizes the benchmark's sweep tries by default; 0 keeps autotuning
+SWEEP_BUFFER_SIZES = (0, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+_warned = set()
+
+
+def _option(name):
+    return getattr(socket, name, None)
+
+
+def _set(sock, level, name, value):
+    option = _option(name)
+    if option is None:
+        if name not in _warned:
+            _warned.add(name)
+            logging.warning(f"{name} is not supported on this platform; skipped")
+        return False
+    try:
+        sock.setsockopt(level, option, value)
+        return True
+    except OSError as e:
+        if name not in _warned:
+            _warned.add(name)
+            logging.warning(f"Cannot set {name}={value!r}: {e}")
+        return False
+
+
+def format_size(size):
+    """A byte count in the shortest exact k/m notation, e.g. 4m."""
+    for unit, factor in (('m', 1024 * 1024), ('k', 1024)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def _parse_flag(text):
+    if text.lower() in ('1', 'on', 'true', 'yes'):
+        return True
+    if text.lower() in ('0', 'off', 'false', 'no'):
+        return False
+    raise ValueError(f"Expected on or off, got {text!r}")
+
+
+class SocketProfile:
+    """
+    Socket options applied to every socket of a server or client.
+
+    Parameters:
+    - sndbuf (int): SO_SNDBUF in bytes; None leaves it to the kernel.
+    - rcvbuf (int): SO_RCVBUF in bytes; None leaves it to the kernel.
+    - nodelay (bool): TCP_NODELAY.
+    - quickack (bool): TCP_QUICKACK.
+    - notsent_lowat (int): TCP_NOTSENT_LOWAT in bytes; None leaves it unset.
+    - congestion (str): TCP_CONGESTION algorithm; None keeps the system default.
+    - keepalive (int): TCP_KEEPIDLE in seconds; None disables keepalive probes.
+    - keepintvl (int): TCP_KEEPINTVL in seconds.
+    - keepcnt (int): TCP_KEEPCNT.
+    """
+
+    def __init__(self, sndbuf=None, rcvbuf=None, nodelay=True, quickack=False,
+                 notsent_lowat=None, congestion=None, keepalive=None, keepintvl=None,
+                 keepcnt=None):
+        for name, value in (('sndbuf', sndbuf), ('rcvbuf', rcvbuf),
+                            ('notsent_lowat', notsent_lowat), ('keepalive', keepalive),
+                            ('keepintvl', keepintvl), ('keepcnt', keepcnt)):
+            if value is not None and value <= 0:
+                raise ValueError(f"{name} must be positive, got {value}")
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.nodelay = nodelay
+        self.quickack = quickack
+        self.notsent_lowat = notsent_lowat
+        self.congestion = congestion
+        self.keepalive = keepalive
+        self.keepintvl = keepintvl
+        self.keepcnt = keepcnt
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Builds a profile from a specification, see the module comment.
+
+        Raises:
+        - ValueError: If the specification is invalid.
+        """
+        values = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            key, _, value = (text.strip() for text in item.partition('='))
+            key = key.lower()
+            if not value and key in PROFILE_PRESETS:
+                values.update(cls.parse(PROFILE_PRESETS[key]).as_dict())
+            elif key == 'buffers':
+                values['sndbuf'] = values['rcvbuf'] = units.parse_size(value) or None
+            elif key in ('sndbuf', 'rcvbuf', 'notsent_lowat'):
+                values[key] = units.parse_size(value) or None
+            elif key in ('nodelay', 'quickack'):
+                values[key] = _parse_flag(value) if value else True
+            elif key in ('cc', 'congestion'):
+                if not value:
+                    raise ValueError("cc needs an algorithm, e.g. cc=cubic")
+                values['congestion'] = value
+            elif key in ('keepalive', 'keepintvl', 'keepcnt'):
+                values[key] = int(value) if value else None
+            else:
+                raise ValueError(f"Unknown socket option {item!r}, expected a preset "
+                                 f"({', '.join(PROFILE_PRESETS)}) or sndbuf, rcvbuf, buffers, "
+                                 "nodelay, quickack, notsent_lowat, cc, keepalive, keepintvl, "
+                                 "keepcnt")
+        return cls(**values)
+
+    def with_buffers(self, size):
+        """A copy of the profile with both buffers set to `size`; 0 unsets them."""
+        return SocketProfile(**dict(self.as_dict(), sndbuf=size or None, rcvbuf=size or None))
+
+    def _apply_buffers(self, sock):
+        if self.sndbuf is not None:
+            _set(sock, socket.SOL_SOCKET, 'SO_SNDBUF', self.sndbuf)
+        if self.rcvbuf is not None:
+            _set(sock, socket.SOL_SOCKET, 'SO_RCVBUF', self.rcvbuf)
+        if self.congestion is not None:
+            _set(sock, socket.IPPROTO_TCP, 'TCP_CONGESTION', self.congestion.encode())
+
+    def apply_listener(self, sock):
+        """
+        Applies the inherited options to a listening socket; call before `listen`.
+        """
+        self._apply_buffers(sock)
+
+    def apply_before_connect(self, sock):
+        """
+        Applies the options that must precede the handshake to a client socket.
+        """
+        self._apply_buffers(sock)
+
+    def apply_connected(self, sock):
+        """
+        Applies the per-connection options to an accepted or connected socket.
+        """
+        _set(sock, socket.IPPROTO_TCP, 'TCP_NODELAY', int(self.nodelay))
+        if self.quickack:
+            _set(sock, socket.IPPROTO_TCP, 'TCP_QUICKACK', 1)
+        if self.notsent_lowat is not None:
+            _set(sock, socket.IPPROTO_TCP, 'TCP_NOTSENT_LOWAT', self.notsent_lowat)
+        if self.keepalive is not None:
+            _set(sock, socket.SOL_SOCKET, 'SO_KEEPALIVE', 1)
+            _set(sock, socket.IPPROTO_TCP, 'TCP_KEEPIDLE', self.keepalive)
+            if self.keepintvl is not None:
+                _set(sock, socket.IPPROTO_TCP, 'TCP_KEEPINTVL', self.keepintvl)
+            if self.keepcnt is not None:
+                _set(sock, socket.IPPROTO_TCP, 'TCP_KEEPCNT', self.keepcnt)
+
+    def rearm(self, sock):
+        """
+        Re-enters quick-ack mode before a response is received, if enabled.
+        """
+        if self.quickack:
+            _set(sock, socket.IPPROTO_TCP, 'TCP_QUICKACK', 1)
+
+    def as_dict(self):
+        return {'sndbuf': self.sndbuf, 'rcvbuf': self.rcvbuf, 'nodelay': self.nodelay,
+                'quickack': self.quickack, 'notsent_lowat': self.notsent_lowat,
+                'congestion': self.congestion, 'keepalive': self.keepalive,
+                'keepintvl': self.keepintvl, 'keepcnt': self.keepcnt}
+
+    @property
+    def spec(self):
+        """The profile as a specification that `parse` turns back into it."""
+        items = []
+        for key, value in self.as_dict().items():
+            if key == 'nodelay':
+                items.append('nodelay' if value else 'nodelay=0')
+            elif value is True:
+                items.append(key)
+            elif key in ('sndbuf', 'rcvbuf', 'notsent_lowat') and value is not None:
+                items.append(f"{key}={format_size(value)}")
+            elif key == 'congestion' and value is not None:
+                items.append(f"cc={value}")
+            elif value not in (None, False):
+                items.append(f"{key}={value}")
+        return ','.join(items)
+
+    def __str__(self):
+        return self.spec
+
+    def __repr__(self):
+        return f"SocketProfile({self.spec!r})"
+
+
+def effective(sock):
+    """
+    Reads back the options a socket actually has, which may differ from the
+    profile: Linux doubles and caps buffer sizes.
+
+    Returns:
+    - dict: sndbuf, rcvbuf, nodelay and, where available, notsent_lowat and congestion.
+    """
+    values = {'sndbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+              'rcvbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+              'nodelay': bool(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))}
+    try:
+        if _option('TCP_NOTSENT_LOWAT') is not None:
+            values['notsent_lowat'] = sock.getsockopt(socket.IPPROTO_TCP,
+                                                      socket.TCP_NOTSENT_LOWAT)
+        if _option('TCP_CONGESTION') is not None:
+            values['congestion'] = sock.getsockopt(
+                socket.IPPROTO_TCP, socket.TCP_CONGESTION, 16).split(b'\0')[0].decode()
+    except OSError:
+        pass
+    return values
+
+
+def describe_effective(values):
+    """The `effective` values as one 'key=value,...' string, for result files."""
+    return ','.join(f"{key}={value}" for key, value in values.items())
+
+
+_active = SocketProfile()
+
+
+def configure(profile):
+    """
+    Makes `profile` the one applied to the sockets of this process.
+    """
+    global _active
+    _active = profile
+
+
+def active():
+    """The profile applied to the sockets of this process."""
+    return _active
+
+
+def listen(host, port, backlog):
+    """
+    Creates a listening socket with the active profile applied before `listen`.
+
+    Returns:
+    - socket.socket: The listening socket, with SO_REUSEADDR set.
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        _active.apply_listener(server_socket)
+        server_socket.bind((host, port))
+        server_socket.listen(backlog)
+    except OSError:
+        server_socket.close()
+        raise
+    return server_socket
+
+
+def connect(host, port, timeout=None):
+    """
+    Connects a client socket with the active profile: buffers and congestion
+    control before the handshake, the per-connection options after it.
+
+    Parameters:
+    - host (str): Server address.
+    - port (int): Server port.
+    - timeout (float): Optional connect timeout in seconds; the returned socket
+      is blocking either way.
+
+    Returns:
+    - socket.socket: The connected socket.
+    """
+    family, kind, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    client_socket = socket.socket(family, kind, proto)
+    try:
+        _active.apply_before_connect(client_socket)
+        client_socket.settimeout(timeout)
+        client_socket.connect(address)
+        client_socket.settimeout(None)
+        _active.apply_connected(client_socket)
+    except OSError:
+        client_socket.close()
+        raise
+    return client_socket
+
+
+def tune_accepted(sock):
+    """Applies the active profile's per-connection options to an accepted socket."""
+    _active.apply_connected(sock)
+
+
+def rearm(sock):
+    """Re-arms quick-ack mode on a client socket before it receives a response."""
+    _active.rearm(sock)
+
+
+def profile_argument(spec):
+    """argparse type for profile specifications."""
+    try:
+        return SocketProfile.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def configure_from_arguments(args):
+    """
+    Activates the profile of parsed `add_arguments` options.
+    """
+    configure(args.socket)
+
+
+def add_arguments(parser):
+    """
+    Adds the --socket option to an argparse parser.
+    """
+    parser.add_argument('--socket', type=profile_argument, default=SocketProfile(),
+                        help='Socket tuning profile: a preset '
+                             f'({", ".join(PROFILE_PRESETS)}) and/or options like '
+                             '"sndbuf=4m,rcvbuf=4m,quickack,notsent_lowat=128k,cc=bbr,'
+                             'keepalive=60" (see common/socket_tuning.py)')
@@ -0,0 +1,208 @@
+import concurrent.futures
+import time
+
+import numpy as np
+
+from common import codec_registry, framing, integrity, socket_tuning, timing
+
+# Striped transfers. One logical request for `size_mb` megabytes is split into N
+# byte ranges ("stripes"), and each goes over its own connection as a request with
+# `offset` and `length` (see server_core.request_range). The server compresses
+# every stripe independently with the requested codec. The client receives the
+# stripes in parallel and writes each one into its slice of one preallocated
+# output buffer. Uncompressed stripes are received straight into that slice;
+# encoded stripes are decoded first and then copied in. With `verify` every
+# stripe is checked against the block digests of its own range.
+#
+# N parallel TCP connections is what `iperf3 -P N` measures, so the same stripe
+# counts give numbers that can be compared with iperf3ReadMe.md. Every stripe
+# except the last is a multiple of STRIPE_ALIGNMENT bytes. That keeps block-based
+# codecs and wavelet decompositions (2**level samples) aligned.
+STRIPE_ALIGNMENT = 64 * 1024
+MAX_STRIPES = 64
+MB = 1024 * 1024
+
+
+def stripe_ranges(total, stripes, alignment=STRIPE_ALIGNMENT):
+    """
+    Splits `total` bytes into at most `stripes` contiguous byte ranges.
+
+    Parameters:
+    - total (int): Size of the whole object in bytes.
+    - stripes (int): Number of stripes wanted.
+    - alignment (int): Every range but the last is a multiple of this many bytes.
+
+    Returns:
+    - list: (offset, length) tuples covering the object in order. Fewer than
+      `stripes` when the object is too small for every stripe to get a range.
+
+    Raises:
+    - ValueError: If `stripes` is outside 1..MAX_STRIPES.
+    """
+    if not 1 <= stripes <= MAX_STRIPES:
+        raise ValueError(f"Stripes must be between 1 and {MAX_STRIPES}, got {stripes}")
+    units = -(-total // alignment)
+    per_stripe = -(-units // stripes) * alignment
+    return [(offset, min(per_stripe, total - offset))
+            for offset in range(0, total, per_stripe)] or [(0, 0)]
+
+
+class StripedClient:
+    """
+    Fetches objects as N byte-range stripes over N persistent connections.
+
+    Parameters:
+    - host (str): Server address.
+    - port (int): Server port.
+    - stripes (int): Number of parallel connections, like iperf3's `-P`.
+    - read_size (int): Largest single read from a socket, in bytes.
+    """
+
+    def __init__(self, host, port, stripes, read_size=framing.RECV_CHUNK_SIZE):
+        if not 1 <= stripes <= MAX_STRIPES:
+            raise ValueError(f"Stripes must be between 1 and {MAX_STRIPES}, got {stripes}")
+        self.stripes = stripes
+        self.read_size = read_size
+        self.output = framing.ReceiveBuffer()
+        # One reused receive buffer per connection for the encoded stripes
+        self._buffers = [framing.ReceiveBuffer() for _ in range(stripes)]
+        self.sockets = []
+        try:
+            for _ in range(stripes):
+                self.sockets.append(socket_tuning.connect(host, port))
+        except OSError:
+            self.close()
+            raise
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=stripes, thread_name_prefix='stripe')
+
+    def _fetch_stripe(self, index, data_size, offset, length, output, options):
+        client_socket = self.sockets[index]
+        span, options = timing.client_span(data_size, options)
+        framing.send_request(client_socket, data_size, offset=offset, length=length, **options)
+        span.mark('request_sent')
+        socket_tuning.rearm(client_socket)
+        verifier = integrity.BlockVerifier() if options.get('verify') else None
+        start_time = time.perf_counter()
+        header = framing.recv_header(client_socket)
+        span.mark('first_byte_received')
+        if verifier is not None:
+            verifier.expect(header)
+        target = output[offset:offset + length]
+        if (header.codec_id == framing.CODEC_RAW and not header.is_error
+                and not header.is_stream and header.compressed_length == length):
+            # Nothing to decode: receive straight into the output
+            framing.recv_exact_into(client_socket, target, self.read_size,
+                                    on_data=verifier.wire if verifier is not None else None)
+            framing.recv_digests(client_socket, header, self.read_size)
+            payload = target
+        else:
+            payload = framing.recv_payload(client_socket, header, self.read_size,
+                                           self._buffers[index])
+            if header.is_error:
+                raise framing.ServerError(
+                    f"Server error: {bytes(payload).decode('utf-8', 'replace')}")
+            if header.is_stream:
+                raise framing.FrameError("Stripes must not be streamed")
+        received_time = time.perf_counter()
+        span.mark('last_byte_received')
+        with span.stage('verify'):
+            framing.verify_checksum(header, payload)
+        if payload is not target:
+            with span.stage('decode'):
+                decoded = codec_registry.decode(header, payload)
+            data = integrity.as_bytes(decoded)
+            if len(data) != length:
+                raise framing.FrameError(
+                    f"Stripe {index} decoded to {len(data)} bytes, expected {length}")
+            target[:] = data
+        end_time = time.perf_counter()
+        if verifier is not None:
+            verifier.check(header, decoded if payload is not target else None)
+        span.finish(codec=header.codec_name, raw_length=header.raw_length,
+                    compressed_length=header.compressed_length, flags=header.flags,
+                    stripe=index, offset=offset)
+        return {'stripe': index, 'offset': offset, 'length': length,
+                'codec': header.codec_name, 'compressed_length': header.compressed_length,
+                'receive_seconds': received_time - start_time,
+                'decode_seconds': end_time - received_time,
+                'verify_seconds': verifier.seconds if verifier is not None else None}
+
+    def fetch(self, data_size, **options):
+        """
+        Fetches `data_size` megabytes as parallel stripes and reassembles them.
+
+        Parameters:
+        - data_size (int): The size of the whole object in megabytes.
+        - **options: Extra request fields sent with every stripe, e.g. `codec`,
+          `dataset` or `source`.
+
+        Returns:
+        - tuple: A tuple containing:
+            - np.ndarray: The object as uint8 samples, a view on the client's
+              output buffer that is only valid until the next fetch.
+            - float: Seconds from sending the first request until every stripe
+              was received and decoded.
+            - list: One dict per stripe with its range, codec, compressed length
+              and receive, decode and (with `verify`) verification times.
+
+        Raises:
+        - framing.FrameError: If a stripe fails or, with `verify`, does not match
+          its digests (integrity.IntegrityError); the server's error message is
+          included. The connections stay usable unless an OSError is raised.
+        - OSError: If a connection fails.
+        """
+        total = data_size * MB
+        ranges = stripe_ranges(total, self.stripes)
+        output = self.output.view(total)
+        start_time = time.perf_counter()
+        futures = [self._executor.submit(self._fetch_stripe, index, data_size,
+                                         offset, length, output, options)
+                   for index, (offset, length) in enumerate(ranges)]
+        # Wait for every stripe so no connection is still busy when this returns
+        concurrent.futures.wait(futures)
+        elapsed_time = time.perf_counter() - start_time
+        stripes = [future.result() for future in futures]
+        return np.frombuffer(output, dtype=np.uint8), elapsed_time, stripes
+
+    def close(self):
+        executor = getattr(self, '_executor', None)
+        if executor is not None:
+            executor.shutdown()
+        for client_socket in self.sockets:
+            client_socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"StripedClient(stripes={self.stripes})"
+
+
+def describe(data_size, elapsed_time, stripes):
+    """
+    One line summarizing a striped fetch, with the aggregate throughput that
+    corresponds to iperf3's SUM line.
+    """
+    wire_bytes = sum(stripe['compressed_length'] for stripe in stripes)
+    slowest = max(stripe['receive_seconds'] for stripe in stripes)
+    summary = (f"{len(stripes)} stripes: {data_size / elapsed_time:.2f}MB/s, "
+               f"{wire_bytes * 8 / elapsed_time / 1e6:.1f}Mbit/s on the wire, "
+               f"slowest stripe received in {slowest:.4f} sec")
+    verify_times = [stripe['verify_seconds'] for stripe in stripes
+                    if stripe['verify_seconds'] is not None]
+    if verify_times:
+        summary += f", verified in {sum(verify_times) * 1000:.1f}ms"
+    return summary
+
+
+def add_client_arguments(parser):
+    """
+    Adds the --stripes option to a client's argparse parser.
+    """
+    parser.add_argument('--stripes', type=int, default=1,
+                        help='Split every request into this many byte ranges fetched over '
+                             'parallel connections (compare with iperf3 -P)')
@@ -0,0 +1,207 @@
+import contextlib
+import json
+import threading
+import time
+import uuid
+
+# Per-request timing spans. A span records what happens to one request on one
+# side of the connection:
+# - events: points in time, as nanoseconds since the span started
+#   (time.perf_counter_ns), e.g. 'first_byte_sent' or 'last_byte_received';
+# - stages: durations of work such as 'generate', 'encode' or 'decode', with the
+#   CPU time of the thread that did it (time.thread_time_ns);
+# - cpu_ns: process CPU time over the whole span (time.process_time_ns). With
+#   concurrent requests this includes the work of other threads.
+#
+# Finished spans are written as JSON lines to the file given with `--trace`. The
+# client puts a random `request_id` into every traced request and the server
+# copies it, so the spans of both sides can be joined. Network time is then the
+# client's first_byte_received minus the server's time to its first_byte_sent.
+#
+# Encoders mark their stages with `with timing.stage('encode'):`. The stages go
+# to whichever `collect` call is active in the thread. That works in worker
+# processes too, because `collect` returns the stages with the result.
+_local = threading.local()
+_writer = None
+
+
+def new_request_id():
+    """A random id correlating the client and server spans of one request."""
+    return uuid.uuid4().hex[:16]
+
+
+def _add_stage(stages, name, wall_ns, cpu_ns):
+    # A stage that runs more than once, e.g. per block, accumulates
+    total = stages.setdefault(name, {'ns': 0, 'cpu_ns': 0})
+    total['ns'] += wall_ns
+    total['cpu_ns'] += cpu_ns
+
+
+@contextlib.contextmanager
+def _timed(stages, name):
+    start_ns = time.perf_counter_ns()
+    cpu_start_ns = time.thread_time_ns()
+    try:
+        yield
+    finally:
+        _add_stage(stages, name, time.perf_counter_ns() - start_ns,
+                   time.thread_time_ns() - cpu_start_ns)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the enclosed block as stage `name` of the request being collected in
+    this thread, see `collect`. Does nothing when no collection is active.
+    """
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        yield
+        return
+    with _timed(stages, name):
+        yield
+
+
+def collect(function, *args):
+    """
+    Calls `function(*args)` and collects the stages it times with `stage`.
+    Module-level, so it can be submitted to a process pool in place of `function`.
+
+    Returns:
+    - tuple: (result of the call, dict of stages).
+    """
+    previous = getattr(_local, 'stages', None)
+    _local.stages = {}
+    try:
+        result = function(*args)
+        return result, _local.stages
+    finally:
+        _local.stages = previous
+
+
+def merge(stages):
+    """
+    Adds stages collected elsewhere, e.g. in a worker process, to the collection
+    active in this thread.
+    """
+    active = getattr(_local, 'stages', None)
+    if active is None:
+        return
+    for name, totals in stages.items():
+        _add_stage(active, name, totals['ns'], totals['cpu_ns'])
+
+
+class Span:
+    """
+    The timing record of one request on one side of the connection.
+
+    Parameters:
+    - role (str): 'server' or 'client'.
+    - **attributes: Fields stored with the span, e.g. `request_id` and `size_mb`.
+    """
+
+    def __init__(self, role, **attributes):
+        self.role = role
+        self.attributes = attributes
+        self.events = {}
+        self.stages = {}
+        self.wall_ns = None
+        self.cpu_ns = None
+        self.start_ns = time.perf_counter_ns()
+        self._cpu_start_ns = time.process_time_ns()
+
+    def mark(self, name):
+        """Records event `name` now; the first time it is marked wins."""
+        self.events.setdefault(name, time.perf_counter_ns() - self.start_ns)
+
+    def stage(self, name):
+        """Context manager timing the enclosed block as stage `name`."""
+        return _timed(self.stages, name)
+
+    def finish(self, **attributes):
+        """
+        Stops the span's clocks, adds `attributes` and writes it to the trace.
+        """
+        self.wall_ns = time.perf_counter_ns() - self.start_ns
+        self.cpu_ns = time.process_time_ns() - self._cpu_start_ns
+        self.attributes.update(attributes)
+        emit(self)
+
+    def as_dict(self):
+        return {'role': self.role, **self.attributes, 'start_ns': self.start_ns,
+                'wall_ns': self.wall_ns, 'cpu_ns': self.cpu_ns,
+                'events': self.events, 'stages': self.stages}
+
+    def __repr__(self):
+        return f"Span({self.role!r}, {self.attributes}, events={self.events})"
+
+
+def client_span(data_size, options=None):
+    """
+    Starts the client span of a request. When tracing is enabled the request
+    gets a `request_id`, so the server's span of it can be found.
+
+    Parameters:
+    - data_size (int): The requested size in megabytes.
+    - options (dict): The extra request fields.
+
+    Returns:
+    - tuple: (Span, request fields to send).
+    """
+    options = dict(options or {})
+    if enabled():
+        options['request_id'] = new_request_id()
+    span = Span('client', request_id=options.get('request_id'), size_mb=data_size,
+                codec=options.get('codec'))
+    return span, options
+
+
+class TraceWriter:
+    """
+    Appends finished spans to a file, one JSON object per line. Thread-safe.
+
+    Parameters:
+    - path (str): The trace file; created if needed and appended to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, span):
+        line = json.dumps(span.as_dict(), separators=(',', ':'), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def configure(path):
+    """
+    Starts writing finished spans to `path`.
+    """
+    global _writer
+    if _writer is not None:
+        _writer.close()
+    _writer = TraceWriter(path)
+
+
+def enabled():
+    """Whether finished spans are written anywhere."""
+    return _writer is not None
+
+
+def emit(span):
+    if _writer is not None:
+        _writer.write(span)
+
+
+def add_arguments(parser):
+    """
+    Adds the --trace option to an argparse parser.
+    """
+    parser.add_argument('--trace', default=None,
+                        help='Append per-request timing spans to this file as JSON lines')
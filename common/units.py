@@ -0,0 +1,32 @@
+import re
+
+# Parsers for the quantities written on command lines and in specifications:
+# link rates and delays (common/netem.py) and buffer sizes (common/socket_tuning.py).
+# Rates use tc's units, where 'mbit' is megabits and 'mbps' megabytes per second.
+RATE_UNITS = {'bit': 1, 'kbit': 1e3, 'mbit': 1e6, 'gbit': 1e9,
+              'bps': 8, 'kbps': 8e3, 'mbps': 8e6, 'gbps': 8e9}
+TIME_UNITS = {'s': 1.0, 'ms': 1e-3, 'us': 1e-6}
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 * 1024, 'mb': 1024 * 1024}
+
+
+def _parse_quantity(text, units, default_unit, what):
+    match = re.fullmatch(r'([0-9]*\.?[0-9]+)\s*([a-z]*)', text.strip().lower())
+    if match is None or (match.group(2) or default_unit) not in units:
+        raise ValueError(f"Invalid {what} {text!r}, expected a number with one of "
+                         f"the units {sorted(unit for unit in units if unit)}")
+    return float(match.group(1)) * units[match.group(2) or default_unit]
+
+
+def parse_rate(text):
+    """Parses a rate like '100mbit' (tc units; 'mbps' is megabytes) into bytes per second."""
+    return _parse_quantity(text, RATE_UNITS, 'bit', 'rate') / 8
+
+
+def parse_time(text):
+    """Parses a duration like '20ms' into seconds; plain numbers are milliseconds."""
+    return _parse_quantity(text, TIME_UNITS, 'ms', 'time')
+
+
+def parse_size(text):
+    """Parses a size like '64k' into bytes."""
+    return int(_parse_quantity(text, SIZE_UNITS, '', 'size'))
@@ -0,0 +1,250 @@
+import math
+import struct
+import time
+import zlib
+
+import numpy as np
+import pywt
+
+# Lossy wavelet codec: decompose, threshold the detail bands, quantize every band
+# to small integers with a per-band step, then entropy code the (mostly zero)
+# result with DEFLATE. Unlike shipping raw float64 coefficients this actually
+# shrinks compressible data.
+#
+# Encoded layout:
+#   magic (4s) | version (B) | quantization code (B) | entropy code (B) |
+#   threshold mode code (B) | level (H) | band count (H) | wavelet name (16s) |
+#   original length (Q)
+#   per band: length (Q) | quantization step (d)
+#   entropy coded quantized bands, back to back
+CODEC_MAGIC = b'WVL1'
+CODEC_VERSION = 1
+CODEC_STRUCT = struct.Struct('!4sBBBBHH16sQ')
+BAND_STRUCT = struct.Struct('!Qd')
+
+QUANTIZATIONS = {'int8': (1, np.dtype('<i1')), 'int16': (2, np.dtype('<i2'))}
+ENTROPY_CODERS = {'none': 0, 'zlib': 1}
+THRESHOLD_MODES = {'hard': 1, 'soft': 2}
+# Wavelets are decomposed in periodization mode so the transform is not expansive:
+# n samples give exactly n coefficients.
+SIGNAL_MODE = 'periodization'
+
+
+class WaveletParams:
+    """
+    Parameters of the lossy wavelet codec.
+
+    Attributes:
+    - wavelet (str): Any discrete wavelet known to PyWavelets, e.g. 'haar', 'db4', 'bior2.2'.
+    - level (int): Decomposition level; None uses the maximum useful level.
+    - threshold (float): Detail coefficients with magnitude below this value are
+      zeroed (0 disables thresholding). The transform is orthonormal for the
+      orthogonal families, so the value is in the same units as the samples.
+    - threshold_mode (str): 'hard' zeroes small coefficients, 'soft' also shrinks the rest.
+    - quantization (str): 'int8' or 'int16'.
+    - entropy (str): 'zlib' (DEFLATE) or 'none'.
+    - zlib_level (int): DEFLATE compression level.
+    """
+
+    def __init__(self, wavelet='haar', level=None, threshold=4.0,
+                 threshold_mode='hard', quantization='int8', entropy='zlib',
+                 zlib_level=6):
+        try:
+            pywt.Wavelet(wavelet)
+        except ValueError:
+            raise ValueError(f"Unknown wavelet {wavelet!r}")
+        if len(wavelet.encode('ascii')) > 16:
+            raise ValueError(f"Wavelet name {wavelet!r} is too long")
+        if level is not None and not 0 < int(level) <= 32:
+            raise ValueError(f"Invalid decomposition level {level!r}")
+        if not 0 <= float(threshold) < math.inf:
+            raise ValueError(f"Threshold must be a non-negative number, got {threshold!r}")
+        if threshold_mode not in THRESHOLD_MODES:
+            raise ValueError(f"Unknown threshold mode {threshold_mode!r}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}")
+        if entropy not in ENTROPY_CODERS:
+            raise ValueError(f"Unknown entropy coder {entropy!r}")
+        self.wavelet = wavelet
+        self.level = None if level is None else int(level)
+        self.threshold = float(threshold)
+        self.threshold_mode = threshold_mode
+        self.quantization = quantization
+        self.entropy = entropy
+        self.zlib_level = int(zlib_level)
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Builds codec parameters from the optional fields of a request.
+
+        Raises:
+        - ValueError: If any field is invalid.
+        """
+        try:
+            return cls(wavelet=request.get('wavelet', 'haar'),
+                       level=request.get('level'),
+                       threshold=request.get('threshold', 4.0),
+                       threshold_mode=request.get('threshold_mode', 'hard'),
+                       quantization=request.get('quantization', 'int8'),
+                       entropy=request.get('entropy', 'zlib'),
+                       zlib_level=request.get('zlib_level', 6))
+        except (TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid wavelet codec parameters: {e}")
+
+    def as_dict(self):
+        return {
+            'wavelet': self.wavelet,
+            'level': self.level,
+            'threshold': self.threshold,
+            'threshold_mode': self.threshold_mode,
+            'quantization': self.quantization,
+            'entropy': self.entropy,
+            'zlib_level': self.zlib_level,
+        }
+
+
+def _decomposition_level(length, params):
+    max_level = pywt.dwt_max_level(length, pywt.Wavelet(params.wavelet).dec_len)
+    if params.level is None:
+        return max(max_level, 1)
+    return max(min(params.level, max_level), 1)
+
+
+def encode(data, params=None):
+    """
+    Compresses a byte signal with the lossy wavelet codec.
+
+    Parameters:
+    - data (bytes-like or np.ndarray): The samples; bytes are read as uint8.
+    - params (WaveletParams): Codec parameters; defaults to WaveletParams().
+
+    Returns:
+    - bytes: The encoded payload.
+    """
+    params = params or WaveletParams()
+    signal = np.frombuffer(data, dtype=np.uint8) \
+        if not isinstance(data, np.ndarray) else data
+    if signal.size == 0:
+        raise ValueError("Cannot encode an empty signal")
+    level = _decomposition_level(signal.size, params)
+    # Centre the bytes on zero so the approximation band quantizes symmetrically
+    coeffs = pywt.wavedec(signal.astype(np.float32) - 128.0, params.wavelet,
+                          mode=SIGNAL_MODE, level=level)
+
+    quant_code, quant_dtype = QUANTIZATIONS[params.quantization]
+    qmax = np.iinfo(quant_dtype).max
+    band_table = bytearray()
+    quantized = []
+    for index, band in enumerate(coeffs):
+        peak = float(np.max(np.abs(band))) if band.size else 0.0
+        if index > 0 and params.threshold > 0 and peak > 0:
+            band = pywt.threshold(band, params.threshold,
+                                  mode=params.threshold_mode)
+            peak = float(np.max(np.abs(band)))
+        step = peak / qmax if peak > 0 else 1.0
+        quantized.append(np.rint(band / step).astype(quant_dtype))
+        band_table += BAND_STRUCT.pack(band.size, step)
+
+    body = np.concatenate(quantized).tobytes()
+    if params.entropy == 'zlib':
+        body = zlib.compress(body, params.zlib_level)
+
+    header = CODEC_STRUCT.pack(
+        CODEC_MAGIC, CODEC_VERSION, quant_code, ENTROPY_CODERS[params.entropy],
+        THRESHOLD_MODES[params.threshold_mode], level, len(coeffs),
+        params.wavelet.encode('ascii'), signal.size)
+    return header + bytes(band_table) + body
+
+
+def decode(payload):
+    """
+    Reconstructs the signal from a payload produced by `encode`.
+
+    Parameters:
+    - payload (bytes-like): The encoded payload.
+
+    Returns:
+    - np.ndarray: The reconstructed samples as uint8.
+
+    Raises:
+    - ValueError: If the payload is malformed.
+    """
+    view = memoryview(payload).cast('B')
+    if view.nbytes < CODEC_STRUCT.size:
+        raise ValueError("Wavelet payload is shorter than its header")
+    (magic, version, quant_code, entropy_code, _, level, band_count,
+     wavelet, length) = CODEC_STRUCT.unpack_from(view)
+    if magic != CODEC_MAGIC or version != CODEC_VERSION:
+        raise ValueError(f"Not a version {CODEC_VERSION} wavelet payload")
+    quant_dtype = {code: dtype for code, dtype in QUANTIZATIONS.values()}.get(quant_code)
+    if quant_dtype is None:
+        raise ValueError(f"Unknown quantization code {quant_code}")
+    wavelet = wavelet.rstrip(b'\0').decode('ascii')
+
+    offset = CODEC_STRUCT.size
+    bands = []
+    for _ in range(band_count):
+        band_length, step = BAND_STRUCT.unpack_from(view, offset)
+        bands.append((band_length, step))
+        offset += BAND_STRUCT.size
+
+    body = view[offset:]
+    if entropy_code == ENTROPY_CODERS['zlib']:
+        body = zlib.decompress(body)
+    elif entropy_code != ENTROPY_CODERS['none']:
+        raise ValueError(f"Unknown entropy coder code {entropy_code}")
+    values = np.frombuffer(body, dtype=quant_dtype)
+    if values.size != sum(band_length for band_length, _ in bands):
+        raise ValueError("Wavelet payload band table does not match its data")
+
+    coeffs = []
+    position = 0
+    for band_length, step in bands:
+        coeffs.append(values[position:position + band_length].astype(np.float32) * step)
+        position += band_length
+    signal = pywt.waverec(coeffs, wavelet, mode=SIGNAL_MODE)[:length]
+    return np.clip(np.rint(signal + 128.0), 0, 255).astype(np.uint8)
+
+
+def mse(original, reconstructed):
+    """Mean squared error between two equally sized sample arrays."""
+    original = np.frombuffer(original, dtype=np.uint8) \
+        if not isinstance(original, np.ndarray) else original
+    difference = original.astype(np.float64) - reconstructed.astype(np.float64)
+    return float(np.mean(difference * difference))
+
+
+def psnr(original, reconstructed, peak=255.0):
+    """Peak signal-to-noise ratio in dB; infinite for a perfect reconstruction."""
+    error = mse(original, reconstructed)
+    return math.inf if error == 0 else 10.0 * math.log10(peak * peak / error)
+
+
+def evaluate(data, params=None):
+    """
+    Encodes and decodes `data` once and reports size and quality.
+
+    Parameters:
+    - data (bytes-like): The samples to compress.
+    - params (WaveletParams): Codec parameters.
+
+    Returns:
+    - dict: raw_bytes, encoded_bytes, compression_ratio, mse, psnr_db,
+      encode_s and decode_s.
+    """
+    start = time.perf_counter()
+    payload = encode(data, params)
+    encoded = time.perf_counter()
+    reconstructed = decode(payload)
+    decoded = time.perf_counter()
+    raw_bytes = memoryview(data).nbytes
+    return {
+        'raw_bytes': raw_bytes,
+        'encoded_bytes': len(payload),
+        'compression_ratio': raw_bytes / len(payload),
+        'mse': mse(data, reconstructed),
+        'psnr_db': psnr(data, reconstructed),
+        'encode_s': encoded - start,
+        'decode_s': decoded - encoded,
+    }
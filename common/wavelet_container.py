@@ -0,0 +1,166 @@
+import struct
+
+import numpy as np
+
+# Binary container for a list of wavelet coefficient bands, replacing pickle.
+#   magic (4s) | version (B) | dtype code (B) | band count (H) | wavelet name (16s)
+#   band lengths (band count x Q, in elements)
+#   band data: the raw little-endian values of every band, back to back
+# The bands can be sent straight from the arrays with scatter-gather I/O and
+# decoded as zero-copy NumPy views on the receive buffer.
+CONTAINER_MAGIC = b'WVC1'
+CONTAINER_VERSION = 1
+CONTAINER_STRUCT = struct.Struct('!4sBBH16s')
+BAND_LENGTH_STRUCT = struct.Struct('!Q')
+MAX_BANDS = 256
+
+DTYPE_CODES = {
+    1: np.dtype('<f8'),
+    2: np.dtype('<f4'),
+    3: np.dtype('<i2'),
+    4: np.dtype('<i4'),
+    5: np.dtype('<i1'),
+    6: np.dtype('<i8'),
+}
+DTYPE_IDS = {dtype: code for code, dtype in DTYPE_CODES.items()}
+
+
+class ContainerError(ValueError):
+    """Raised when a wavelet container is malformed."""
+
+
+def dtype_code(dtype):
+    """
+    Looks up the container code of a NumPy dtype.
+
+    Parameters:
+    - dtype (np.dtype): The coefficient dtype.
+
+    Returns:
+    - int: The code stored in the container header.
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+    try:
+        return DTYPE_IDS[dtype]
+    except KeyError:
+        raise ContainerError(f"Unsupported coefficient dtype {dtype}")
+
+
+def header_size(band_count):
+    """Size in bytes of the container header for `band_count` bands."""
+    return CONTAINER_STRUCT.size + band_count * BAND_LENGTH_STRUCT.size
+
+
+def encode_parts(coeffs, wavelet='haar'):
+    """
+    Encodes coefficient bands as a list of buffers without copying the band data.
+
+    Parameters:
+    - coeffs (list): The bands as returned by `pywt.wavedec`; all must share one dtype.
+    - wavelet (str): Name of the wavelet, stored so the receiver can call `waverec`.
+
+    Returns:
+    - list: The header bytes followed by one memoryview per band, ready for
+      `framing.sendall_parts` / `framing.send_frame_parts`.
+    """
+    if not coeffs:
+        raise ContainerError("No coefficient bands to encode")
+    if len(coeffs) > MAX_BANDS:
+        raise ContainerError(f"Too many bands: {len(coeffs)}")
+    dtype = np.dtype(coeffs[0].dtype).newbyteorder('<')
+    code = dtype_code(dtype)
+    name = wavelet.encode('ascii')
+    if len(name) > 16:
+        raise ContainerError(f"Wavelet name {wavelet!r} is longer than 16 bytes")
+
+    bands = []
+    for band in coeffs:
+        band = np.ascontiguousarray(band, dtype=dtype)
+        if band.ndim != 1:
+            raise ContainerError("Only one-dimensional bands are supported")
+        bands.append(band)
+
+    header = bytearray(CONTAINER_STRUCT.pack(
+        CONTAINER_MAGIC, CONTAINER_VERSION, code, len(bands), name))
+    for band in bands:
+        header += BAND_LENGTH_STRUCT.pack(band.size)
+    return [bytes(header)] + [memoryview(band).cast('B') for band in bands]
+
+
+def encoded_size(parts):
+    """Total size in bytes of the buffers returned by `encode_parts`."""
+    return sum(memoryview(part).nbytes for part in parts)
+
+
+def band_count(prefix):
+    """
+    Reads the band count from the first CONTAINER_STRUCT.size bytes of a
+    container, so a receiver knows how long the whole header is (`header_size`).
+
+    Raises:
+    - ContainerError: If the prefix is not the start of a valid container.
+    """
+    view = memoryview(prefix).cast('B')
+    if view.nbytes < CONTAINER_STRUCT.size:
+        raise ContainerError("Container is shorter than its header")
+    magic, version, code, count, _ = CONTAINER_STRUCT.unpack_from(view)
+    if magic != CONTAINER_MAGIC:
+        raise ContainerError(f"Bad container magic {magic!r}")
+    if version != CONTAINER_VERSION:
+        raise ContainerError(f"Unsupported container version {version}")
+    if code not in DTYPE_CODES:
+        raise ContainerError(f"Unknown dtype code {code}")
+    if not 1 <= count <= MAX_BANDS:
+        raise ContainerError(f"Invalid band count {count}")
+    return count
+
+
+def decode_header(buffer):
+    """
+    Decodes the header and band table at the start of a container; the band
+    data need not have arrived yet.
+
+    Returns:
+    - tuple: (wavelet name, np.dtype of the bands, list of band lengths in
+      elements, offset of the first band in bytes).
+
+    Raises:
+    - ContainerError: If the header is malformed or truncated.
+    """
+    view = memoryview(buffer).cast('B')
+    count = band_count(view)
+    _, _, code, _, name = CONTAINER_STRUCT.unpack_from(view)
+    offset = header_size(count)
+    if view.nbytes < offset:
+        raise ContainerError("Container is shorter than its band table")
+    lengths = [BAND_LENGTH_STRUCT.unpack_from(view, CONTAINER_STRUCT.size + i * BAND_LENGTH_STRUCT.size)[0]
+               for i in range(count)]
+    return name.rstrip(b'\0').decode('ascii'), DTYPE_CODES[code], lengths, offset
+
+
+def decode(buffer):
+    """
+    Decodes a container into NumPy views on `buffer` (no copy is made).
+
+    Parameters:
+    - buffer (bytes-like): The whole container, e.g. a preallocated receive buffer.
+      The returned arrays stay valid only as long as the buffer is not reused.
+
+    Returns:
+    - tuple: (wavelet name, list of np.ndarray bands).
+
+    Raises:
+    - ContainerError: If the container is malformed or truncated.
+    """
+    view = memoryview(buffer).cast('B')
+    name, dtype, lengths, offset = decode_header(view)
+    if offset + sum(lengths) * dtype.itemsize != view.nbytes:
+        raise ContainerError(
+            f"Container holds {view.nbytes} bytes, band table describes "
+            f"{offset + sum(lengths) * dtype.itemsize}")
+
+    bands = []
+    for length in lengths:
+        bands.append(np.frombuffer(view, dtype=dtype, count=length, offset=offset))
+        offset += length * dtype.itemsize
+    return name, bands
@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import loadgen  # noqa: E402
+
+
+def main():
+    """
+    Offers open-loop load to a phase server: requests from `--mix` at every rate
+    of `--rates`, with Poisson or constant arrivals, over `--connections`
+    persistent connections.
+
+    Latency is measured from each request's intended send time, so queueing
+    behind a slow server counts. Every step prints its throughput and latency
+    percentiles per `--interval` and in total; the run ends with the highest
+    rate the server sustained, per codec with `--each-codec`.
+    """
+    parser = argparse.ArgumentParser(description='Open-loop load generator')
+    loadgen.add_arguments(parser)
+    args = parser.parse_args()
+    if args.server is None and not args.port:
+        parser.error('--port is required unless --server starts one')
+    if args.connections < 1:
+        parser.error('--connections must be positive')
+    if any(rate <= 0 for rate in args.rates) or args.duration <= 0 or args.interval <= 0:
+        parser.error('--rates, --duration and --interval must be positive')
+    loadgen.run_from_arguments(args)
+
+
+if __name__ == '__main__':
+    main()
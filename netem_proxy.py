@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+import os
+import sys
+
+# Make the shared protocol package at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import netem  # noqa: E402
+
+
+def main():
+    """
+    Runs a TCP proxy that emulates a constrained link between a client and a
+    server, so localhost runs show the bandwidth, latency and loss trade-offs of
+    the codecs without root or tc.
+
+    Example: `python3 netem_proxy.py --port 6000 --target 127.0.0.1:5000 --link 10mbit`
+    and point the client at port 6000.
+    """
+    parser = argparse.ArgumentParser(description='Link emulation proxy')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=6000, help='Port to listen on')
+    parser.add_argument('--target', default='127.0.0.1:5000',
+                        help='Server to forward to, as host:port')
+    netem.add_arguments(parser)
+    args = parser.parse_args()
+
+    target_host, _, target_port = args.target.rpartition(':')
+    try:
+        downlink, uplink = netem.parse_link(args.link)
+        target = (target_host or '127.0.0.1', int(target_port))
+    except ValueError as e:
+        parser.error(str(e))
+    proxy = netem.LinkProxy(target, downlink, uplink, args.chunk_size, args.link_seed)
+    print(f"Link proxy on {args.host}:{args.port} -> {args.target}, "
+          f"down {downlink}, up {uplink}")
+    try:
+        asyncio.run(proxy.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Proxy is shutting down.")
+    finally:
+        print(proxy)
+
+
+if __name__ == '__main__':
+    main()